@@ -5,7 +5,7 @@ from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.forms import ReadOnlyPasswordHashField
 from django.core.exceptions import ValidationError
 
-from .models import User, Post, Subscription, Like
+from .models import User, Post, Subscription, Like, EmailJob
 
 
 class UserCreationForm(forms.ModelForm):
@@ -88,11 +88,17 @@ class LikeAdmin(admin.ModelAdmin):
     list_display = ('id', 'post_id', 'user_id')
 
 
+class EmailJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'to', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+
+
 # Now register the new UserAdmin...
 admin.site.register(User, UserAdmin)
 admin.site.register(Post, PostAdmin)
 admin.site.register(Subscription, SubscriptionAdmin)
 admin.site.register(Like, LikeAdmin)
+admin.site.register(EmailJob, EmailJobAdmin)
 # ... and, since we're not using Django's built-in permissions,
 # unregister the Group model from admin.
 admin.site.unregister(Group)
@@ -0,0 +1,43 @@
+"""Async variants of the hot JSON endpoints.
+
+Under ASGI Django runs every sync view on one shared thread, so a request waiting
+for MySQL or Cloudinary holds up all the others. These variants keep the event loop
+free and run the sync view, with its ORM work and rendering, in a bounded thread pool.
+The pool size also caps the number of database connections they hold.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import wraps
+
+from django.conf import settings
+from django.db import close_old_connections
+
+executor = ThreadPoolExecutor(max_workers=getattr(settings, 'ASYNC_VIEW_THREADS', 8),
+                              thread_name_prefix='async-views')
+
+
+def run_in_pool(func, *args, **kwargs):
+    """Run `func` in the pool, closing its thread's connection the way request_finished does."""
+    def job():
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return asyncio.get_running_loop().run_in_executor(executor, job)
+
+
+def async_view(view):
+    """Returns coroutine view that serves requests with sync `view` in the pool."""
+    def render(request, *args, **kwargs):
+        response = view(request, *args, **kwargs)
+        # DRF responses are rendered lazily, without this Django renders them on its shared thread
+        if callable(getattr(response, 'render', None)):
+            response.render()
+        return response
+
+    @wraps(view)  # keeps csrf_exempt and view_class of APIView.as_view()
+    async def wrapper(request, *args, **kwargs):
+        return await run_in_pool(render, request, *args, **kwargs)
+    return wrapper
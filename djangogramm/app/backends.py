@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+
+from .models import user_cache_key
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    Authenticates like ModelBackend, but serves the session's user from cache
+    instead of loading it from the database on every request.
+    Cached users are dropped whenever the row changes (see models.forget_cached_users).
+    """
+
+    def get_user(self, user_id):
+        cache = caches[getattr(settings, 'AUTH_USER_CACHE', 'default')]
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(key, user, getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 300))
+        return user
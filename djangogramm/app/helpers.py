@@ -1,31 +1,100 @@
 """Helper functions."""
 
-from datetime import datetime
+import base64
+import binascii
+import calendar
+import hashlib
+import json
+from datetime import datetime, tzinfo
+from functools import lru_cache
+from typing import Optional
 
 import pytz
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+
+
+POST_TIME_ZONE = 'Asia/Oral'
+# month names are looked up through locale on every access of calendar.month_name
+MONTHS = tuple(name.upper() for name in calendar.month_name)
+
+
+@lru_cache(maxsize=None)
+def post_time_zone() -> tzinfo:
+    return pytz.timezone(POST_TIME_ZONE)
+
+
+class RelativeTimeFormatter:
+    """
+    Formats publication dates as Instagram like relative time.
+    "Now" is captured once, so all posts of one response are formatted against the same moment.
+    """
+
+    def __init__(self, now: Optional[datetime] = None):
+        self.now = (now or datetime.now(pytz.utc)).astimezone(post_time_zone())
+
+    def __call__(self, pub_date: datetime) -> str:
+        diff = self.now - pub_date
+        days, seconds = diff.days, diff.seconds
+        if days == 0:
+            if seconds >= 3600:
+                hours_ago = seconds // 3600
+                return '1 HOUR AGO' if hours_ago == 1 else f'{hours_ago} HOURS AGO'
+            if seconds >= 60:
+                min_ago = seconds // 60
+                return '1 MINUTE AGO' if min_ago == 1 else f'{min_ago} MINUTES AGO'
+            return 'SECONDS AGO' if seconds < 10 else f'{seconds} SECONDS AGO'
+        if 1 <= days <= 6:
+            return '1 DAY AGO' if days == 1 else f'{days} DAYS AGO'
+        if days == 7:
+            return '1 WEEK AGO'
+        if days > 7:
+            pub_date = pub_date.astimezone(post_time_zone())
+            res = f'{MONTHS[pub_date.month]} {pub_date.day}'
+            return res if self.now.year == pub_date.year else f'{res}, {pub_date.year}'
+        return 'UNDEFINED'  # publication date is in the future
 
 
 def get_timedelta_for_post(pub_date: datetime) -> str:
     """Returns Instagram like post time from datetime object."""
-    now = datetime.now(pytz.timezone('Asia/Oral'))
-    diff = now - pub_date
-    res = 'undefined'  # in case something goes wrong
-    if diff.days == 0:
-        if diff.seconds >= 3600:
-            hours_ago = diff.seconds // 3600
-            res = f"{hours_ago} hour ago" if hours_ago == 1 else f"{hours_ago} hours ago"
-        elif 60 <= diff.seconds < 3600:
-            min_ago = diff.seconds // 60
-            res = f"{min_ago} minute ago" if min_ago == 1 else f"{min_ago} minutes ago"
-        elif diff.seconds < 60:
-            res = f"seconds ago" if diff.seconds < 10 else f"{diff.seconds} seconds ago"
-    elif 1 <= diff.days <= 6:
-        res = f'{diff.days} day ago' if diff.days == 1 else f'{diff.days} days ago'
-    elif diff.days == 7:
-        res = f'1 week ago'
-    elif diff.days > 7:
-        day_of_month = pub_date.strftime('%d').lstrip('0')
-        month = pub_date.strftime('%B')
-        res = f"{month} {day_of_month}" if now.year == pub_date.year else f"{month} {day_of_month}, {pub_date.year}"
-    res = res.upper()
-    return res
+    return RelativeTimeFormatter()(pub_date)
+
+
+def encode_cursor(*values) -> str:
+    """Returns opaque keyset cursor built from the sort key values of the last returned row."""
+    raw = json.dumps([value.isoformat() if isinstance(value, datetime) else value for value in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str, *types: type) -> Optional[tuple]:
+    """Returns sort key values stored in cursor converted to `types` or None if cursor is malformed."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(types):
+            return None
+        res = []
+        for value, value_type in zip(values, types):
+            if value_type is datetime:
+                value = parse_datetime(value)
+                if value is None:
+                    return None
+            else:
+                value = value_type(value)
+            res.append(value)
+    except (binascii.Error, UnicodeError, TypeError, ValueError):
+        return None
+    return tuple(res)
+
+
+def filter_after(queryset: QuerySet, position: Optional[tuple], id_field: str = 'id') -> QuerySet:
+    """Returns rows that come strictly after (pub_date, id) `position` in newest first order."""
+    if position is None:
+        return queryset
+    pub_date, row_id = position
+    return queryset.filter(Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, **{f'{id_field}__lt': row_id}))
+
+
+def make_etag(*parts) -> str:
+    """Returns quoted strong ETag built from string representation of `parts`."""
+    digest = hashlib.md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+    return f'"{digest}"'
@@ -0,0 +1,55 @@
+"""Resized image variants.
+
+Uploaded images are decoded and resized by Pillow in a pool of processes,
+so a burst of uploads keeps CPU work off the web workers and the media worker's threads.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Dict, Tuple
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+# variant format name: (Pillow format, save options)
+VARIANT_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 85, 'optimize': True, 'progressive': True}),
+}
+
+_pool = None
+
+
+def process_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=getattr(settings, 'IMAGE_PROCESS_WORKERS', None))
+    return _pool
+
+
+def render_variants(data: bytes, variants: Dict[str, Tuple[int, bool]]) -> Dict[str, Dict[str, bytes]]:
+    """
+    Encode every variant {name: (size, square)} of image `data` in every format.
+    Square variants are cropped to the center, others fit into size x size keeping aspect ratio.
+    Images are never upscaled.
+    """
+    with Image.open(BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original).convert('RGB')
+    rendered = {}
+    for name, (size, square) in variants.items():
+        if square:
+            side = min(size, image.width, image.height)
+            resized = ImageOps.fit(image, (side, side), Image.LANCZOS)
+        else:
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+        rendered[name] = {}
+        for fmt, (pillow_format, options) in VARIANT_FORMATS.items():
+            buffer = BytesIO()
+            resized.save(buffer, format=pillow_format, **options)
+            rendered[name][fmt] = buffer.getvalue()
+    return rendered
+
+
+def render_in_pool(data: bytes, variants: Dict[str, Tuple[int, bool]]) -> Dict[str, Dict[str, bytes]]:
+    return process_pool().submit(render_variants, data, variants).result()
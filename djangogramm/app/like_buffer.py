@@ -0,0 +1,124 @@
+"""Buffered likes for viral posts.
+
+With LIKE_BUFFER setting on, likes and unlikes are appended to PendingLike instead of
+inserting into Like and updating the post's counter row, which every liker of a viral post
+contends on. The flush_likes command applies pending entries in batches: the latest entry
+of every (post, user) wins, Like rows are created and deleted in bulk and counter deltas
+are merged per post. Workers lock the posts they flush, so they can run side by side.
+Until then the liking user sees their own pending state (see overlay).
+"""
+
+from collections import defaultdict
+from typing import Dict, Iterable, Tuple
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef, Subquery
+
+from .models import Like, PendingLike, Post, User, adjust_counters
+
+
+def enabled() -> bool:
+    return getattr(settings, 'LIKE_BUFFER', False)
+
+
+def pending_states(user_id: int, post_ids: Iterable[int]) -> Dict[int, bool]:
+    """Returns {post_id: liked} of user's likes not flushed yet."""
+    # later entries override earlier ones
+    return dict(PendingLike.objects.filter(user=user_id, post__in=list(post_ids)).order_by('id')
+                .values_list('post_id', 'liked'))
+
+
+def overlay(liked: bool, likes_count: int, pending: bool = None) -> Tuple[bool, int]:
+    """User's like state and post's likes count with user's pending entry applied."""
+    if pending is None or pending == liked:
+        return liked, likes_count
+    return pending, likes_count + (1 if pending else -1)
+
+
+def submit(post_id: int, user_id: int, liked: bool) -> Tuple[bool, int]:
+    """
+    Buffer wanted like state of the user, repeating it changes nothing.
+    Returns if the state changed and the post's likes count as the user sees it.
+    """
+    with transaction.atomic():
+        # requests of one user (e.g. a double-click) are applied one after another,
+        # so both can't see the old state, while other likers of the post don't wait on a shared row
+        if not User.objects.select_for_update().filter(id=user_id).exists():
+            raise User.DoesNotExist
+        # counter, stored like and latest pending entry in one query
+        row = Post.objects.filter(pk=post_id).annotate(
+            stored=Exists(Like.objects.filter(post=OuterRef('pk'), user=user_id)),
+            pending=Subquery(PendingLike.objects.filter(post=OuterRef('pk'), user=user_id).order_by('-id')
+                             .values('liked')[:1]),
+        ).values_list('likes_count', 'stored', 'pending').first()
+        if row is None:
+            raise Post.DoesNotExist
+        likes_count, stored, pending = row
+        current, likes_count = overlay(stored, likes_count, None if pending is None else bool(pending))
+        if current == liked:
+            return False, likes_count
+        PendingLike.objects.create(post_id=post_id, user_id=user_id, liked=liked)
+    return True, likes_count + (1 if liked else -1)
+
+
+def flush(batch_size: int = 1000) -> int:
+    """Apply up to `batch_size` oldest pending entries. Returns number of entries applied."""
+    with transaction.atomic():
+        # a post is flushed by one worker at a time, others skip it, so its entries are applied in order;
+        # direct likes update the same counter row and wait for the flush too
+        candidates = set(PendingLike.objects.order_by('id').values_list('post_id', flat=True)[:batch_size])
+        post_ids = list(Post.objects.select_for_update(skip_locked=True).filter(id__in=candidates).order_by('id')
+                        .values_list('id', flat=True))
+        if not post_ids:
+            return 0
+        # ids only grow, so these are the oldest entries of every locked post
+        entries = list(PendingLike.objects.filter(post__in=post_ids).order_by('id')
+                       .values_list('id', 'post_id', 'user_id', 'liked')[:batch_size])
+        wanted = {(post_id, user_id): liked for _, post_id, user_id, liked in entries}
+
+        user_ids = {user_id for _, user_id in wanted}
+        stored = {(post_id, user_id): like_id for like_id, post_id, user_id
+                  in Like.objects.filter(post__in=post_ids, user__in=user_ids).values_list('id', 'post_id', 'user_id')
+                  if (post_id, user_id) in wanted}
+        created = _insert_likes([pair for pair, liked in wanted.items() if liked and pair not in stored])
+        # rows deleted by a direct unlike meanwhile are not locked here, and not counted
+        deleted = list(Like.objects.select_for_update()
+                       .filter(id__in=[stored[pair] for pair, liked in wanted.items() if not liked and pair in stored])
+                       .values_list('id', 'post_id'))
+        Like.objects.filter(id__in=[like_id for like_id, _ in deleted]).delete()
+
+        deltas = defaultdict(int)
+        for post_id, _ in created:
+            deltas[post_id] += 1
+        for _, post_id in deleted:
+            deltas[post_id] -= 1
+        # one counter update per distinct delta instead of one per like
+        posts_by_delta = defaultdict(list)
+        for post_id, delta in deltas.items():
+            if delta:
+                posts_by_delta[delta].append(post_id)
+        for delta, delta_post_ids in posts_by_delta.items():
+            adjust_counters(Post, delta_post_ids, 'likes_count', delta)
+
+        PendingLike.objects.filter(id__in=[entry[0] for entry in entries]).delete()
+    return len(entries)
+
+
+def _insert_likes(pairs):
+    """Insert likes of (post_id, user_id) `pairs`. Returns pairs inserted, likes stored meanwhile are skipped."""
+    try:
+        with transaction.atomic():
+            Like.objects.bulk_create([Like(post_id=post_id, user_id=user_id) for post_id, user_id in pairs])
+        return pairs
+    except IntegrityError:
+        pass
+    inserted = []
+    for post_id, user_id in pairs:
+        try:
+            with transaction.atomic():
+                Like.objects.bulk_create([Like(post_id=post_id, user_id=user_id)])
+        except IntegrityError:
+            continue
+        inserted.append((post_id, user_id))
+    return inserted
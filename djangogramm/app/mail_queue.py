@@ -0,0 +1,89 @@
+"""Persistent outgoing email queue.
+
+Views enqueue emails as EmailJob rows instead of talking to the SMTP server,
+the process_email_queue command sends them in batches over one connection
+and retries failed ones with exponential backoff.
+"""
+
+import logging
+from datetime import timedelta
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EmailJob
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = getattr(settings, 'EMAIL_QUEUE_MAX_ATTEMPTS', 5)
+# delay before the first retry, doubled after every failed attempt
+RETRY_DELAY = timedelta(seconds=getattr(settings, 'EMAIL_QUEUE_RETRY_DELAY', 60))
+# claimed jobs are not picked by other workers for this long
+CLAIM_TIMEOUT = timedelta(minutes=10)
+
+
+def enqueue(subject: str, body: str, to: str, from_email: Optional[str] = None) -> EmailJob:
+    """Store email to be sent by the queue worker."""
+    return EmailJob.objects.create(subject=subject, body=body, to=to,
+                                   from_email=from_email or settings.EMAIL_HOST_USER or '')
+
+
+def retry_delay(attempts: int) -> timedelta:
+    return RETRY_DELAY * 2 ** (attempts - 1)
+
+
+def claim_batch(batch_size: int) -> list:
+    """Returns due jobs and postpones them, so a concurrent worker does not send them twice."""
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(EmailJob.objects.select_for_update(skip_locked=True)
+                    .filter(status=EmailJob.PENDING, next_attempt_at__lte=now)[:batch_size])
+        EmailJob.objects.filter(id__in=[job.id for job in jobs]).update(next_attempt_at=now + CLAIM_TIMEOUT)
+    return jobs
+
+
+def process_batch(batch_size: int = 50) -> Tuple[int, int]:
+    """Send a batch of due emails over one connection. Returns numbers of sent and failed emails."""
+    jobs = claim_batch(batch_size)
+    if not jobs:
+        return 0, 0
+
+    sent = failed = 0
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as e:
+        for job in jobs:
+            _fail(job, e)
+        return 0, len(jobs)
+    try:
+        for job in jobs:
+            try:
+                EmailMessage(job.subject, job.body, job.from_email, [job.to], connection=connection).send()
+            except Exception as e:
+                _fail(job, e)
+                failed += 1
+            else:
+                job.status, job.sent_at = EmailJob.SENT, timezone.now()
+                job.attempts += 1
+                job.save(update_fields=['status', 'sent_at', 'attempts'])
+                sent += 1
+    finally:
+        connection.close()
+    return sent, failed
+
+
+def _fail(job: EmailJob, error: Exception) -> None:
+    job.attempts += 1
+    job.last_error = repr(error)
+    if job.attempts >= MAX_ATTEMPTS:
+        job.status = EmailJob.FAILED
+        logger.error('giving up on email %s after %d attempts: %r', job.id, job.attempts, error)
+    else:
+        job.next_attempt_at = timezone.now() + retry_delay(job.attempts)
+        logger.warning('email %s failed (attempt %d), retrying at %s: %r',
+                       job.id, job.attempts, job.next_attempt_at, error)
+    job.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
@@ -0,0 +1,59 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from app import like_buffer
+from app.models import Like, PendingLike, Post, User
+
+EMAIL = 'benchmark-liker-{}@example.invalid'
+
+
+class Command(BaseCommand):
+    help = ('Compare likes/sec on one viral post with direct writes and with the like buffer. '
+            'Temporary users and the post are removed afterwards.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--likes', type=int, default=2000, help='Likes, each from another user.')
+        parser.add_argument('--threads', type=int, default=8, help='Likes sent at once.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Entries applied by one flush.')
+
+    def handle(self, *args, **options):
+        User.objects.bulk_create([User(email=EMAIL.format(i)) for i in range(options['likes'])], ignore_conflicts=True)
+        users = list(User.objects.filter(email__startswith='benchmark-liker-').values_list('id', flat=True))
+        author = User.objects.get(email=EMAIL.format(0))
+        post = Post.objects.create(user=author, caption='benchmark', image='benchmark')
+        try:
+            elapsed = self.run(post.id, users, Like.set_liked, options['threads'])
+            self.report('direct', len(users), elapsed)
+            Like.objects.filter(post=post).delete()
+            Post.objects.filter(pk=post.pk).update(likes_count=0)
+
+            elapsed = self.run(post.id, users, like_buffer.submit, options['threads'])
+            self.report('buffered, accepted', len(users), elapsed)
+            started = time.perf_counter()
+            while like_buffer.flush(options['batch_size']):
+                pass
+            self.report('buffered, with flush', len(users), elapsed + time.perf_counter() - started)
+            post.refresh_from_db()
+            self.stdout.write(f'likes count after flush: {post.likes_count}')
+        finally:
+            PendingLike.objects.filter(post=post).delete()
+            User.objects.filter(id__in=users).delete()
+
+    @staticmethod
+    def run(post_id, users, set_liked, threads):
+        def like(user_id):
+            try:
+                set_liked(post_id, user_id, True)
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(like, users))
+        return time.perf_counter() - started
+
+    def report(self, name, likes, elapsed):
+        self.stdout.write(f'{name}: {likes / elapsed:.0f} likes/s ({elapsed:.2f} s)')
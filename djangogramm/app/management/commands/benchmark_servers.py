@@ -0,0 +1,74 @@
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import URLError
+from urllib.request import Request, urlopen
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models import User
+
+PATHS = ['/app/posts/?limit=7', '/app/posts/?limit=9&user_id={user_id}', '/app/likes/{post_id}',
+         '/app/subscriptions/{user_id}', '/app/user/{user_id}/fullname']
+
+
+class Command(BaseCommand):
+    help = ('Load the hot JSON endpoints of running WSGI and ASGI servers and compare throughput. '
+            'Start both with the same number of workers, e.g. `gunicorn djangogramm.wsgi -w 4 -b :8000` '
+            'and `uvicorn djangogramm.asgi:application --workers 4 --port 8001`.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi', default='http://127.0.0.1:8000', help='Base URL of the WSGI server.')
+        parser.add_argument('--asgi', default='http://127.0.0.1:8001', help='Base URL of the ASGI server.')
+        parser.add_argument('--requests', type=int, default=1000, help='Requests per server.')
+        parser.add_argument('--concurrency', type=int, default=50, help='Requests in flight at once.')
+        parser.add_argument('--user-id', type=int, help='User whose session is used, first active user by default.')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(is_active=True, **({'id': options['user_id']} if options['user_id'] else {}))\
+            .first()
+        if user is None:
+            raise CommandError('no active user to sign in with')
+        post = user.post_set.first()
+        paths = [path.format(user_id=user.id, post_id=post.id if post else 0) for path in PATHS]
+        cookie = f'{settings.SESSION_COOKIE_NAME}={self.session_key(user)}'
+
+        for name in ('wsgi', 'asgi'):
+            base_url = options[name].rstrip('/')
+            urls = [base_url + paths[i % len(paths)] for i in range(options['requests'])]
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+                results = list(pool.map(lambda url: self.fetch(url, cookie), urls))
+            elapsed = time.perf_counter() - started
+            latencies = sorted(latency for ok, latency in results if ok)
+            errors = len(results) - len(latencies)
+            if not latencies:
+                self.stdout.write(f'{name}: {base_url} did not answer')
+                continue
+            p95 = latencies[int(len(latencies) * 0.95) - 1] if len(latencies) > 1 else latencies[0]
+            self.stdout.write(f'{name}: {len(results) / elapsed:.1f} req/s, '
+                              f'p50 {statistics.median(latencies):.1f} ms, p95 {p95:.1f} ms, {errors} errors')
+
+    @staticmethod
+    def session_key(user):
+        session = SessionStore()
+        session[SESSION_KEY] = str(user.pk)
+        session[BACKEND_SESSION_KEY] = settings.AUTHENTICATION_BACKENDS[0]
+        session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+        session.create()
+        return session.session_key
+
+    @staticmethod
+    def fetch(url, cookie):
+        """Returns if request succeeded and its latency in milliseconds."""
+        started = time.perf_counter()
+        try:
+            with urlopen(Request(url, headers={'Cookie': cookie}), timeout=30) as response:
+                response.read()
+                ok = response.status == 200
+        except (URLError, OSError):
+            ok = False
+        return ok, (time.perf_counter() - started) * 1000
@@ -0,0 +1,42 @@
+import statistics
+import time
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+from PIL import Image
+
+from app.images import render_variants
+from app.models import Post
+from app.storage import media_storage
+
+
+class Command(BaseCommand):
+    help = ('Time storing post images and their variants with the storage selected by MEDIA_STORAGE, '
+            'e.g. MEDIA_STORAGE=app.storage.FileSystemMediaStorage to measure it offline.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--images', type=int, default=20, help='Number of images to store.')
+        parser.add_argument('--size', type=int, default=2000, help='Side of the generated images in pixels.')
+
+    def handle(self, *args, **options):
+        storage = media_storage()
+        buffer = BytesIO()
+        Image.new('RGB', (options['size'], options['size']), 'teal').save(buffer, format='JPEG')
+        data = buffer.getvalue()
+
+        resize, store = [], []
+        for i in range(options['images']):
+            started = time.perf_counter()
+            rendered = render_variants(data, Post.media_variants)
+            resize.append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            storage.save(BytesIO(data), 'benchmark/', f'original_{i}', 'jpg')
+            for name, formats in rendered.items():
+                for fmt, content in formats.items():
+                    storage.save(BytesIO(content), 'benchmark/', f'original_{i}_{name}_{fmt}', fmt)
+            store.append((time.perf_counter() - started) * 1000)
+
+        self.stdout.write(f'{type(storage).__name__}, {options["images"]} images')
+        self.stdout.write(f'resize: median {statistics.median(resize):.1f} ms per image')
+        self.stdout.write(f'store: median {statistics.median(store):.1f} ms per image with variants')
@@ -0,0 +1,87 @@
+import copy
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.template.loader import render_to_string
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from app.models import Post, User
+from app.views import ExploreUserListView
+
+# fragments are stored in a private in-memory cache, the configured one is never touched
+BENCHMARK_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'benchmark-templates',
+    }
+}
+LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
+
+def templates_setting(cached_loader):
+    """Returns TEMPLATES setting with plain or cached template loaders."""
+    templates = copy.deepcopy(settings.TEMPLATES)
+    for engine in templates:
+        engine.pop('APP_DIRS', None)
+        engine.setdefault('OPTIONS', {})['loaders'] = [('django.template.loaders.cached.Loader', LOADERS)] \
+            if cached_loader else LOADERS
+    return templates
+
+
+class Command(BaseCommand):
+    help = 'Measure render time of profile, explore and post pages with and without template caching.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=200, help='Renders per page and cache state.')
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(is_active=True).first()
+        post = Post.objects.select_related('user').first()
+        if user is None or post is None:
+            raise CommandError('need at least one active user and one post')
+        request = RequestFactory().get('/')
+        request.user = user
+
+        with override_settings(CACHES=BENCHMARK_CACHES):
+            # the view's own context, rendering is left to the measurements
+            explore_context = ExploreUserListView.as_view()(request).context_data
+        pages = {
+            'profile': ('app/user_detail.html', {
+                'user': user, 'auth_user': user, 'can_edit': False, 'empty_avatar': False,
+                'num_posts': user.posts_count, 'follow_params': {'can_follow': False},
+            }),
+            'explore': ('app/user_list.html', explore_context),
+            'post': ('app/post_detail.html', {
+                'post': post, 'auth_user': user, 'can_edit': False, 'liked': False, 'likes_count': post.likes_count,
+                'post_timedelta': '1 DAY AGO',
+            }),
+        }
+
+        repeat = options['repeat']
+        for name, (template_name, context) in pages.items():
+            with override_settings(CACHES=BENCHMARK_CACHES, TEMPLATES=templates_setting(cached_loader=False)):
+                plain = self.measure(template_name, context, request, repeat, clear=True)
+            with override_settings(CACHES=BENCHMARK_CACHES, TEMPLATES=templates_setting(cached_loader=True)):
+                render_to_string(template_name, context, request)  # compile template once
+                cold = self.measure(template_name, context, request, repeat, clear=True)
+                warm = self.measure(template_name, context, request, repeat, clear=False)
+            self.stdout.write(f'{name}: no caching {plain:.3f} ms, cached loader {cold:.3f} ms, '
+                              f'cached loader and fragments {warm:.3f} ms ({plain / warm if warm else 0:.1f}x faster)')
+
+    @staticmethod
+    def measure(template_name, context, request, repeat, clear):
+        """Returns average render time in milliseconds."""
+        total = 0
+        for _ in range(repeat):
+            if clear:
+                cache.clear()
+            started = time.perf_counter()
+            render_to_string(template_name, context, request)
+            total += time.perf_counter() - started
+        return total / repeat * 1000
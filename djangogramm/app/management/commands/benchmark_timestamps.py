@@ -0,0 +1,69 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+import pytz
+from django.core.management.base import BaseCommand
+from rest_framework import serializers
+
+from app.helpers import RelativeTimeFormatter
+
+
+def get_timedelta_for_post(pub_date: datetime) -> str:
+    """Returns Instagram like post time from datetime object."""
+    # verbatim copy of the former helpers.get_timedelta_for_post, kept as the baseline to compare with
+    now = datetime.now(pytz.timezone('Asia/Oral'))
+    diff = now - pub_date
+    res = 'undefined'  # in case something goes wrong
+    if diff.days == 0:
+        if diff.seconds >= 3600:
+            hours_ago = diff.seconds // 3600
+            res = f"{hours_ago} hour ago" if hours_ago == 1 else f"{hours_ago} hours ago"
+        elif 60 <= diff.seconds < 3600:
+            min_ago = diff.seconds // 60
+            res = f"{min_ago} minute ago" if min_ago == 1 else f"{min_ago} minutes ago"
+        elif diff.seconds < 60:
+            res = f"seconds ago" if diff.seconds < 10 else f"{diff.seconds} seconds ago"
+    elif 1 <= diff.days <= 6:
+        res = f'{diff.days} day ago' if diff.days == 1 else f'{diff.days} days ago'
+    elif diff.days == 7:
+        res = f'1 week ago'
+    elif diff.days > 7:
+        day_of_month = pub_date.strftime('%d').lstrip('0')
+        month = pub_date.strftime('%B')
+        res = f"{month} {day_of_month}" if now.year == pub_date.year else f"{month} {day_of_month}, {pub_date.year}"
+    res = res.upper()
+    return res
+
+
+def legacy_format(pub_date: datetime) -> str:
+    """Former feed path: ISO string round trip in the serializer, then get_timedelta_for_post for every post."""
+    pub_date = datetime.fromisoformat(serializers.DateTimeField().to_representation(pub_date))
+    return get_timedelta_for_post(pub_date)
+
+
+class Command(BaseCommand):
+    help = 'Compare per-post relative time formatting, the batched formatter and raw epoch timestamps.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--posts', type=int, default=10000, help='Number of publication dates to format.')
+
+    def handle(self, *args, **options):
+        now = datetime.now(pytz.utc)
+        pub_dates = [now - timedelta(seconds=random.randint(0, 2 * 365 * 86400)) for _ in range(options['posts'])]
+
+        def batched():
+            formatter = RelativeTimeFormatter()
+            return [formatter(pub_date) for pub_date in pub_dates]
+
+        approaches = {
+            'per post (legacy)': lambda: [legacy_format(pub_date) for pub_date in pub_dates],
+            'batched formatter': batched,
+            'epoch timestamps': lambda: [int(pub_date.timestamp()) for pub_date in pub_dates],
+        }
+        for name, run in approaches.items():
+            started = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - started
+            self.stdout.write(f'{name}: {elapsed * 1000:.1f} ms total, '
+                              f'{elapsed / len(pub_dates) * 1e6:.2f} us per post')
@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from app import timeline
+from app.models import User
+
+
+class Command(BaseCommand):
+    help = 'Show how the feed fan-out threshold splits accounts and measure feed read cost.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sample', type=int, default=20, help='Number of users whose feed page is timed.')
+        parser.add_argument('--limit', type=int, default=7, help='Feed page size.')
+
+    def handle(self, *args, **options):
+        threshold = timeline.FANOUT_FOLLOWER_THRESHOLD
+        pulled = User.objects.filter(followers_count__gte=threshold)
+        pushed = User.objects.filter(followers_count__lt=threshold)
+        max_inserts = pushed.aggregate(num=Max('followers_count'))['num'] or 0
+        self.stdout.write(f'threshold: {threshold} followers')
+        self.stdout.write(f'pulled accounts: {pulled.count()}')
+        self.stdout.write(f'pushed accounts: {pushed.count()}, max inserts per post: {max_inserts + 1}')
+
+        totals = {}
+        user_ids = User.objects.filter(is_active=True).values_list('id', flat=True)[:options['sample']]
+        started = time.perf_counter()
+        for user_id in user_ids:
+            timings = {}
+            timeline.feed_page(user_id, None, options['limit'], timings=timings)
+            for stage, duration in timings.items():
+                totals[stage] = totals.get(stage, 0) + duration
+        elapsed = (time.perf_counter() - started) * 1000
+        if user_ids:
+            for stage, duration in totals.items():
+                self.stdout.write(f'{stage}: {duration / len(user_ids):.2f} ms per page')
+            self.stdout.write(f'total: {elapsed / len(user_ids):.2f} ms per page')
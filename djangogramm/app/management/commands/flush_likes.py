@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app import like_buffer
+
+
+class Command(BaseCommand):
+    help = ('Apply buffered likes to posts in batches (LIKE_BUFFER setting). '
+            'Workers can run side by side, each post is flushed by one of them at a time.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Entries applied in one transaction.')
+        parser.add_argument('--sleep', type=float, default=1, help='Seconds to wait when the buffer is empty.')
+        parser.add_argument('--once', action='store_true', help='Apply all pending entries and exit.')
+
+    def handle(self, *args, **options):
+        while True:
+            applied = like_buffer.flush(options['batch_size'])
+            if applied:
+                self.stdout.write(f'applied: {applied}')
+            elif options['once']:
+                return
+            else:
+                time.sleep(options['sleep'])
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app import mail_queue
+
+
+class Command(BaseCommand):
+    help = 'Send queued emails in batches, retrying failed ones with backoff.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='Emails sent over one SMTP connection.')
+        parser.add_argument('--sleep', type=float, default=5, help='Seconds to wait when the queue is empty.')
+        parser.add_argument('--once', action='store_true', help='Send all due emails and exit.')
+
+    def handle(self, *args, **options):
+        while True:
+            sent, failed = mail_queue.process_batch(options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f'sent: {sent}, failed: {failed}')
+            elif options['once']:
+                return
+            else:
+                time.sleep(options['sleep'])
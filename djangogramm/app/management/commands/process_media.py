@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app import media
+
+
+class Command(BaseCommand):
+    help = 'Upload staged post images and avatars to the storage with a pool of workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Uploads run at once.')
+        parser.add_argument('--limit', type=int, default=100, help='Rows of every model taken in one round.')
+        parser.add_argument('--sleep', type=float, default=5, help='Seconds to wait when nothing is staged.')
+        parser.add_argument('--once', action='store_true', help='Publish all staged media and exit.')
+        parser.add_argument('--retry-failed', action='store_true', help='Queue failed uploads again first.')
+
+    def handle(self, *args, **options):
+        if options['retry_failed']:
+            self.stdout.write(f'queued again: {media.retry_failed()}')
+        while True:
+            stale = media.requeue_stale()
+            if stale:
+                self.stdout.write(f'queued again after claim timeout: {stale}')
+            published, failed = media.publish_pending(options['workers'], options['limit'])
+            if published or failed:
+                self.stdout.write(f'published: {published}, failed: {failed}')
+            elif options['once']:
+                return
+            else:
+                time.sleep(options['sleep'])
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from app import timeline
+from app.models import User
+
+
+class Command(BaseCommand):
+    help = 'Rebuild materialized home timelines from posts and subscriptions.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('user_ids', nargs='*', type=int, help='Users to rebuild, all users by default.')
+
+    def handle(self, *args, **options):
+        users = User.objects.all()
+        if options['user_ids']:
+            users = users.filter(id__in=options['user_ids'])
+        user_ids = list(users.values_list('id', flat=True))
+        for user_id in user_ids:
+            timeline.rebuild(user_id)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(user_ids)} timelines'))
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from app.models import Like, Post, Subscription, User, forget_cached_users
+
+# (model with counter, counter field, counted model, foreign key of counted model to the first one)
+COUNTERS = [
+    (User, 'followers_count', Subscription, 'followee'),
+    (User, 'following_count', Subscription, 'follower'),
+    (User, 'posts_count', Post, 'user'),
+    (Post, 'likes_count', Like, 'post'),
+]
+
+
+def actual_count(counted_model, fk):
+    rows = counted_model.objects.filter(**{fk: OuterRef('pk')}).order_by().values(fk)
+    return Coalesce(Subquery(rows.annotate(num=Count('*')).values('num'), output_field=IntegerField()), Value(0))
+
+
+class Command(BaseCommand):
+    help = 'Recount denormalized like/follower/following/post counters and fix any drift.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted rows.')
+
+    def handle(self, *args, **options):
+        for model, field, counted_model, fk in COUNTERS:
+            with transaction.atomic():
+                drifted = model.objects.annotate(actual=actual_count(counted_model, fk))\
+                    .exclude(**{field: F('actual')})
+                drifted_pks = list(drifted.values_list('pk', flat=True))
+                if drifted_pks and not options['dry_run']:
+                    # bump `updated_at` too, ETags are keyed by it
+                    model.objects.filter(pk__in=drifted_pks).update(**{field: actual_count(counted_model, fk),
+                                                                       'updated_at': timezone.now()})
+                    if model is User:
+                        forget_cached_users(*drifted_pks)
+            self.stdout.write(f'{model.__name__}.{field}: {len(drifted_pks)} drifted')
@@ -0,0 +1,142 @@
+"""Deferred media uploads.
+
+Views only stage uploaded images on local disk and mark the post or user as pending,
+so a request never waits for the upload to the storage. The process_media command
+publishes staged files with a pool of workers, along with their resized variants
+(see images.py), and marks the rows ready.
+"""
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import BytesIO
+from typing import Tuple
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadedfile import UploadedFile
+from django.db import connection
+from django.utils import timezone
+
+from . import images
+from .models import MEDIA_FAILED, MEDIA_PENDING, MEDIA_READY, MEDIA_UPLOADING, Post, User, forget_cached_users
+from .storage import content_hash, media_storage
+
+logger = logging.getLogger(__name__)
+
+MEDIA_MODELS = [Post, User]
+# uploads claimed longer ago are taken for ones of a dead worker
+CLAIM_TIMEOUT = timedelta(minutes=10)
+# fields defer_upload and discard_staged change besides the media field, for saves with `update_fields`
+STAGED_FIELDS = ['staged_media', 'media_status']
+
+
+def staging_storage() -> FileSystemStorage:
+    return FileSystemStorage(location=settings.MEDIA_STAGING_ROOT)
+
+
+def defer_upload(instance, upload: UploadedFile) -> None:
+    """
+    Stage `upload` as the new media of unsaved `instance`.
+    Media field keeps its stored value (empty for a new post) until the upload is published.
+    """
+    field = instance.media_field
+    prefix = f'{type(instance).__name__.lower()}_{instance.pk or "new"}'
+    instance.staged_media = staging_storage().save(f'{prefix}_{os.path.basename(upload.name)}', upload)
+    instance.media_status = MEDIA_PENDING
+    stored = type(instance).objects.filter(pk=instance.pk).values_list(field, flat=True).first() \
+        if instance.pk else None
+    setattr(instance, field, stored or '')
+
+
+def discard_staged(instance) -> None:
+    """Forget staged upload of unsaved `instance`, e.g. when the user removes their avatar meanwhile."""
+    if instance.staged_media:
+        staging_storage().delete(instance.staged_media)
+    instance.staged_media, instance.media_status = '', MEDIA_READY
+
+
+def store_variant(instance, digest: str, name: str, fmt: str, content: bytes) -> str:
+    """Upload one variant of original image with content hash `digest` next to it. Returns its URL."""
+    folder = instance._meta.get_field(instance.media_field).upload_folder(instance)
+    storage = media_storage()
+    return storage.url(storage.store(BytesIO(content), folder, f'{digest}_{name}_{fmt}', fmt))
+
+
+def _update(rows, **fields) -> int:
+    """Update `rows` queryset, users are dropped from the authenticated user cache as well."""
+    if rows.model is User:
+        pks = list(rows.values_list('pk', flat=True))
+        rows = User.objects.filter(pk__in=pks)
+    updated = rows.update(**fields)
+    if rows.model is User and updated:
+        forget_cached_users(*pks)
+    return updated
+
+
+def publish(model, pk) -> bool:
+    """Upload staged media of one row to the storage. Returns if it was published."""
+    # claim the row, so concurrent workers don't upload it twice, see requeue_stale for dead workers
+    if not _update(model.objects.filter(pk=pk, media_status=MEDIA_PENDING).exclude(staged_media=''),
+                   media_status=MEDIA_UPLOADING, updated_at=timezone.now()):
+        return False
+    instance = model.objects.get(pk=pk)
+    storage = staging_storage()
+    staged = instance.staged_media
+    # a newer upload staged while this one runs replaces it, the row is left to that upload
+    current = model.objects.filter(pk=pk, staged_media=staged)
+    try:
+        with storage.open(staged) as file:
+            data = file.read()
+        digest = content_hash(BytesIO(data))
+        rendered = images.render_in_pool(data, instance.media_variants)
+        variants = {name: {fmt: store_variant(instance, digest, name, fmt, content)
+                           for fmt, content in formats.items()}
+                    for name, formats in rendered.items()}
+        field = instance._meta.get_field(instance.media_field)
+        setattr(instance, field.attname, UploadedFile(BytesIO(data), name=os.path.basename(staged)))
+        # the field uploads the original
+        name = field.pre_save(instance, add=False)
+        now = timezone.now()
+        published = _update(current, **{field.attname: name}, variants=variants, staged_media='',
+                            media_status=MEDIA_READY, updated_at=now, edited_at=now)
+    except Exception:
+        logger.exception('could not publish %s of %s %s', staged, model.__name__, pk)
+        _update(current, media_status=MEDIA_FAILED)
+        return False
+    storage.delete(staged)
+    return bool(published)
+
+
+def publish_pending(workers: int = 4, limit: int = 100) -> Tuple[int, int]:
+    """
+    Publish staged media of up to `limit` rows of every model with a pool of `workers` threads.
+    Returns numbers of published and failed uploads.
+    """
+    jobs = [(model, pk) for model in MEDIA_MODELS
+            for pk in model.objects.filter(media_status=MEDIA_PENDING).values_list('pk', flat=True)[:limit]]
+
+    def run(job):
+        try:
+            return publish(*job)
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='media') as pool:
+        results = list(pool.map(run, jobs))
+    published = sum(results)
+    return published, len(results) - published
+
+
+def retry_failed() -> int:
+    """Queue failed uploads again. Returns number of rows queued."""
+    return sum(_update(model.objects.filter(media_status=MEDIA_FAILED).exclude(staged_media=''),
+                       media_status=MEDIA_PENDING) for model in MEDIA_MODELS)
+
+
+def requeue_stale() -> int:
+    """Queue again uploads claimed longer than CLAIM_TIMEOUT ago, their worker died. Returns number of rows."""
+    claimed_before = timezone.now() - CLAIM_TIMEOUT
+    return sum(_update(model.objects.filter(media_status=MEDIA_UPLOADING, updated_at__lt=claimed_before)
+                       .exclude(staged_media=''), media_status=MEDIA_PENDING) for model in MEDIA_MODELS)
@@ -0,0 +1,21 @@
+# Generated by Django 3.2.8 on 2026-10-18 06:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0024_alter_user_avatar'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='post',
+            options={'ordering': ['-pub_date', '-id']},
+        ),
+        migrations.AddIndex(
+            model_name='post',
+            index=models.Index(fields=['user', '-pub_date', '-id'], name='post_user_pub_date_id_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 3.2.8 on 2026-10-18 07:00
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def populate_counters(apps, schema_editor):
+    User = apps.get_model('app', 'User')
+    Post = apps.get_model('app', 'Post')
+    Subscription = apps.get_model('app', 'Subscription')
+    Like = apps.get_model('app', 'Like')
+
+    def count(model, fk):
+        rows = model.objects.filter(**{fk: OuterRef('pk')}).order_by().values(fk)
+        return Coalesce(Subquery(rows.annotate(num=Count('*')).values('num'), output_field=IntegerField()), Value(0))
+
+    User.objects.update(followers_count=count(Subscription, 'followee'),
+                        following_count=count(Subscription, 'follower'),
+                        posts_count=count(Post, 'user'))
+    Post.objects.update(likes_count=count(Like, 'post'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0026_timelineentry'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='likes_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='following_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='posts_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.2.8 on 2026-10-18 07:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0029_emailjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='media_status',
+            field=models.CharField(choices=[('ready', 'Ready'), ('pending', 'Pending'), ('uploading', 'Uploading'), ('failed', 'Failed')], db_index=True, default='ready', max_length=9),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='staged_media',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='media_status',
+            field=models.CharField(choices=[('ready', 'Ready'), ('pending', 'Pending'), ('uploading', 'Uploading'), ('failed', 'Failed')], db_index=True, default='ready', max_length=9),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='staged_media',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.8 on 2026-10-18 07:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0032_pendinglike'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['is_active', 'is_admin', 'last_name', 'id'], name='user_explore_idx'),
+        ),
+    ]
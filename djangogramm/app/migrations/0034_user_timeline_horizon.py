@@ -0,0 +1,18 @@
+# Generated by Django 3.2.8 on 2026-10-18 07:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0033_user_explore_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='timeline_horizon',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 3.2.8 on 2026-10-18 07:43
+
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def mark_pulled_accounts(apps, schema_editor):
+    # when they were pulled is unknown, their latest posts are pushed once they drop below the threshold
+    User = apps.get_model('app', 'User')
+    threshold = getattr(settings, 'FEED_FANOUT_FOLLOWER_THRESHOLD', 10000)
+    User.objects.filter(followers_count__gte=threshold).update(pulled_since=datetime(1970, 1, 1, tzinfo=timezone.utc))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0034_user_timeline_horizon'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='pulled_since',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_pulled_accounts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 3.2.8 on 2026-10-18 08:01
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0035_user_pulled_since'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='edited_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='edited_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+    ]
@@ -1,39 +1,158 @@
 import os
 
-from django.db import models
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.uploadedfile import UploadedFile
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.contrib.auth.models import (
     BaseUserManager, AbstractBaseUser, PermissionsMixin
 )
 from django.urls import reverse
-from PIL import Image
+from django.utils import timezone
 from cloudinary.models import CloudinaryField as BaseCloudinaryField
 
+from .storage import content_hash, media_storage
+
 EMPTY_USER_IMAGE = os.getenv('EMPTY_USER_IMAGE')
 
 
-class CloudinaryAvatarField(BaseCloudinaryField):
-    def upload_options(self, instance):
-        return {
-            'folder': f"media/{instance.id}/avatar/",
-            'public_id': f"avatar_{instance.id}",
-        }
+class MediaField(BaseCloudinaryField):
+    """
+    Image kept as a name in the storage selected by MEDIA_STORAGE setting (see storage.py).
+    Uploads are named by their content hash in `upload_folder`, so a stored name never
+    changes its content and uploading the same bytes again reuses the stored file.
+    """
 
-    def pre_save(self, model_instance, add):
-        self.options.update(self.upload_options(model_instance))
-        return super().pre_save(model_instance, add)
+    def upload_folder(self, instance):
+        """Folder of the instance's uploads, subclasses keep them apart per owner."""
+        return 'media/'
+
+    def upload_options(self, instance, digest):
+        return {'folder': self.upload_folder(instance), 'public_id': digest}
 
+    def from_db_value(self, value, expression, connection, *args, **kwargs):
+        if value is not None:
+            return media_storage().resource(value)
 
-class CloudinaryPostField(BaseCloudinaryField):
-    def upload_options(self, instance):
-        print(instance.pub_date)
-        return {
-            'folder': f"media/{instance.user.id}/posts/",
-            'public_id': f"{instance.user.id}_{instance.pub_date}",
-        }
+    def to_python(self, value):
+        if isinstance(value, str):
+            return media_storage().resource(value)
+        return value
 
     def pre_save(self, model_instance, add):
-        self.options.update(self.upload_options(model_instance))
-        return super().pre_save(model_instance, add)
+        value = getattr(model_instance, self.attname)
+        if isinstance(value, UploadedFile):
+            name = media_storage().store(value, **self.upload_options(model_instance, content_hash(value)))
+            setattr(model_instance, self.attname, media_storage().resource(name))
+            return name
+        return self.get_prep_value(value)
+
+    def get_prep_value(self, value):
+        if not value:
+            return self.get_default()
+        if hasattr(value, 'get_prep_value'):
+            return value.get_prep_value()
+        return value
+
+
+class CloudinaryAvatarField(MediaField):
+    def upload_folder(self, instance):
+        return f"media/{instance.id}/avatar/"
+
+
+class CloudinaryPostField(MediaField):
+    def upload_folder(self, instance):
+        return f"media/{instance.user_id}/posts/"
+
+
+class DerivedFieldsMixin(models.Model):
+    """
+    Fields listed in `derived_fields` are only written by update queries (see adjust_counters and timeline),
+    a save of a loaded row leaves them as they are in the database instead of writing back stale values.
+    """
+    derived_fields = ()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and not args and kwargs.get('update_fields') is None \
+                and not kwargs.get('force_insert'):
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields
+                                       if not field.primary_key and field.name not in self.derived_fields
+                                       and field.attname not in deferred]
+        super().save(*args, **kwargs)
+
+
+MEDIA_READY, MEDIA_PENDING, MEDIA_UPLOADING, MEDIA_FAILED = 'ready', 'pending', 'uploading', 'failed'
+MEDIA_STATUS_CHOICES = [(MEDIA_READY, 'Ready'), (MEDIA_PENDING, 'Pending'), (MEDIA_UPLOADING, 'Uploading'),
+                        (MEDIA_FAILED, 'Failed')]
+
+
+class StagedMediaMixin(models.Model):
+    """
+    New upload of `media_field` is staged on local disk and published to the storage
+    by the process_media command (see media.py), until then `media_status` is pending.
+    Resized copies listed in `media_variants` as {name: (size, square)} are published
+    along with it and their URLs kept in `variants` as {name: {format: url}}.
+    """
+    media_field = None
+    media_variants = {}
+    media_status = models.CharField(max_length=9, choices=MEDIA_STATUS_CHOICES, default=MEDIA_READY, db_index=True)
+    staged_media = models.CharField(max_length=255, blank=True)
+    variants = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        abstract = True
+
+    @property
+    def media_ready(self):
+        return self.media_status == MEDIA_READY
+
+    def variant_url(self, name, fmt='jpeg', fallback=True):
+        """URL of the variant, or of the original image when it has no variants (yet) and `fallback` is set."""
+        url = self.variants.get(name, {}).get(fmt)
+        if url or not fallback:
+            return url
+        original = self._meta.get_field(self.media_field).to_python(getattr(self, self.media_field))
+        return original.url if original else ''
+
+
+def user_cache_key(pk):
+    return f'auth_user:{pk}'
+
+
+def forget_cached_users(*pks):
+    """Drop users from the authenticated user cache (see backends.CachedModelBackend)."""
+    cache = caches[getattr(settings, 'AUTH_USER_CACHE', 'default')]
+    keys = [user_cache_key(pk) for pk in pks]
+    cache.delete_many(keys)
+    # a request reading the old row before commit could cache it again
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def adjust_counter(model, pk, field, delta):
+    """
+    Atomically add `delta` to counter `field` of the row, never going below zero.
+    Row's `updated_at` is bumped too, so it can be used as a validator by clients' caches.
+    """
+    adjust_counters(model, [pk], field, delta)
+
+
+def adjust_counters(model, pks, field, delta):
+    """Same as adjust_counter for many rows in one statement."""
+    if not pks:
+        return
+    rows = model.objects.filter(pk__in=pks)
+    if delta < 0:
+        rows = rows.filter(**{f'{field}__gte': -delta})
+    rows.update(**{field: F(field) + delta, 'updated_at': timezone.now()})
+    if model is User:
+        forget_cached_users(*pks)
 
 
 class MyUserManager(BaseUserManager):
@@ -79,7 +198,7 @@ def user_posts_path(instance, filename):
     return f'{instance.user.id}/posts/{filename}'
 
 
-class User(AbstractBaseUser, PermissionsMixin):
+class User(DerivedFieldsMixin, StagedMediaMixin, AbstractBaseUser, PermissionsMixin):
     email = models.EmailField(
         verbose_name='email address',
         max_length=255,
@@ -88,9 +207,23 @@ class User(AbstractBaseUser, PermissionsMixin):
     first_name = models.CharField(blank=True, max_length=20)
     last_name = models.CharField(blank=True, max_length=20)
     bio = models.TextField(blank=True, max_length=70)
-    avatar = CloudinaryAvatarField('image', default=EMPTY_USER_IMAGE, proxy='http://proxy.server:3128')
+    avatar = CloudinaryAvatarField('image', default=EMPTY_USER_IMAGE)
     followers = models.ManyToManyField('self', through='Subscription', through_fields=('followee', 'follower'))
     following = models.ManyToManyField('self', through='Subscription', through_fields=('follower', 'followee'))
+    # denormalized counters, kept by Post and Subscription write paths (see reconcile_counters command)
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+    posts_count = models.PositiveIntegerField(default=0)
+    # feed posts from this date back may be missing from the capped timeline, they are pulled (see timeline)
+    timeline_horizon = models.DateTimeField(null=True, blank=True)
+    # since when posts of this account are pulled instead of pushed, kept by timeline
+    pulled_since = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    # bumped by edits of the profile only, not by counters, cached template fragments are keyed by it
+    edited_at = models.DateTimeField(auto_now=True)
+    derived_fields = ('followers_count', 'following_count', 'posts_count', 'timeline_horizon', 'pulled_since')
+    media_field = 'avatar'
+    media_variants = {'avatar': (64, True)}
 
     is_active = models.BooleanField(default=False)
     is_admin = models.BooleanField(default=False)
@@ -99,6 +232,12 @@ class User(AbstractBaseUser, PermissionsMixin):
 
     USERNAME_FIELD = 'email'
 
+    class Meta:
+        indexes = [
+            # explore page filters on the flags and walks (last_name, id) from a cursor
+            models.Index(fields=['is_active', 'is_admin', 'last_name', 'id'], name='user_explore_idx'),
+        ]
+
     def __str__(self):
         return self.email
 
@@ -108,42 +247,51 @@ class User(AbstractBaseUser, PermissionsMixin):
     def has_module_perms(self, app_label):
         return True
 
-    # code for Pillow, before using Cloudinary
-    # def save(self, *args, **kwargs):
-    #     super().save(*args, **kwargs)  # saving image first
-    #     if self.avatar:
-    #         with Image.open(self.avatar.path) as img:
-    #             if img.height > 512 or img.width > 512:
-    #                 size = (512, 512)
-    #                 img.thumbnail(size)
-    #                 img.save(self.avatar.path, format="JPEG")  # saving image at the same path
-
     @property
     def is_staff(self):
         return self.is_admin
 
 
-class Post(models.Model):
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_user(sender, instance, **kwargs):
+    # also called for raw saves of fixtures
+    forget_cached_users(instance.pk)
+
+
+class Post(DerivedFieldsMixin, StagedMediaMixin, models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     caption = models.CharField(max_length=200, blank=True)
     pub_date = models.DateTimeField('date posted', auto_now_add=True)
     likes = models.ManyToManyField(User, through='Like', related_name='users_liked')
-    image = CloudinaryPostField('image', proxy='http://proxy.server:3128')
+    image = CloudinaryPostField('image')
+    # denormalized counter, kept by Like write paths (see reconcile_counters command)
+    likes_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    # bumped by edits of the post only, not by counters, cached template fragments are keyed by it
+    edited_at = models.DateTimeField(auto_now=True)
+    derived_fields = ('likes_count',)
+    media_field = 'image'
+    media_variants = {'grid': (150, True), 'feed': (640, False), 'detail': (1080, False)}
 
     class Meta:
-        ordering = ['-pub_date']
+        ordering = ['-pub_date', '-id']
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-id'], name='post_user_pub_date_id_idx'),
+        ]
 
     def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)  # Call the "real" save() method.
-
-    # def save(self):
-    #     super().save()  # saving image first
-    #     if self.image:
-    #         with Image.open(self.image.path) as img:
-    #             if img.height > 1024 or img.width > 1024:
-    #                 size = (1024, 1024)
-    #                 img.thumbnail(size)
-    #                 img.save(self.image.path, format="JPEG")  # saving image at the same path
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)  # Call the "real" save() method.
+            if adding:
+                adjust_counter(User, self.user_id, 'posts_count', 1)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            res = super().delete(*args, **kwargs)
+            adjust_counter(User, self.user_id, 'posts_count', -1)
+        return res
 
     def get_absolute_url(self):
         return reverse('app:post_detail', kwargs={'pk': self.pk})
@@ -163,6 +311,67 @@ class Subscription(models.Model):
                                    name='followee_and_follower_cannot_be_equal')
         ]
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                adjust_counter(User, self.followee_id, 'followers_count', 1)
+                adjust_counter(User, self.follower_id, 'following_count', 1)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            res = super().delete(*args, **kwargs)
+            adjust_counter(User, self.followee_id, 'followers_count', -1)
+            adjust_counter(User, self.follower_id, 'following_count', -1)
+        return res
+
+    @classmethod
+    def follow_many(cls, follower_id, followee_ids):
+        """
+        Subscribe follower to every existing user of `followee_ids` with one insert.
+        Returns {followee_id: status}, status is 'followed', 'already_following', 'self' or 'not_found'.
+        """
+        with transaction.atomic():
+            # concurrent bulk writes of the same follower wait for each other, so counters stay exact
+            if not User.objects.select_for_update().filter(id=follower_id).exists():
+                raise User.DoesNotExist
+            found = set(User.objects.filter(id__in=followee_ids).values_list('id', flat=True))
+            followed = set(cls.objects.filter(follower=follower_id, followee__in=found)
+                           .values_list('followee_id', flat=True))
+            new = [followee_id for followee_id in found if followee_id not in followed and followee_id != follower_id]
+            cls.objects.bulk_create([cls(follower_id=follower_id, followee_id=followee_id) for followee_id in new],
+                                    ignore_conflicts=True)
+            if new:
+                adjust_counter(User, follower_id, 'following_count', len(new))
+                adjust_counters(User, new, 'followers_count', 1)
+
+        def result(followee_id):
+            if followee_id not in found:
+                return 'not_found'
+            if followee_id == follower_id:
+                return 'self'
+            return 'already_following' if followee_id in followed else 'followed'
+        return {followee_id: result(followee_id) for followee_id in followee_ids}
+
+    @classmethod
+    def unfollow_many(cls, follower_id, followee_ids):
+        """
+        Delete subscriptions of follower to `followee_ids` with one delete.
+        Returns {followee_id: status}, status is 'unfollowed' or 'not_following'.
+        """
+        with transaction.atomic():
+            if not User.objects.select_for_update().filter(id=follower_id).exists():
+                raise User.DoesNotExist
+            followed = list(cls.objects.filter(follower=follower_id, followee__in=followee_ids)
+                            .values_list('followee_id', flat=True))
+            if followed:
+                cls.objects.filter(follower=follower_id, followee__in=followed).delete()
+                adjust_counter(User, follower_id, 'following_count', -len(followed))
+                adjust_counters(User, followed, 'followers_count', -1)
+        return {followee_id: 'unfollowed' if followee_id in followed else 'not_following'
+                for followee_id in followee_ids}
+
     def __repr__(self):
         return f"{self.__class__.__name__}({self.followee}, {self.follower})"
 
@@ -179,8 +388,113 @@ class Like(models.Model):
             models.UniqueConstraint(fields=['post', 'user'], name='only_one_like_from_user'),
         ]
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                adjust_counter(Post, self.post_id, 'likes_count', 1)
+
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            res = super().delete(*args, **kwargs)
+            adjust_counter(Post, self.post_id, 'likes_count', -1)
+        return res
+
+    @classmethod
+    def set_liked(cls, post_id, user_id, liked):
+        """
+        Like or unlike the post with one write, repeating it changes nothing.
+        Returns if the like changed and the post's likes count after it.
+        """
+        with transaction.atomic():
+            if liked:
+                try:
+                    # a concurrent like of the same user fails on the unique constraint
+                    with transaction.atomic():
+                        cls(post_id=post_id, user_id=user_id).save()
+                    changed = True
+                except IntegrityError:
+                    changed = False
+            else:
+                changed = cls.objects.filter(post=post_id, user=user_id).delete()[0] > 0
+                if changed:
+                    adjust_counter(Post, post_id, 'likes_count', -1)
+            # the counter row stays locked by the update until commit
+            likes_count = Post.objects.filter(pk=post_id).values_list('likes_count', flat=True).first()
+            if likes_count is None:
+                raise Post.DoesNotExist
+        return changed, likes_count
+
     def __repr__(self):
         return f"{self.__class__.__name__}({self.post}, {self.user})"
 
     def __str__(self):
         return f"User {self.user.id} liked Post {self.post.id}"
+
+
+class PendingLike(models.Model):
+    """
+    Like or unlike accepted in buffered mode (LIKE_BUFFER setting), applied to Like
+    in batches by the flush_likes command, see like_buffer.py.
+    """
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    liked = models.BooleanField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'post', 'id'], name='pending_like_user_post_idx'),
+        ]
+
+    def __str__(self):
+        return f"User {self.user_id} {'liked' if self.liked else 'unliked'} Post {self.post_id}"
+
+
+class TimelineEntry(models.Model):
+    owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE)
+    # copy of post.pub_date, so a feed page is one range scan over the owner's index
+    pub_date = models.DateTimeField()
+
+    class Meta:
+        ordering = ['-pub_date', '-post']
+        constraints = [
+            models.UniqueConstraint(fields=['owner', 'post'], name='unique_timeline_entry'),
+        ]
+        indexes = [
+            models.Index(fields=['owner', '-pub_date', '-post'], name='timeline_owner_pub_date_idx'),
+        ]
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.owner}, {self.post})"
+
+    def __str__(self):
+        return f"Post {self.post_id} in timeline of User {self.owner_id}"
+
+
+class EmailJob(models.Model):
+    """Email waiting to be sent by the process_email_queue command."""
+    PENDING, SENT, FAILED = 'pending', 'sent', 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (SENT, 'Sent'), (FAILED, 'Failed')]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, blank=True)
+    to = models.EmailField(max_length=255)
+    status = models.CharField(max_length=7, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['next_attempt_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='email_job_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.id} to {self.to}: {self.subject} ({self.status}, attempts: {self.attempts})"
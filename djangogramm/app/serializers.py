@@ -1,35 +1,102 @@
-from datetime import datetime
+from django.db.models import Prefetch, prefetch_related_objects
+from django.utils.functional import cached_property
 from rest_framework import serializers
 from .models import Post, Subscription, Like, User
-from .helpers import get_timedelta_for_post
+from .helpers import RelativeTimeFormatter
 
 
-class UserProfilePostSerializer(serializers.ModelSerializer):
-    image = serializers.ImageField()
+class VariantImageField(serializers.Field):
+    """URL of a resized variant of the row's media, see StagedMediaMixin.variant_url."""
+
+    def __init__(self, variant, fmt='jpeg', fallback=True, **kwargs):
+        self.variant, self.fmt, self.fallback = variant, fmt, fallback
+        kwargs.setdefault('source', '*')
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        return instance.variant_url(self.variant, self.fmt, self.fallback)
+
+
+class PostLikesMixin(serializers.Serializer):
+    """
+    Ids of users who liked the post, with `pending_likes` {post_id: liked} of the
+    requesting user `user_id` from context applied (see like_buffer.py).
+    """
+    likes = serializers.SerializerMethodField()
+
+    def get_likes(self, post):
+        likes = [user.id for user in post.likes.all()]
+        pending = self.context.get('pending_likes', {}).get(post.id)
+        user_id = self.context.get('user_id')
+        if pending is True and user_id not in likes:
+            likes.append(user_id)
+        elif pending is False and user_id in likes:
+            likes.remove(user_id)
+        return likes
+
+
+class UserProfilePostSerializer(PostLikesMixin, serializers.ModelSerializer):
+    image = VariantImageField('grid')
+    image_webp = VariantImageField('grid', 'webp', fallback=False)
 
     class Meta:
         model = Post
-        fields = ['id', 'image', 'likes']
-        read_only_fields = ['id', 'image', 'likes']
+        fields = ['id', 'image', 'image_webp', 'media_ready', 'likes']
+        read_only_fields = ['id', 'image', 'image_webp', 'media_ready', 'likes']
+
+    @staticmethod
+    def prefetch(posts):
+        """Load likes of all posts in one query."""
+        prefetch_related_objects(posts, Prefetch('likes', queryset=User.objects.only('id')))
 
 
 class FeedPostSerializer(serializers.ModelSerializer):
-    user_avatar = serializers.ImageField(source='user.avatar')
+    """
+    Feed post with relative publication time, or with `pub_ts` epoch timestamp
+    when `timestamps` context is 'epoch' and the client formats it.
+    The count includes `likes_delta` {post_id: +1 or -1} of the requesting user from context,
+    whether they liked each post is asked for separately (see ViewerStatusAPI).
+    """
+    user_avatar = VariantImageField('avatar', source='user')
     first_name = serializers.CharField(source='user.first_name')
     last_name = serializers.CharField(source='user.last_name')
-    image = serializers.ImageField()
+    image = VariantImageField('feed')
+    image_webp = VariantImageField('feed', 'webp', fallback=False)
+    pub_date = serializers.SerializerMethodField()
+    pub_ts = serializers.SerializerMethodField()
+    likes_count = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
-        fields = ['id', 'image', 'caption', 'pub_date', 'user', 'user_avatar', 'first_name', 'last_name', 'likes']
-        read_only_fields = ['id', 'image', 'caption', 'pub_date', 'user', 'user_avatar', 'first_name', 'last_name', 'likes']
+        fields = ['id', 'image', 'image_webp', 'media_ready', 'caption', 'pub_date', 'pub_ts', 'user', 'user_avatar',
+                  'first_name', 'last_name', 'likes_count']
+        read_only_fields = ['id', 'image', 'image_webp', 'media_ready', 'caption', 'pub_date', 'pub_ts', 'user',
+                            'user_avatar', 'first_name', 'last_name', 'likes_count']
 
-    def to_representation(self, instance):
-        """Convert `pub_date` to time delta."""
-        ret = super().to_representation(instance)
-        pub_date = datetime.fromisoformat(ret['pub_date'])
-        ret['pub_date'] = get_timedelta_for_post(pub_date)
-        return ret
+    @staticmethod
+    def prefetch(posts):
+        """Load authors of all posts in one query."""
+        prefetch_related_objects(posts, 'user')
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fields.pop('pub_date' if self.context.get('timestamps') == 'epoch' else 'pub_ts')
+        return fields
+
+    @cached_property
+    def time_formatter(self):
+        # with many=True one child serializer formats every post of the response
+        return self.context.get('time_formatter') or RelativeTimeFormatter()
+
+    def get_pub_date(self, post):
+        return self.time_formatter(post.pub_date)
+
+    def get_pub_ts(self, post):
+        return int(post.pub_date.timestamp())
+
+    def get_likes_count(self, post):
+        return post.likes_count + self.context.get('likes_delta', {}).get(post.id, 0)
 
 
 class SubscriptionSerializer(serializers.ModelSerializer):
@@ -52,6 +119,17 @@ class LikeSerializer(serializers.ModelSerializer):
         return attrs
 
 
+class LikerSerializer(serializers.ModelSerializer):
+    first_name = serializers.CharField(source='user.first_name')
+    last_name = serializers.CharField(source='user.last_name')
+    avatar = VariantImageField('avatar', source='user')
+
+    class Meta:
+        model = Like
+        fields = ['id', 'post', 'user', 'first_name', 'last_name', 'avatar']
+        read_only_fields = ['id', 'post', 'user', 'first_name', 'last_name', 'avatar']
+
+
 class UserSerializer(serializers.ModelSerializer):
     avatar = serializers.ImageField()
 
@@ -59,3 +137,12 @@ class UserSerializer(serializers.ModelSerializer):
         model = User
         fields = ['first_name', 'last_name', 'avatar']
         read_only_fields = ['first_name', 'last_name', 'avatar']
+
+
+class UserCardSerializer(serializers.ModelSerializer):
+    avatar = VariantImageField('avatar')
+
+    class Meta:
+        model = User
+        fields = ['id', 'first_name', 'last_name', 'avatar']
+        read_only_fields = ['id', 'first_name', 'last_name', 'avatar']
@@ -0,0 +1,40 @@
+"use strict"
+
+document.addEventListener("DOMContentLoaded", function() {
+    const userList = document.getElementById('userList')
+    const moreLink = document.getElementById('moreUsers')
+    let loading = false
+
+    if (!moreLink) {
+        return
+    }
+    // cards are appended while scrolling, the link is kept for browsers without scripts
+    moreLink.hidden = true
+
+    function loadUsers () {
+        loading = true
+        fetch(`${moreLink.href}&partial=1`)
+            .then(response => {
+                const nextCursor = response.headers.get('X-Next-Cursor')
+                return response.text().then(html => {
+                    userList.insertAdjacentHTML('beforeend', html)
+                    if (nextCursor) {
+                        moreLink.search = `?cursor=${encodeURIComponent(nextCursor)}`
+                    }
+                    else {
+                        moreLink.remove()
+                    }
+                    loading = false
+                })
+            })
+    }
+
+    window.addEventListener('scroll', function() {
+        let windowRelativeBottom = document.documentElement.getBoundingClientRect().bottom
+        if (windowRelativeBottom < document.documentElement.clientHeight + 10) {
+            if (!loading && moreLink.isConnected) {
+                loadUsers()
+            }
+        }
+    })
+})
@@ -3,78 +3,74 @@
 const curScriptElement = document.currentScript
 
 document.addEventListener("DOMContentLoaded", function() {
-    let start = 0
-    const offset = 7
-    getPosts(start, offset, true)
-    const total_num_posts = curScriptElement.getAttribute('total_num_posts')
+    const limit = 7
+    let nextCursor = null
+    let hasMore = false
+    let loading = false
+
+    function loadPosts (firstTime=false) {
+        loading = true
+        getPosts(nextCursor, limit, firstTime)
+            .then(page => {
+                nextCursor = page.nextCursor
+                hasMore = page.hasMore
+                loading = false
+                loadLikedStates(page.setLiked)
+            })
+    }
+
+    loadPosts(true)
 
     window.addEventListener('scroll', function() {
         let windowRelativeBottom = document.documentElement.getBoundingClientRect().bottom
         if (windowRelativeBottom < document.documentElement.clientHeight + 10) {
-            start += offset
-            if (start < total_num_posts) {
-                getPosts(start, offset)
+            if (!loading && hasMore) {
+                loadPosts()
             }
         }
     })
 
-    const likesModal = document.getElementById('likesModal')
-    likesModal.addEventListener('show.bs.modal', function (event) {
-        const link = event.relatedTarget
-        const likes = link.getAttribute('data-bs-likes')
-        const likesArray = likes.split(",");
-        const modalList = likesModal.querySelector('.ppl-liked')
-        if (likesArray.length === 1 && likesArray[0] === '') {
-            modalList.textContent = "No likes yet"
-        }
-        else {
-            modalList.innerHTML = ''
-            likesArray.forEach((personId) => {
-                const personItem = document.createElement('li')
-                personItem.className = 'person-liked'
-                fetch(`${window.location.origin}/app/user/${personId}/fullname`)
-                    .then(response => response.json())
-                    .then(data => {
-                        const avatarLink = document.createElement('a')
-                        avatarLink.href = `${window.location.origin}/app/${personId}/profile`
-                        const avatarImg = document.createElement('img')
-                        avatarImg.src = data.avatar
-                        avatarLink.appendChild(avatarImg)
-                        personItem.appendChild(avatarLink)
-
-                        const nameLink = document.createElement('a')
-                        nameLink.href = `${window.location.origin}/app/${personId}/profile`
-                        const fullName = document.createElement('span')
-                        fullName.textContent = `${data.first_name} ${data.last_name}`
-                        fullName.className = 'name ms-2'
-                        nameLink.appendChild(fullName)
-                        personItem.appendChild(nameLink)
-                    });
-                modalList.appendChild(personItem)
-            })
-        }
-    })
+    lazyLoadLikers(document.getElementById('likesModal'))
 })
 
-function getPosts (start, offset, firstTime=false) {
-    fetch(`${window.location.origin}/app/posts?offset=${offset}&start=${start}`)
+function getPosts (cursor, limit, firstTime=false) {
+    // publication time comes as epoch seconds and is formatted here
+    let url = `${window.location.origin}/app/posts?limit=${limit}&timestamps=epoch`
+    if (cursor) {
+        url += `&cursor=${encodeURIComponent(cursor)}`
+    }
+    // revalidate with the stored ETag, unchanged pages come back as 304 and are served from the browser cache
+    return fetch(url, {cache: 'no-cache'})
     .then (response => response.json())
     .then (json => {
-        if (json.length === 0 && firstTime) {
+        if (json.results.length === 0 && firstTime) {
             const el = document.createElement("div")
             el.innerHTML = "You don't follow anyone yet <br> find people in <strong>'explore'</strong> link!"
             el.style = 'text-align: center;'
             document.getElementById('content').append(el)
         }
-        else {
-            showPosts(json)
-        }
+        return {nextCursor: json.next_cursor, hasMore: json.has_more, setLiked: showPosts(json.results)}
+    })
+}
+
+function loadLikedStates (setLiked) {
+    // liked state of the whole page in one request
+    const ids = Array.from(setLiked.keys())
+    if (ids.length === 0) {
+        return
+    }
+    fetch(`${window.location.origin}/app/viewer/status?post_ids=${ids.join(',')}`)
+    .then(response => response.json())
+    .then(json => {
+        setLiked.forEach((setter, postId) => setter(json.liked[postId] === true))
     })
 }
 
 function showPosts (posts) {
+    // returns Map of post id to a function setting whether the current user liked it
     const container = document.querySelector('.posts')
-    const authUserID = JSON.parse(document.getElementById('authUserId').textContent)
+    const now = new Date()
+    const setLiked = new Map()
     posts.forEach(post => {
         const divPost = document.createElement('div')
         divPost.classList.add('card');
@@ -103,9 +99,13 @@ function showPosts (posts) {
 
         const divPhoto = document.createElement('div')
         divPhoto.classList.add('photo')
-        const imgPhoto = document.createElement('img')
-        imgPhoto.src = post.image
-        divPhoto.append(imgPhoto)
+        if (post.media_ready) {
+            divPhoto.append(createPicture(post.image, post.image_webp))
+        }
+        else {
+            divPhoto.classList.add('media-pending')
+            divPhoto.textContent = 'Photo is being uploaded'
+        }
 
         const likeContainer = document.createElement('div')
         likeContainer.className = 'like-container d-flex mt-3 ms-3'
@@ -113,23 +113,29 @@ function showPosts (posts) {
         heart.className = 'heart d-flex align-items-center'
         heart.id = 'heart'
         const heartSvg = document.createElement('i')
-        let liked = post.likes.includes(authUserID)
+        let liked = false
+        let clicked = false
         setHeart(heartSvg, liked)
+        setLiked.set(post.id, value => {
+            // a click made before the state arrived wins
+            if (!clicked) {
+                liked = value
+                setHeart(heartSvg, liked)
+            }
+        })
         heart.appendChild(heartSvg)
         likeContainer.appendChild(heart)
         const amountContainer = document.createElement('div')
         amountContainer.className = 'number-likes ps-2 d-flex align-items-center'
         amountContainer.setAttribute('data-bs-toggle', 'modal')
         amountContainer.setAttribute('data-bs-target', '#likesModal')
-        amountContainer.setAttribute('data-bs-likes', post.likes)
+        amountContainer.setAttribute('data-bs-url', `${window.location.origin}/app/likes/${post.id}`)
         const number = document.createElement('span')
         number.className = 'me-1'
         number.id = 'num-likes'
         const likeWord = document.createElement('span')
         likeWord.id = 'like-word'
-        let numberOfLikes = post.likes.length
-        number.textContent = numberOfLikes
-        likeWord.textContent = numberOfLikes === 1 ? 'like' : 'likes'
+        setNumLikes(number, likeWord, post.likes_count)
         amountContainer.appendChild(number)
         amountContainer.appendChild(likeWord)
         likeContainer.appendChild(amountContainer)
@@ -147,7 +153,7 @@ function showPosts (posts) {
         const divDate = document.createElement('div')
         divDate.className = 'date ms-3 my-3'
         const pDate = document.createElement('p')
-        pDate.textContent = `${post.pub_date}`
+        pDate.textContent = formatPubDate(post.pub_ts, now)
         divDate.append(pDate)
 
         divPost.append(divAuthorPost)
@@ -159,52 +165,152 @@ function showPosts (posts) {
         container.append(divPost)
 
         heart.addEventListener('click', () => {
+            clicked = true
             liked = !liked
-            if (!liked) {
-                fetch(`${window.location.origin}/app/likes/${post.id}/${authUserID}`, {
-                        method: 'DELETE',
-                        headers: {
-                            'Content-Type': 'application/json',
-                            'X-CSRFToken': getCookie('csrftoken'),
-                        },
-                    })
-                    .then(response => {
-                        if (response.ok) {
-                            setHeart(heartSvg, liked)
-                            adjustNumLikes(number, likeWord, -1)
-                        }
-                        else {
-                            alert(`You request cannot be proceeded (error code ${response.status}), please reload the page`)
-                        }
-                    })
-                    .catch((error) => {
-                      alert(`There has been a problem with your fetch operation: ${error}`)
-                    });
-            }
-            else {
-                fetch(`${window.location.origin}/app/likes/${post.id}`, {
-                        method: 'POST',
-                        headers: {
-                            'Content-Type': 'application/json',
-                            'X-CSRFToken': getCookie('csrftoken'),
-                        },
-                        body: JSON.stringify({'user_id': authUserID}),
-                    })
-                    .then(response => {
-                        if (response.ok) {
-                            setHeart(heartSvg, liked)
-                            adjustNumLikes(number, likeWord, 1)
-                        }
-                        else {
-                            alert(`You request cannot be proceeded (error code ${response.status}), please reload the page`)
-                        }
-                    })
-                    .catch((error) => {
-                      alert(`There has been a problem with your fetch operation: ${error}`)
-                    });
+            setHeart(heartSvg, liked)
+            fetch(`${window.location.origin}/app/likes/${post.id}/toggle`, {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                        'X-CSRFToken': getCookie('csrftoken'),
+                    },
+                    body: JSON.stringify({'liked': liked}),
+                })
+                .then(response => {
+                    if (!response.ok) {
+                        throw new Error(`error code ${response.status}`)
+                    }
+                    return response.json()
+                })
+                .then(json => {
+                    // response of an earlier click is stale, the count is set by the latest one
+                    if (json.liked === liked) {
+                        setNumLikes(number, likeWord, json.likes_count)
+                    }
+                })
+                .catch((error) => {
+                  liked = !liked
+                  setHeart(heartSvg, liked)
+                  alert(`You request cannot be proceeded (${error}), please reload the page`)
+                });
+        })
+    })
+    return setLiked
+}
+
+
+function lazyLoadLikers (modal) {
+    // likers of the clicked post are fetched page by page when the modal is opened and scrolled
+    const list = modal.querySelector('.ppl-liked')
+    const body = modal.querySelector('.modal-body')
+    let url = null
+    let nextCursor = null
+    let loading = false
+
+    function loadPage (firstPage=false) {
+        loading = true
+        let pageUrl = url
+        if (nextCursor) {
+            pageUrl += `?cursor=${encodeURIComponent(nextCursor)}`
+        }
+        fetch(pageUrl)
+        .then(response => response.json())
+        .then(json => {
+            if (firstPage) {
+                list.innerHTML = ''
+                if (json.results.length === 0) {
+                    list.innerHTML = '<li>No likes yet</li>'
+                }
             }
+            json.results.forEach(like => list.appendChild(likerItem(like)))
+            nextCursor = json.next_cursor
+            loading = false
         })
+    }
+
+    modal.addEventListener('show.bs.modal', event => {
+        url = event.relatedTarget.getAttribute('data-bs-url')
+        nextCursor = null
+        list.innerHTML = ''
+        loadPage(true)
     })
+    body.addEventListener('scroll', () => {
+        if (body.scrollTop + body.clientHeight > body.scrollHeight - 50 && !loading && nextCursor) {
+            loadPage()
+        }
+    })
+}
+
+
+function likerItem (like) {
+    const item = document.createElement('li')
+    const div = document.createElement('div')
+    div.className = 'person-liked'
+    const avatarLink = document.createElement('a')
+    avatarLink.href = `${window.location.origin}/app/${like.user}/profile`
+    const avatarImg = document.createElement('img')
+    avatarImg.src = like.avatar
+    avatarImg.alt = 'avatar'
+    avatarLink.appendChild(avatarImg)
+    const nameLink = document.createElement('a')
+    nameLink.href = `${window.location.origin}/app/${like.user}/profile`
+    const name = document.createElement('span')
+    name.className = 'name ms-2'
+    name.textContent = `${like.first_name} ${like.last_name}`
+    nameLink.appendChild(name)
+    div.append(avatarLink, nameLink)
+    item.appendChild(div)
+    return item
+}
+
+function createPicture (jpegUrl, webpUrl) {
+    // WebP variant when the browser supports it, JPEG otherwise
+    const img = document.createElement('img')
+    img.src = jpegUrl
+    if (!webpUrl) {
+        return img
+    }
+    const picture = document.createElement('picture')
+    const source = document.createElement('source')
+    source.srcset = webpUrl
+    source.type = 'image/webp'
+    picture.append(source, img)
+    return picture
+}
+
+function formatPubDate (timestamp, now) {
+    // same rules as helpers.RelativeTimeFormatter on the server
+    const pubDate = new Date(timestamp * 1000)
+    const seconds = Math.floor((now - pubDate) / 1000)
+    const days = Math.floor(seconds / 86400)
+    let res = 'undefined'
+    if (days === 0) {
+        if (seconds >= 3600) {
+            const hoursAgo = Math.floor(seconds / 3600)
+            res = hoursAgo === 1 ? '1 hour ago' : `${hoursAgo} hours ago`
+        }
+        else if (seconds >= 60) {
+            const minAgo = Math.floor(seconds / 60)
+            res = minAgo === 1 ? '1 minute ago' : `${minAgo} minutes ago`
+        }
+        else {
+            res = seconds < 10 ? 'seconds ago' : `${seconds} seconds ago`
+        }
+    }
+    else if (days >= 1 && days <= 6) {
+        res = days === 1 ? '1 day ago' : `${days} days ago`
+    }
+    else if (days === 7) {
+        res = '1 week ago'
+    }
+    else if (days > 7) {
+        const month = pubDate.toLocaleString('en-US', {month: 'long'})
+        res = `${month} ${pubDate.getDate()}`
+        if (pubDate.getFullYear() !== now.getFullYear()) {
+            res += `, ${pubDate.getFullYear()}`
+        }
+    }
+    return res.toUpperCase()
 }
 
 function setHeart (i, liked) {
@@ -216,10 +322,7 @@ function setHeart (i, liked) {
     }
 }
 
-function adjustNumLikes(numLikes, likeWord, delta) {
-    let num = numLikes.textContent
-    num = parseInt(num, 10)
-    num += delta
+function setNumLikes(numLikes, likeWord, num) {
     numLikes.textContent = num
     if (num === 1) {
         likeWord.textContent = 'like'
@@ -4,60 +4,109 @@
 document.addEventListener("DOMContentLoaded", function() {
     let liked = JSON.parse(document.getElementById('liked').textContent)
     const postId = JSON.parse(document.getElementById('postId').textContent)
-    const userId = JSON.parse(document.getElementById('userId').textContent)
     const heart = document.getElementById('heart')
     const i = heart.getElementsByTagName('i')[0]
     setHeart(i, liked)
 
+    lazyLoadLikers(document.getElementById('likesModal'))
+
     const numLikes = document.getElementById('num-likes')
     const likeWord = document.getElementById('like-word')
     heart.addEventListener('click', () => {
         liked = !liked
-        if (!liked) {
-            fetch(`${window.location.origin}/app/likes/${postId}/${userId}`, {
-                    method: 'DELETE',
-                    headers: {
-                        'Content-Type': 'application/json',
-                        'X-CSRFToken': getCookie('csrftoken'),
-                    },
-                })
-                .then(response => {
-                    if (response.ok) {
-                        setHeart(i, liked)
-                        adjustNumLikes(numLikes, likeWord, -1)
-                    }
-                    else {
-                        alert(`You request cannot be proceeded (error code ${response.status}), please reload the page`)
-                    }
-                })
-                .catch((error) => {
-                  alert(`There has been a problem with your fetch operation: ${error}`)
-                });
+        setHeart(i, liked)
+        fetch(`${window.location.origin}/app/likes/${postId}/toggle`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'X-CSRFToken': getCookie('csrftoken'),
+                },
+                body: JSON.stringify({'liked': liked}),
+            })
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error(`error code ${response.status}`)
+                }
+                return response.json()
+            })
+            .then(json => {
+                // response of an earlier click is stale, the count is set by the latest one
+                if (json.liked === liked) {
+                    setNumLikes(numLikes, likeWord, json.likes_count)
+                }
+            })
+            .catch((error) => {
+              liked = !liked
+              setHeart(i, liked)
+              alert(`You request cannot be proceeded (${error}), please reload the page`)
+            });
+    })
+})
+
+
+function lazyLoadLikers (modal) {
+    // likers are fetched page by page when the modal is opened and scrolled
+    const list = modal.querySelector('.ppl-liked')
+    const body = modal.querySelector('.modal-body')
+    let nextCursor = null
+    let loading = false
+
+    function loadPage (firstPage=false) {
+        loading = true
+        let url = list.dataset.url
+        if (nextCursor) {
+            url += `?cursor=${encodeURIComponent(nextCursor)}`
+        }
+        fetch(url)
+        .then(response => response.json())
+        .then(json => {
+            if (firstPage) {
+                list.innerHTML = ''
+                if (json.results.length === 0) {
+                    list.innerHTML = '<li>No likes yet</li>'
+                }
+            }
+            json.results.forEach(like => list.appendChild(likerItem(like)))
+            nextCursor = json.next_cursor
+            loading = false
+        })
+    }
+
+    // likes change while the page is open, so the list is reloaded every time
+    modal.addEventListener('show.bs.modal', () => {
+        if (!loading) {
+            nextCursor = null
+            loadPage(true)
         }
-        else {
-            fetch(`${window.location.origin}/app/likes/${postId}`, {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                        'X-CSRFToken': getCookie('csrftoken'),
-                    },
-                    body: JSON.stringify({'user_id': userId}),
-                })
-                .then(response => {
-                    if (response.ok) {
-                        setHeart(i, liked)
-                        adjustNumLikes(numLikes, likeWord, 1)
-                    }
-                    else {
-                        alert(`You request cannot be proceeded (error code ${response.status}), please reload the page`)
-                    }
-                })
-                .catch((error) => {
-                  alert(`There has been a problem with your fetch operation: ${error}`)
-                });
+    })
+    body.addEventListener('scroll', () => {
+        if (body.scrollTop + body.clientHeight > body.scrollHeight - 50 && !loading && nextCursor) {
+            loadPage()
         }
     })
-})
+}
+
+
+function likerItem (like) {
+    const item = document.createElement('li')
+    const div = document.createElement('div')
+    div.className = 'person-liked'
+    const avatarLink = document.createElement('a')
+    avatarLink.href = `${window.location.origin}/app/${like.user}/profile`
+    const avatarImg = document.createElement('img')
+    avatarImg.src = like.avatar
+    avatarImg.alt = 'avatar'
+    avatarLink.appendChild(avatarImg)
+    const nameLink = document.createElement('a')
+    nameLink.href = `${window.location.origin}/app/${like.user}/profile`
+    const name = document.createElement('span')
+    name.className = 'name ms-2'
+    name.textContent = `${like.first_name} ${like.last_name}`
+    nameLink.appendChild(name)
+    div.append(avatarLink, nameLink)
+    item.appendChild(div)
+    return item
+}
 
 
 function setHeart (i, liked) {
@@ -69,10 +118,7 @@ function setHeart (i, liked) {
     }
 }
 
-function adjustNumLikes(numLikes, likeWord, delta) {
-    let num = numLikes.textContent
-    num = parseInt(num, 10)
-    num += delta
+function setNumLikes(numLikes, likeWord, num) {
     numLikes.textContent = num
     if (num === 1) {
         likeWord.textContent = 'like'
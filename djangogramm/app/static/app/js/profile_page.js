@@ -3,26 +3,39 @@
 const curScriptElement = document.currentScript
 
 document.addEventListener("DOMContentLoaded", function() {
-    let start = 0
-    let offset = 9
+    const limit = 9
+    let nextCursor = null
+    let hasMore = false
+    let loading = false
     let userID = curScriptElement.getAttribute('user_id')
-    let post_count = curScriptElement.getAttribute('post_count')
     const followData = JSON.parse(document.getElementById('follow-data').textContent)
     const authUserID = JSON.parse(document.getElementById('auth-user-id').textContent)
     let canFollow = followData['can_follow']
 
-    getPosts(start, offset, userID)
+    function loadPosts () {
+        loading = true
+        getPosts(nextCursor, limit, userID)
+            .then(page => {
+                nextCursor = page.nextCursor
+                hasMore = page.hasMore
+                loading = false
+            })
+    }
+
+    loadPosts()
 
     window.addEventListener('scroll', function() {
         let windowRelativeBottom = document.documentElement.getBoundingClientRect().bottom
         if (windowRelativeBottom < document.documentElement.clientHeight + 50) {
-            start += offset
-            if (start < post_count) {
-                getPosts(start, offset, userID)
+            if (!loading && hasMore) {
+                loadPosts()
             }
         }
     })
 
+    lazyLoadUsers(document.getElementById('followersModal'), 'followers', 'follower')
+    lazyLoadUsers(document.getElementById('followingModal'), 'followees', 'followee')
+
     if (canFollow) {
         const bio = document.getElementById('bio')
         const btnFollow = document.createElement('button')
@@ -80,6 +93,70 @@ document.addEventListener("DOMContentLoaded", function() {
 })
 
 
+function lazyLoadUsers (modal, listClass, itemClass) {
+    // users are fetched page by page when the modal is opened and scrolled
+    const list = modal.querySelector(`.${listClass}`)
+    const body = modal.querySelector('.modal-body')
+    let nextCursor = null
+    let loading = false
+    let loaded = false
+
+    function loadPage () {
+        loading = true
+        let url = list.dataset.url
+        if (nextCursor) {
+            url += `?cursor=${encodeURIComponent(nextCursor)}`
+        }
+        fetch(url)
+        .then(response => response.json())
+        .then(json => {
+            if (!loaded && json.results.length === 0) {
+                const item = document.createElement('li')
+                item.textContent = list.dataset.empty
+                list.appendChild(item)
+            }
+            json.results.forEach(user => list.appendChild(userItem(user, itemClass)))
+            nextCursor = json.next_cursor
+            loaded = true
+            loading = false
+        })
+    }
+
+    modal.addEventListener('show.bs.modal', () => {
+        if (!loaded && !loading) {
+            loadPage()
+        }
+    })
+    body.addEventListener('scroll', () => {
+        if (body.scrollTop + body.clientHeight > body.scrollHeight - 50 && !loading && nextCursor) {
+            loadPage()
+        }
+    })
+}
+
+
+function userItem (user, itemClass) {
+    const item = document.createElement('li')
+    const div = document.createElement('div')
+    div.className = itemClass
+    const avatarLink = document.createElement('a')
+    avatarLink.href = `${window.location.origin}/app/${user.id}/profile`
+    const avatarImg = document.createElement('img')
+    avatarImg.src = user.avatar
+    avatarImg.alt = 'avatar'
+    avatarLink.appendChild(avatarImg)
+    const nameLink = document.createElement('a')
+    nameLink.href = `${window.location.origin}/app/${user.id}/profile`
+    const name = document.createElement('span')
+    name.className = 'name ms-2'
+    name.textContent = `${user.first_name} ${user.last_name}`
+    nameLink.appendChild(name)
+    div.append(avatarLink, nameLink)
+    item.appendChild(div)
+    return item
+}
+
+
 function setFollowOption (btn, isFollowing) {
     if (!isFollowing) {
         btn.innerHTML = 'Follow'
@@ -130,10 +207,18 @@ function getCookie(name) {
 }
 
 
-function getPosts (start, offset, userID) {
-    fetch(`${window.location.origin}/app/posts?user_id=${userID}&offset=${offset}&start=${start}`)
+function getPosts (cursor, limit, userID) {
+    let url = `${window.location.origin}/app/posts?user_id=${userID}&limit=${limit}`
+    if (cursor) {
+        url += `&cursor=${encodeURIComponent(cursor)}`
+    }
+    // revalidate with the stored ETag, unchanged pages come back as 304 and are served from the browser cache
+    return fetch(url, {cache: 'no-cache'})
     .then (response => response.json())
-    .then (json => showPosts(json))
+    .then (json => {
+        showPosts(json.results)
+        return {nextCursor: json.next_cursor, hasMore: json.has_more}
+    })
 }
 
 
@@ -144,9 +229,15 @@ function showPosts (posts) {
         div.classList.add("post-area");
         const hyperlink = document.createElement('a')
         hyperlink.href = `${window.location.origin}/app/p/${post.id}`
-        const img = document.createElement('img')
-        img.src = post.image
-        hyperlink.appendChild(img)
+        if (post.media_ready) {
+            hyperlink.appendChild(createPicture(post.image, post.image_webp))
+        }
+        else {
+            const placeholder = document.createElement('div')
+            placeholder.className = 'media-pending'
+            placeholder.textContent = 'Uploading'
+            hyperlink.appendChild(placeholder)
+        }
         const numLikes = document.createElement('div')
         numLikes.className = 'num-likes'
         const i = document.createElement('i')
@@ -160,4 +251,20 @@ function showPosts (posts) {
         userPosts.append(div)
 
     })
-}
\ No newline at end of file
+}
+
+
+function createPicture (jpegUrl, webpUrl) {
+    // WebP variant when the browser supports it, JPEG otherwise
+    const img = document.createElement('img')
+    img.src = jpegUrl
+    if (!webpUrl) {
+        return img
+    }
+    const picture = document.createElement('picture')
+    const source = document.createElement('source')
+    source.srcset = webpUrl
+    source.type = 'image/webp'
+    picture.append(source, img)
+    return picture
+}
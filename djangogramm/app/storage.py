@@ -0,0 +1,146 @@
+"""Media storage backends.
+
+Media fields (see models.CloudinaryAvatarField and CloudinaryPostField) keep a storage name
+in the database and hand uploads to the backend selected by the MEDIA_STORAGE setting:
+Cloudinary in production, or the local file system under MEDIA_ROOT for offline runs and benchmarks.
+"""
+
+import hashlib
+import os
+import re
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from urllib.parse import urljoin
+
+from cloudinary import CloudinaryResource, uploader
+from cloudinary.models import CLOUDINARY_FIELD_DB_RE
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+class MediaStorage(ABC):
+    """Stores uploaded media under `folder`/`public_id` and resolves stored names to field values."""
+
+    def __init__(self, **options):
+        self.options = options
+
+    @abstractmethod
+    def save(self, content, folder: str, public_id: str, fmt: str = None) -> str:
+        """Store `content` and return the name kept in the database."""
+
+    def store(self, content, folder: str, public_id: str, fmt: str = None) -> str:
+        """
+        Like `save`, for `public_id` derived from the content (see content_hash):
+        storing the same bytes again reuses the stored asset.
+        """
+        return self.save(content, folder, public_id, fmt)
+
+    @abstractmethod
+    def resource(self, name: str):
+        """Value of a media field for stored `name`, it has `url` and `public_id`."""
+
+    def url(self, name: str) -> str:
+        return self.resource(name).url
+
+
+class CloudinaryStorage(MediaStorage):
+    """Names are Cloudinary resource paths like image/upload/v1/<public_id>.<format>."""
+
+    def save(self, content, folder, public_id, fmt=None):
+        # Cloudinary returns the existing asset instead of uploading it again
+        options = {'type': 'upload', 'resource_type': 'image', 'folder': folder, 'public_id': public_id,
+                   'overwrite': False, **self.options}
+        if fmt:
+            options['format'] = fmt
+        if hasattr(content, 'seekable') and content.seekable():
+            content.seek(0)
+        return uploader.upload_resource(content, **options).get_prep_value()
+
+    def resource(self, name):
+        match = re.match(CLOUDINARY_FIELD_DB_RE, name)
+        return CloudinaryResource(type=match.group('type') or 'upload',
+                                  resource_type=match.group('resource_type') or 'image',
+                                  version=match.group('version'), public_id=match.group('public_id'),
+                                  format=match.group('format'))
+
+
+class LocalMedia:
+    """Field value of media stored by FileSystemMediaStorage, mirrors CloudinaryResource."""
+
+    def __init__(self, name, url):
+        self.name, self.url = name, url
+        self.public_id, ext = os.path.splitext(name)
+        self.format = ext.lstrip('.') or None
+
+    def __str__(self):
+        return self.public_id
+
+    def __bool__(self):
+        return bool(self.name)
+
+    def __eq__(self, other):
+        return isinstance(other, LocalMedia) and other.name == self.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+    def get_prep_value(self):
+        return self.name
+
+    def build_url(self, **options):
+        return self.url
+
+
+class FileSystemMediaStorage(MediaStorage):
+    """Names are paths relative to MEDIA_ROOT, served from MEDIA_URL."""
+
+    def __init__(self, **options):
+        super().__init__(**options)
+        self.storage = FileSystemStorage(location=options.get('location'), base_url=options.get('base_url'))
+
+    @staticmethod
+    def name(content, folder, public_id, fmt=None):
+        ext = fmt or os.path.splitext(getattr(content, 'name', '') or '')[1].lstrip('.') or 'jpg'
+        return f'{folder}{public_id}.{ext}'
+
+    def save(self, content, folder, public_id, fmt=None):
+        name = self.name(content, folder, public_id, fmt)
+        # same public id replaces the stored file, like an overwriting Cloudinary upload
+        self.storage.delete(name)
+        if hasattr(content, 'seekable') and content.seekable():
+            content.seek(0)
+        return self.storage.save(name, content)
+
+    def store(self, content, folder, public_id, fmt=None):
+        name = self.name(content, folder, public_id, fmt)
+        if self.storage.exists(name):
+            return name
+        return self.save(content, folder, public_id, fmt)
+
+    def resource(self, name):
+        return LocalMedia(name, urljoin(self.storage.base_url, name))
+
+
+def content_hash(content) -> str:
+    """Asset id of file-like `content`, equal for equal bytes."""
+    digest = hashlib.sha256()
+    content.seek(0)
+    for chunk in iter(lambda: content.read(64 * 1024), b''):
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()[:32]
+
+
+@lru_cache(maxsize=None)
+def media_storage() -> MediaStorage:
+    storage_class = import_string(getattr(settings, 'MEDIA_STORAGE', 'app.storage.CloudinaryStorage'))
+    return storage_class(**getattr(settings, 'MEDIA_STORAGE_OPTIONS', {}))
+
+
+@receiver(setting_changed)
+def reset_media_storage(setting, **kwargs):
+    if setting in ('MEDIA_STORAGE', 'MEDIA_STORAGE_OPTIONS', 'MEDIA_ROOT', 'MEDIA_URL'):
+        media_storage.cache_clear()
@@ -1,5 +1,7 @@
 import calendar
 from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html
 
 register = template.Library()
 
@@ -7,3 +9,20 @@ register = template.Library()
 @register.filter
 def month_name(month_number):
     return calendar.month_name[month_number]
+
+
+@register.simple_tag
+def variant_picture(obj, variant, **attrs):
+    """<picture> with WebP variant of the object's media and JPEG fallback, see StagedMediaMixin.variant_url."""
+    img_attrs = flatatt(attrs)
+    webp = obj.variant_url(variant, 'webp', fallback=False)
+    if not webp:
+        return format_html('<img src="{}"{}>', obj.variant_url(variant), img_attrs)
+    return format_html('<picture><source srcset="{}" type="image/webp"><img src="{}"{}></picture>',
+                       webp, obj.variant_url(variant), img_attrs)
+
+
+@register.simple_tag
+def media_img(media, **attrs):
+    """<img> of a media field value from any storage backend, in JPEG where the storage converts formats."""
+    return format_html('<img src="{}"{}>', media.build_url(format='jpg') if media else '', flatatt(attrs))
@@ -1,26 +1,49 @@
+import json
 import os
 import re
 import shutil
+import tempfile
+import threading
 import time
 import unittest
 
+from io import BytesIO, StringIO
+from smtplib import SMTPException
+from unittest import mock
 from datetime import datetime, timedelta
 
 import pytz
+from asgiref.sync import async_to_sync
+from cloudinary import CloudinaryResource
 from django.contrib.staticfiles.testing import StaticLiveServerTestCase
-from django.test import TestCase, Client
+from django.test import TestCase, TransactionTestCase, Client
+from django.test.utils import CaptureQueriesContext
 from django.core import mail
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.mail import get_connection
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
 from django.conf import settings
 from django.urls import reverse
+from django.utils import timezone
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from webdriver_manager.chrome import ChromeDriverManager
-from rest_framework.test import APITestCase, APIClient
+from rest_framework.test import APITestCase, APIClient, APIRequestFactory, force_authenticate
 from rest_framework import status
-
-from .helpers import get_timedelta_for_post
-from .models import User, Post, Subscription
-from .views import Authentication, UserEnterInfoView, Feed, Register, UserProfile, PostDetail
+from PIL import Image
+
+from .helpers import get_timedelta_for_post, RelativeTimeFormatter
+from .models import User, Post, Subscription, Like, TimelineEntry, EmailJob, PendingLike, MEDIA_FAILED, MEDIA_PENDING, \
+    MEDIA_UPLOADING
+from . import images, like_buffer, mail_queue, media, timeline, views
+from .async_views import async_view
+from .views import Authentication, UserEnterInfoView, Feed, Register, UserProfile, PostDetail, ExploreUserListView
+from .serializers import FeedPostSerializer
+from .storage import CloudinaryStorage, MediaStorage
 from .forms import UserLoginForm, UserRegisterForm, UserFullInfoForm
 
 
@@ -111,6 +134,9 @@ class RegisterViewTestCase(TestCase):
         data = {'email': 'test@mail.ru', 'password': 'test', 'confirm_password': 'test', 'proceed': 'register'}
         response = self.c.post('/app/register', data=data, follow=True, secure=True)
         self.assertEqual(response.status_code, 200)
+        # email is queued by the view and sent by the worker
+        self.assertEqual(len(mail.outbox), 0)
+        call_command('process_email_queue', '--once', stdout=StringIO())
         self.assertEqual(len(mail.outbox), 1)
         self.assertEqual(mail.outbox[0].subject, 'Activate your DjangoGramm account.')
         self.assertTemplateUsed(response=response, template_name='app/acc_active_email.html')
@@ -131,6 +157,38 @@ class RegisterViewTestCase(TestCase):
         self.assertTrue(user.is_active)
 
 
+class MailQueueTestCase(TestCase):
+    def test_batch_uses_one_connection(self):
+        """Due emails are sent over one connection and marked as sent."""
+        for i in range(3):
+            mail_queue.enqueue('Subject', 'Body', f'user{i}@mail.com')
+        with mock.patch('app.mail_queue.get_connection', wraps=get_connection) as connect:
+            self.assertEqual(mail_queue.process_batch(), (3, 0))
+        connect.assert_called_once()
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(EmailJob.objects.filter(status=EmailJob.SENT).count(), 3)
+        self.assertEqual(mail_queue.process_batch(), (0, 0))
+
+    def test_failed_email_is_retried_with_backoff(self):
+        """Failed email is postponed with growing delay and given up after MAX_ATTEMPTS."""
+        job = mail_queue.enqueue('Subject', 'Body', 'user@mail.com')
+        with mock.patch('app.mail_queue.EmailMessage.send', side_effect=SMTPException('unavailable')):
+            for attempt in range(1, mail_queue.MAX_ATTEMPTS + 1):
+                EmailJob.objects.filter(id=job.id).update(next_attempt_at=timezone.now())
+                self.assertEqual(mail_queue.process_batch(), (0, 1))
+                job.refresh_from_db()
+                self.assertEqual(job.attempts, attempt)
+                if attempt < mail_queue.MAX_ATTEMPTS:
+                    delay = job.next_attempt_at - timezone.now()
+                    self.assertAlmostEqual(delay.total_seconds(), mail_queue.retry_delay(attempt).total_seconds(),
+                                           delta=5)
+                    # not due until the delay passes
+                    self.assertEqual(mail_queue.process_batch(), (0, 0))
+        self.assertEqual(job.status, EmailJob.FAILED)
+        self.assertIn('unavailable', job.last_error)
+        self.assertEqual(len(mail.outbox), 0)
+
+
 class LogoutViewTestCase(TestCase):
     def setUp(self):
         self.c = Client()
@@ -232,6 +290,149 @@ class UserEditInfoTestCase(TestCase):
         self.assertEqual(response.status_code, 403)
 
 
+class MediaQueueTestCase(TestCase):
+    def setUp(self):
+        self.staging_root, self.media_root = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.staging_root)
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = self.settings(MEDIA_STAGING_ROOT=self.staging_root, MEDIA_ROOT=self.media_root,
+                                          MEDIA_URL='/media/', MEDIA_STORAGE='app.storage.FileSystemMediaStorage',
+                                          MEDIA_STORAGE_OPTIONS={})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = User.objects.create_user(email='test@mail.com', password='test', is_active=True,
+                                             first_name='Test', last_name='Test')
+
+    @staticmethod
+    def jpeg(size):
+        buffer = BytesIO()
+        Image.new('RGB', size, 'teal').save(buffer, format='JPEG')
+        return buffer.getvalue()
+
+    def stage_post(self):
+        post = Post(user=self.user, caption='staged')
+        media.defer_upload(post, SimpleUploadedFile('photo.jpg', self.jpeg((2000, 1000)), content_type='image/jpeg'))
+        post.save()
+        return post
+
+    def test_upload_is_published_later(self):
+        """Post is saved pending with staged file, publishing stores it with variants and removes the file."""
+        post = self.stage_post()
+        self.assertEqual(post.media_status, MEDIA_PENDING)
+        self.assertFalse(post.image)
+        self.assertTrue(os.path.exists(os.path.join(self.staging_root, post.staged_media)))
+        self.assertTrue(media.publish(Post, post.id))
+        # only pending rows are claimed
+        self.assertFalse(media.publish(Post, post.id))
+        staged = post.staged_media
+        post.refresh_from_db()
+        self.assertTrue(post.media_ready)
+        self.assertTrue(post.image.url.startswith(f'/media/media/{self.user.id}/posts/'))
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, post.image.name)))
+        self.assertEqual(set(post.variants), {'grid', 'feed', 'detail'})
+        self.assertTrue(post.variant_url('feed', 'webp').endswith('_feed_webp.webp'))
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'media', str(self.user.id), 'posts'))), 7)
+        self.assertEqual(post.staged_media, '')
+        self.assertFalse(os.path.exists(os.path.join(self.staging_root, staged)))
+
+    def test_same_bytes_are_stored_once(self):
+        """Posting the same image again reuses the stored files under the same content hash names."""
+        first, second = self.stage_post(), self.stage_post()
+        self.assertTrue(media.publish(Post, first.id))
+        with mock.patch('app.storage.FileSystemMediaStorage.save') as save:
+            self.assertTrue(media.publish(Post, second.id))
+        save.assert_not_called()
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.image, second.image)
+        self.assertEqual(first.variants, second.variants)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'media', str(self.user.id), 'posts'))), 7)
+
+    def test_media_is_served_immutable(self):
+        """Uploads from MEDIA_ROOT are cached by browsers for good."""
+        post = self.stage_post()
+        media.publish(Post, post.id)
+        post.refresh_from_db()
+        request = APIRequestFactory().get(post.image.url)
+        response = views.serve_media(request, post.image.name, document_root=self.media_root)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+
+    def test_failed_upload_is_retried(self):
+        """Failed upload keeps staged file and is queued again by retry_failed."""
+        post = self.stage_post()
+        with mock.patch('app.storage.FileSystemMediaStorage.save', side_effect=OSError('unavailable')), \
+                self.assertLogs('app.media', 'ERROR'):
+            self.assertFalse(media.publish(Post, post.id))
+        post.refresh_from_db()
+        self.assertEqual(post.media_status, MEDIA_FAILED)
+        self.assertTrue(os.path.exists(os.path.join(self.staging_root, post.staged_media)))
+        self.assertEqual(media.retry_failed(), 1)
+        self.assertEqual(Post.objects.get(id=post.id).media_status, MEDIA_PENDING)
+
+    def test_stale_claim_is_requeued(self):
+        """Upload claimed by a worker that died is queued again after the claim timeout."""
+        post = self.stage_post()
+        Post.objects.filter(id=post.id).update(media_status=MEDIA_UPLOADING, updated_at=timezone.now())
+        self.assertEqual(media.requeue_stale(), 0)
+        Post.objects.filter(id=post.id).update(updated_at=timezone.now() - media.CLAIM_TIMEOUT - timedelta(seconds=1))
+        self.assertEqual(media.requeue_stale(), 1)
+        self.assertEqual(Post.objects.get(id=post.id).media_status, MEDIA_PENDING)
+
+    def test_upload_staged_meanwhile_wins(self):
+        """Publishing doesn't overwrite an upload staged while it ran."""
+        post = self.stage_post()
+        staged = post.staged_media
+
+        def stage_newer(*args):
+            Post.objects.filter(id=post.id).update(staged_media='post_newer.jpg', media_status=MEDIA_PENDING)
+            return '/media/variant.jpg'
+
+        with mock.patch.object(media, 'store_variant', side_effect=stage_newer):
+            self.assertFalse(media.publish(Post, post.id))
+        post.refresh_from_db()
+        self.assertEqual((post.staged_media, post.media_status), ('post_newer.jpg', MEDIA_PENDING))
+        self.assertFalse(os.path.exists(os.path.join(self.staging_root, staged)))
+
+    def test_cloudinary_storage_names(self):
+        """Cloudinary storage keeps resource paths and resolves them to resources."""
+        resource = CloudinaryResource('media/1/posts/photo', format='jpg', version=1, type='upload',
+                                      resource_type='image')
+        storage = CloudinaryStorage(proxy='http://proxy.test')
+        with mock.patch('cloudinary.uploader.upload_resource', return_value=resource) as upload:
+            name = storage.save(BytesIO(b'image'), 'media/1/posts/', 'photo')
+        self.assertEqual(upload.call_args.kwargs['proxy'], 'http://proxy.test')
+        self.assertEqual(name, 'image/upload/v1/media/1/posts/photo.jpg')
+        self.assertEqual(storage.resource(name).public_id, 'media/1/posts/photo')
+
+    def test_incomplete_storage_is_rejected(self):
+        """A storage backend without `save` or `resource` cannot be created."""
+        class SaveOnlyStorage(MediaStorage):
+            def save(self, content, folder, public_id, fmt=None):
+                return public_id
+
+        with self.assertRaises(TypeError):
+            SaveOnlyStorage()
+
+    def test_variants_fit_their_size(self):
+        """Square variants are cropped, others keep aspect ratio, small images are not upscaled."""
+        rendered = images.render_variants(self.jpeg((2000, 1000)), Post.media_variants)
+        sizes = {name: Image.open(BytesIO(formats['jpeg'])).size for name, formats in rendered.items()}
+        self.assertEqual(sizes, {'grid': (150, 150), 'feed': (640, 320), 'detail': (1080, 540)})
+        with Image.open(BytesIO(rendered['grid']['webp'])) as webp:
+            self.assertEqual(webp.format, 'WEBP')
+        rendered = images.render_variants(self.jpeg((40, 30)), User.media_variants)
+        self.assertEqual(Image.open(BytesIO(rendered['avatar']['jpeg'])).size, (30, 30))
+
+    def test_serializer_falls_back_to_original(self):
+        """Post without variants is served with its original image and no WebP."""
+        post = Post.objects.create(user=self.user, image='media/original.jpg')
+        data = FeedPostSerializer(post).data
+        self.assertEqual(data['image'], '/media/media/original.jpg')
+        self.assertIsNone(data['image_webp'])
+
+
 class UserProfileTestCase(TestCase):
     def setUp(self):
         self.c = Client()
@@ -260,9 +461,167 @@ class UserProfileTestCase(TestCase):
         self.assertTemplateUsed(response=response, template_name='app/user_detail.html')
         self.assertFalse(response.context.get('can_edit'))
 
+    def test_profile_does_not_load_follow_lists(self):
+        """Followers and followees are loaded by the modals, the page only shows counters."""
+        self.c.login(email=self.user1.email, password='test1')
+        response = self.c.get(f'/app/{self.user2.pk}/profile', follow=True)
+        self.assertNotIn('followers', response.context)
+        self.assertNotIn('following', response.context)
+        self.assertContains(response, reverse('app:user_followers', kwargs={'pk': self.user2.pk}))
+
+    def test_cached_header_follows_user_changes(self):
+        """Profile header is served from the fragment cache until the user changes, counters are always current."""
+        self.c.login(email=self.user1.email, password='test1')
+        response = self.c.get(f'/app/{self.user2.pk}/profile')
+        self.assertContains(response, 'Test2 Test2')
+        self.user2.first_name = 'Renamed'
+        self.user2.save()
+        response = self.c.get(f'/app/{self.user2.pk}/profile')
+        self.assertContains(response, 'Renamed Test2')
+        Subscription.objects.create(followee=self.user2, follower=self.user1)
+        response = self.c.get(f'/app/{self.user2.pk}/profile')
+        self.assertContains(response, '<p id="id-followers">Follower</p>', html=True)
+
+    def test_cached_avatar_per_block(self):
+        """Owner's editable avatar is cached apart from the avatar other users see."""
+        self.c.login(email=self.user2.email, password='test2')
+        self.assertContains(self.c.get(f'/app/{self.user2.pk}/profile'), 'avatar-can-change')
+        self.c.login(email=self.user1.email, password='test1')
+        self.assertNotContains(self.c.get(f'/app/{self.user2.pk}/profile'), 'avatar-can-change')
+
+    def test_counters_keep_cached_fragments(self):
+        """Follows and likes bump updated_at for validators, but cached fragments stay valid."""
+        self.c.login(email=self.user1.email, password='test1')
+        self.c.get(f'/app/{self.user2.pk}/profile')
+        edited_at = User.objects.get(id=self.user2.pk).edited_at
+        Subscription.objects.create(followee=self.user2, follower=self.user1)
+        user2 = User.objects.get(id=self.user2.pk)
+        self.assertEqual(user2.edited_at, edited_at)
+        self.assertGreater(user2.updated_at, edited_at)
+        self.assertIsNotNone(cache.get(make_template_fragment_key('profile_name', [user2.id, edited_at])))
+
+
+class LoadedObjectsTestCase(TestCase):
+    """Every row a page view needs is loaded once per request."""
+    fixtures = ['users.json', 'posts.json', 'likes.json']
+
+    def setUp(self):
+        self.c = Client()
+        self.post = Post.objects.filter(user=69).first()
+        self.c.force_login(self.post.user)
+
+    def selects(self, queries, table):
+        return [query for query in queries if query['sql'].startswith('SELECT') and f'FROM "{table}"' in query['sql']]
+
+    def test_post_detail(self):
+        """Post is loaded once together with its author."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.c.get(reverse('app:post_detail', kwargs={'pk': self.post.pk}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(self.selects(queries, 'app_post')), 1)
+        # the only possible user query is the one of authentication middleware
+        self.assertLessEqual(len(self.selects(queries, 'app_user')), 1)
+
+    def test_post_update(self):
+        """Permission check and update share one loaded post."""
+        with CaptureQueriesContext(connection) as queries:
+            self.c.post(reverse('app:post_update', kwargs={'pk': self.post.pk}), {'caption': 'New caption'})
+        self.assertEqual(len(self.selects(queries, 'app_post')), 1)
+        self.assertEqual(Post.objects.get(pk=self.post.pk).caption, 'New caption')
+
+    def test_post_update_leaves_media_fields(self):
+        """Caption edit writes the caption only, media published meanwhile is not written back."""
+        with CaptureQueriesContext(connection) as queries:
+            self.c.post(reverse('app:post_update', kwargs={'pk': self.post.pk}), {'caption': 'New caption'})
+        update, = [query['sql'] for query in queries if query['sql'].startswith('UPDATE "app_post"')]
+        for column in ('image', 'variants', 'media_status', 'staged_media', 'likes_count'):
+            self.assertNotIn(f'"{column}"', update)
+
+    def test_own_profile(self):
+        """Own profile and profile edit page reuse the signed-in user."""
+        for url_name in ('profile', 'edit_profile'):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.c.get(reverse(f'app:{url_name}', kwargs={'pk': 69}))
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(self.selects(queries, 'app_user')), 1)
+
+    def test_other_users_objects_are_checked(self):
+        """Views about other users' rows are still forbidden."""
+        response = self.c.post(reverse('app:post_update', kwargs={'pk': Post.objects.exclude(user=69).first().pk}),
+                               {'caption': 'New caption'})
+        self.assertEqual(response.status_code, 403)
+        response = self.c.get(reverse('app:add_post', kwargs={'pk': 62}))
+        self.assertEqual(response.status_code, 403)
+
+
+class CachedUserTestCase(TestCase):
+    """Session's user is served from cache until the row changes."""
+    fixtures = ['users.json']
+
+    def setUp(self):
+        self.c = Client()
+        self.user = User.objects.get(id=69)
+        self.c.force_login(self.user)
+        self.url = reverse('app:edit_profile', kwargs={'pk': self.user.pk})
+
+    def user_selects(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.c.get(self.url)
+        return response, [query for query in queries if 'FROM "app_user"' in query['sql']]
+
+    def test_user_is_cached(self):
+        self.user_selects()
+        response, selects = self.user_selects()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(selects, [])
+
+    def test_save_invalidates_cached_user(self):
+        self.user_selects()
+        self.user.first_name = 'Renamed'
+        self.user.save()
+        response, selects = self.user_selects()
+        self.assertEqual(len(selects), 1)
+        self.assertEqual(response.context['auth_user'].first_name, 'Renamed')
+
+        self.user.is_active = False
+        self.user.save()
+        response = self.c.get(self.url)
+        self.assertEqual(response.status_code, 302)
+
+    def test_media_status_update_invalidates_cached_user(self):
+        User.objects.filter(id=self.user.id).update(media_status=MEDIA_FAILED, staged_media='user_69_a.jpg')
+        self.user_selects()
+        media.retry_failed()
+        response, selects = self.user_selects()
+        self.assertEqual(len(selects), 1)
+        self.assertEqual(response.context['auth_user'].media_status, MEDIA_PENDING)
+
+    def test_edit_keeps_fields_changed_meanwhile(self):
+        """Editing the profile through the cached user writes only the edited fields."""
+        self.user_selects()
+        # e.g. published while a stale row was put back to the cache
+        User.objects.filter(id=self.user.id).update(variants={'avatar': {'jpeg': 'published.jpg'}})
+        response = self.c.post(self.url, {'first_name': 'Edited', 'last_name': 'Name', 'bio': ''})
+        self.assertEqual(response.status_code, 302)
+        user = User.objects.get(id=self.user.id)
+        self.assertEqual((user.first_name, user.last_name), ('Edited', 'Name'))
+        self.assertEqual(user.variants, {'avatar': {'jpeg': 'published.jpg'}})
+
+    def test_counter_change_invalidates_cached_user(self):
+        self.user_selects()
+        Subscription.objects.create(followee=User.objects.get(id=62), follower=self.user)
+        response, selects = self.user_selects()
+        self.assertEqual(len(selects), 1)
+        self.assertEqual(response.context['auth_user'].following_count, self.user.following_count + 1)
+
 
 class UserPostsTestCase(TestCase):
     def setUp(self):
+        staging_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, staging_root)
+        settings_override = self.settings(MEDIA_STAGING_ROOT=staging_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
         self.c = Client()
         self.user = User.objects.create_user(email='test@mail.com', password='test', is_active=True,
                                              first_name='Test', last_name='Test')
@@ -337,6 +696,7 @@ class UserPostsAPITestCase(APITestCase):
 
     def setUp(self) -> None:
         self.client = APIClient()
+        call_command('rebuild_timelines', stdout=StringIO())
 
     def test_get_posts(self):
         """
@@ -347,15 +707,238 @@ class UserPostsAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
         user = User.objects.get(id=69)
         self.client.force_authenticate(user=user)
-        response = self.client.get(url, format='json')
+        response = self.client.get(url + '?limit=50', format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 17)
-        response = self.client.get(url + '?start=1&offset=2', format='json')
+        self.assertEqual(len(response.data['results']), 17)
+        self.assertIsNone(response.data['next_cursor'])
+        self.assertFalse(response.data['has_more'])
+        response = self.client.get(url + '?limit=2', format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next_cursor'])
+        self.assertTrue(response.data['has_more'])
         response = self.client.get(url + '?user_id=62', format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 2)
+        self.assertEqual(len(response.data['results']), 2)
+
+    def test_get_posts_timestamps(self):
+        """
+        Ensure feed sends relative publication time by default and raw epoch timestamps on request.
+        """
+        url = reverse('app:posts')
+        self.client.force_authenticate(user=User.objects.get(id=69))
+        post = self.client.get(url + '?limit=1', format='json').data['results'][0]
+        self.assertNotIn('pub_ts', post)
+        self.assertEqual(post['pub_date'], get_timedelta_for_post(Post.objects.get(id=post['id']).pub_date))
+        post = self.client.get(url + '?limit=1&timestamps=epoch', format='json').data['results'][0]
+        self.assertNotIn('pub_date', post)
+        self.assertEqual(post['pub_ts'], int(Post.objects.get(id=post['id']).pub_date.timestamp()))
+        response = self.client.get(url + '?timestamps=iso', format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_posts_with_cursor(self):
+        """
+        Ensure cursor pages do not overlap and together return every post in order.
+        """
+        url = reverse('app:posts')
+        user = User.objects.get(id=69)
+        self.client.force_authenticate(user=user)
+        ids, cursor = [], None
+        while True:
+            params = '?limit=5' + (f'&cursor={cursor}' if cursor else '')
+            response = self.client.get(url + params, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [post['id'] for post in response.data['results']]
+            cursor = response.data['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(len(ids), 17)
+        self.assertEqual(len(set(ids)), 17)
+        expected = Post.objects.filter(id__in=ids).order_by('-pub_date', '-id').values_list('id', flat=True)
+        self.assertEqual(ids, list(expected))
+
+        response = self.client.get(url + '?cursor=not-a-cursor', format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(url + '?limit=abc', format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class UserPostsQueryCountTestCase(APITestCase):
+    fixtures = ['users.json', 'posts.json', 'subscriptions.json', 'likes.json']
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.get(id=69))
+        call_command('rebuild_timelines', stdout=StringIO())
+
+    def test_feed_page_query_count(self):
+        """Feed page loads authors in a fixed number of queries whatever the page size, likes are not loaded."""
+        url = reverse('app:posts')
+        for limit in (1, 9, 17):
+            # timeline horizon, timeline with authors, pulled accounts
+            with self.assertNumQueries(3):
+                response = self.client.get(url + f'?limit={limit}', format='json')
+            self.assertEqual(len(response.data['results']), limit)
+
+    def test_feed_page_does_not_count_posts(self):
+        """Feed page itself does not touch posts, they are loaded through the API."""
+        client = Client()
+        client.force_login(User.objects.get(id=69))
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse('app:feed'))
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('total_num_posts', response.context)
+        self.assertFalse([query for query in queries if 'app_post' in query['sql']])
+
+    def test_profile_page_query_count(self):
+        """Profile grid loads likes in a fixed number of queries whatever the page size."""
+        url = reverse('app:posts')
+        for limit in (1, 9):
+            # posts, likes
+            with self.assertNumQueries(2):
+                response = self.client.get(url + f'?user_id=69&limit={limit}', format='json')
+            self.assertEqual(len(response.data['results']), limit)
+
+
+class TimelineTestCase(APITestCase):
+    fixtures = ['users.json', 'posts.json', 'subscriptions.json']
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        call_command('rebuild_timelines', stdout=StringIO())
+
+    def test_new_post_is_pushed_to_followers(self):
+        """New post appears in timelines of its author and of every follower."""
+        author = User.objects.get(id=62)
+        post = Post.objects.create(user=author, caption='fresh', image='image/upload/v1/fresh')
+        timeline.push_post(post)
+        owners = set(TimelineEntry.objects.filter(post=post).values_list('owner_id', flat=True))
+        followers = set(Subscription.objects.filter(followee=author).values_list('follower_id', flat=True))
+        self.assertEqual(owners, followers | {author.id})
+
+    def test_follow_and_unfollow_update_timeline(self):
+        """Following backfills followee posts, unfollowing removes them."""
+        url = reverse('app:subscription_list', kwargs={'follower_id': 93})
+        self.client.force_authenticate(user=User.objects.get(id=93))
+        self.assertFalse(TimelineEntry.objects.filter(owner=93, post__user=62).exists())
+        response = self.client.post(url, data={'followee_id': 62})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(TimelineEntry.objects.filter(owner=93, post__user=62).count(),
+                         Post.objects.filter(user=62).count())
+
+        url = reverse('app:subscription', kwargs={'follower_id': 93, 'followee_id': 62})
+        response = self.client.delete(url)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(TimelineEntry.objects.filter(owner=93, post__user=62).exists())
+
+    def test_deleted_post_leaves_timelines(self):
+        """Deleting post removes it from every timeline."""
+        post = Post.objects.filter(user=62).first()
+        self.assertTrue(TimelineEntry.objects.filter(post=post).exists())
+        post.delete()
+        self.assertFalse(TimelineEntry.objects.filter(post_id=post.id).exists())
+
+    def test_feed_past_backfill_horizon(self):
+        """Posts older than the capped backfill are pulled, so the feed still has every followee post."""
+        with mock.patch.object(timeline, 'BACKFILL_SIZE', 2):
+            timeline.rebuild(93)
+        self.assertEqual(TimelineEntry.objects.filter(owner=93, post__user=69).count(), 2)
+        self.assertIsNotNone(User.objects.get(id=93).timeline_horizon)
+
+        self.client.force_authenticate(user=User.objects.get(id=93))
+        ids, cursor = [], ''
+        while cursor is not None:
+            response = self.client.get(reverse('app:posts') + f'?limit=3&cursor={cursor}', format='json')
+            ids += [item['id'] for item in response.data['results']]
+            cursor = response.data['next_cursor']
+        followees = Subscription.objects.filter(follower=93).values('followee_id')
+        expected = Post.objects.filter(Q(user=93) | Q(user__in=followees))
+        self.assertEqual(ids, list(expected.values_list('id', flat=True)))
+
+    def test_failed_push_saves_no_post(self):
+        """Post is not saved when it can't be pushed to the feeds."""
+        staging_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, staging_root)
+        user = User.objects.get(id=69)
+        self.client.force_login(user)
+        image = BytesIO()
+        Image.new('RGB', (10, 10), 'teal').save(image, format='JPEG')
+        upload = SimpleUploadedFile('photo.jpg', image.getvalue(), content_type='image/jpeg')
+        posts_count = Post.objects.count()
+        with self.settings(MEDIA_STAGING_ROOT=staging_root), \
+                mock.patch.object(timeline, 'push_post', side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            self.client.post(reverse('app:add_post', kwargs={'pk': user.id}), {'caption': 'lost', 'image': upload})
+        self.assertEqual(Post.objects.count(), posts_count)
+
+
+class HybridTimelineTestCase(APITestCase):
+    fixtures = ['users.json', 'posts.json', 'subscriptions.json']
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        patcher = mock.patch.object(timeline, 'FANOUT_FOLLOWER_THRESHOLD', 5)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        call_command('reconcile_counters', stdout=StringIO())
+        call_command('rebuild_timelines', stdout=StringIO())
+
+    def test_popular_account_is_pulled(self):
+        """Posts of accounts above the threshold are not pushed but still show up in feeds."""
+        author = User.objects.get(id=69)
+        self.assertTrue(timeline.is_pulled(author.id))
+        post = Post.objects.create(user=author, caption='viral', image='image/upload/v1/viral')
+        timeline.push_post(post)
+        self.assertEqual(list(TimelineEntry.objects.filter(post=post).values_list('owner_id', flat=True)),
+                         [author.id])
+
+        self.client.force_authenticate(user=User.objects.get(id=62))
+        response = self.client.get(reverse('app:posts') + '?limit=50', format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = [item['id'] for item in response.data['results']]
+        self.assertEqual(ids[0], post.id)
+        self.assertEqual(len(ids), len(set(ids)))
+        expected = Post.objects.filter(user__in=[62, 69]).values_list('id', flat=True)
+        self.assertEqual(ids, list(expected))
+        self.assertIn('merge;dur=', response['Server-Timing'])
+
+    def feed_ids(self, user_id):
+        self.client.force_authenticate(user=User.objects.get(id=user_id))
+        response = self.client.get(reverse('app:posts') + '?limit=50', format='json')
+        return [item['id'] for item in response.data['results']]
+
+    def cross_threshold(self):
+        """93 follows 116, its second follower takes 116 to the threshold."""
+        self.client.force_authenticate(user=User.objects.get(id=93))
+        response = self.client.post(reverse('app:subscription_list', kwargs={'follower_id': 93}),
+                                    data={'followee_id': 116})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        post = Post.objects.create(user_id=116, caption='while pulled', image='image/upload/v1/pulled')
+        timeline.push_post(post)
+        return post
+
+    def test_account_crossing_threshold_up(self):
+        """Account reaching the threshold gets pulled, its older pushed posts stay in timelines."""
+        with mock.patch.object(timeline, 'FANOUT_FOLLOWER_THRESHOLD', 2):
+            older = list(Post.objects.filter(user=116).values_list('id', flat=True))
+            post = self.cross_threshold()
+            self.assertIsNotNone(User.objects.get(id=116).pulled_since)
+            self.assertFalse(TimelineEntry.objects.filter(post=post).exclude(owner=116).exists())
+            self.assertEqual(TimelineEntry.objects.filter(owner=69, post__in=older).count(), len(older))
+            ids = self.feed_ids(69)
+        self.assertIn(post.id, ids)
+        self.assertTrue(set(older) <= set(ids))
+
+    def test_account_crossing_threshold_down(self):
+        """Posts made while pulled are pushed to followers when the account drops below the threshold."""
+        with mock.patch.object(timeline, 'FANOUT_FOLLOWER_THRESHOLD', 2):
+            post = self.cross_threshold()
+            self.client.force_authenticate(user=User.objects.get(id=93))
+            response = self.client.delete(reverse('app:subscription', kwargs={'follower_id': 93, 'followee_id': 116}))
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+            self.assertIsNone(User.objects.get(id=116).pulled_since)
+            self.assertTrue(TimelineEntry.objects.filter(owner=69, post=post).exists())
+            self.assertFalse(TimelineEntry.objects.filter(owner=93, post=post).exists())
+            self.assertIn(post.id, self.feed_ids(69))
 
 
 class SubscriptionAPITestCase(APITestCase):
@@ -446,6 +1029,56 @@ class SubscriptionAPITestCase(APITestCase):
         response = self.client.post(url, data={'followee_id': 91})
         self.assertNotEqual(response.status_code, status.HTTP_201_CREATED)
 
+    def test_bulk_follow_and_unfollow(self):
+        """Many users are followed and unfollowed at once with a result for each of them."""
+        url = reverse('app:subscription_bulk', kwargs={'follower_id': 93})
+        data = {'followee_ids': [69, 62, 94, 93, 9999, 62]}
+        response = self.client.post(url, data=data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(user=User.objects.get(email='test2@mail.com'))
+        following_count = User.objects.get(id=93).following_count
+        followers_count = User.objects.get(id=62).followers_count
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, data=data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [
+            {'followee_id': 69, 'status': 'already_following'}, {'followee_id': 62, 'status': 'followed'},
+            {'followee_id': 94, 'status': 'followed'}, {'followee_id': 93, 'status': 'self'},
+            {'followee_id': 9999, 'status': 'not_found'}])
+        # same statements whatever the number of followees: follower lock, followees, existing subscriptions,
+        # insert, two counter updates, followees with their backfill cutoffs, their posts, timeline insert
+        statements = [query for query in queries if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+        self.assertEqual(len(statements), 9)
+        self.assertEqual(set(Subscription.objects.filter(follower=93).values_list('followee_id', flat=True)),
+                         {69, 62, 94})
+        self.assertEqual(User.objects.get(id=93).following_count, following_count + 2)
+        self.assertEqual(User.objects.get(id=62).followers_count, followers_count + 1)
+        self.assertTrue(TimelineEntry.objects.filter(owner=93, post__user=62).exists())
+
+        response = self.client.delete(url, data={'followee_ids': [62, 94, 95]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['status'] for result in response.data['results']],
+                         ['unfollowed', 'unfollowed', 'not_following'])
+        self.assertEqual(list(Subscription.objects.filter(follower=93).values_list('followee_id', flat=True)), [69])
+        self.assertEqual(User.objects.get(id=93).following_count, following_count)
+        self.assertEqual(User.objects.get(id=62).followers_count, followers_count)
+        self.assertFalse(TimelineEntry.objects.filter(owner=93, post__user=62).exists())
+
+        for data in ({}, {'followee_ids': []}, {'followee_ids': ['x']}, {'followee_ids': list(range(101))}):
+            response = self.client.post(url, data=data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_follow_is_atomic(self):
+        """Subscriptions are not kept when the timeline backfill fails."""
+        self.client.force_authenticate(user=User.objects.get(id=93))
+        following_count = User.objects.get(id=93).following_count
+        with mock.patch.object(timeline, 'backfill_many', side_effect=RuntimeError), self.assertRaises(RuntimeError):
+            self.client.post(reverse('app:subscription_bulk', kwargs={'follower_id': 93}),
+                             data={'followee_ids': [62, 94]}, format='json')
+        self.assertFalse(Subscription.objects.filter(follower=93, followee__in=[62, 94]).exists())
+        self.assertEqual(User.objects.get(id=93).following_count, following_count)
+
 
 class LikeAPITestCase(APITestCase):
     fixtures = ['users.json', 'posts.json', 'likes.json']
@@ -464,9 +1097,19 @@ class LikeAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
         user = User.objects.get(email='test1@mail.com')
         self.client.force_authenticate(user=user)
-        response = self.client.get(url, format='json')
+        with self.assertNumQueries(1):
+            response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 3)
+        self.assertEqual(len(response.data['results']), 3)
+        self.assertEqual([like['user'] for like in response.data['results']], [102, 101, 69])
+        self.assertEqual(response.data['results'][2]['first_name'], 'Tony')
+
+        # pages follow each other without gaps
+        response = self.client.get(url + '?limit=2', format='json')
+        self.assertEqual(len(response.data['results']), 2)
+        response = self.client.get(url + f"?limit=2&cursor={response.data['next_cursor']}", format='json')
+        self.assertEqual([like['user'] for like in response.data['results']], [69])
+        self.assertIsNone(response.data['next_cursor'])
 
     def test_post_like(self):
         """
@@ -483,14 +1126,14 @@ class LikeAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 4)
+        self.assertEqual(len(response.data['results']), 4)
 
         # test user cannot like twice
         response = self.client.post(url, data={'user_id': 103})
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         response = self.client.get(url, format='json')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 4)
+        self.assertEqual(len(response.data['results']), 4)
 
         response = self.client.post(url, data={'user_id': 'f'})
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -537,6 +1180,466 @@ class LikeAPITestCase(APITestCase):
         response = self.client.delete(url)
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def test_like_toggle(self):
+        """Wanted like state is set once, repeating it changes nothing, likes count is returned."""
+        post = Post.objects.create(user=User.objects.get(id=62), image='image/upload/v1/toggled')
+        url = reverse('app:like_toggle', kwargs={'post_id': post.id})
+        response = self.client.post(url, data={'liked': True}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_authenticate(user=User.objects.get(id=69))
+        for changed in (True, False):
+            response = self.client.post(url, data={'liked': True}, format='json')
+            self.assertEqual(response.data, {'liked': True, 'changed': changed, 'likes_count': 1})
+        self.assertEqual(Like.objects.filter(post=post).count(), 1)
+        for changed in (True, False):
+            response = self.client.post(url, data={'liked': False}, format='json')
+            self.assertEqual(response.data, {'liked': False, 'changed': changed, 'likes_count': 0})
+        self.assertFalse(Like.objects.filter(post=post).exists())
+
+        response = self.client.post(url, data={'liked': 'yes'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse('app:like_toggle', kwargs={'post_id': 99999}), data={'liked': True},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertFalse(Like.objects.filter(post=99999).exists())
+
+
+class LikeBufferTestCase(APITestCase):
+    fixtures = ['users.json', 'posts.json', 'subscriptions.json']
+
+    def setUp(self):
+        settings_override = self.settings(LIKE_BUFFER=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.post = Post.objects.create(user=User.objects.get(id=62), image='image/upload/v1/viral')
+        self.liker = User.objects.get(id=69)
+        self.client.force_authenticate(user=self.liker)
+
+    def toggle(self, liked):
+        url = reverse('app:like_toggle', kwargs={'post_id': self.post.id})
+        return self.client.post(url, data={'liked': liked}, format='json').data
+
+    def profile_likes(self):
+        response = self.client.get(reverse('app:posts'), {'user_id': 62, 'limit': 1})
+        return response.data['results'][0]['likes']
+
+    def test_liker_sees_buffered_like(self):
+        """Buffered like is not written to Like, but the liker sees it in the count and post lists."""
+        self.assertEqual(self.toggle(True), {'liked': True, 'changed': True, 'likes_count': 1})
+        self.assertEqual(self.toggle(True), {'liked': True, 'changed': False, 'likes_count': 1})
+        self.assertFalse(Like.objects.filter(post=self.post).exists())
+        self.assertEqual(PendingLike.objects.count(), 1)
+        self.assertEqual(self.profile_likes(), [self.liker.id])
+        self.client.force_authenticate(user=User.objects.get(id=93))
+        self.assertEqual(self.profile_likes(), [])
+
+    def test_flush_applies_latest_state(self):
+        """Flush keeps the latest entry of each user and merges counter updates."""
+        self.toggle(True)
+        self.toggle(False)
+        self.toggle(True)
+        for user_id in (93, 94):
+            like_buffer.submit(self.post.id, user_id, True)
+        like_buffer.submit(self.post.id, 94, False)
+        self.assertEqual(like_buffer.flush(), 6)
+        self.assertEqual(like_buffer.flush(), 0)
+        self.assertEqual(set(Like.objects.filter(post=self.post).values_list('user_id', flat=True)), {69, 93})
+        self.assertEqual(Post.objects.get(id=self.post.id).likes_count, 2)
+        self.assertEqual(self.profile_likes(), [69, 93])
+        self.assertEqual(self.toggle(False), {'liked': False, 'changed': True, 'likes_count': 1})
+
+    def test_flush_counts_inserted_likes_only(self):
+        """Like inserted directly while the flush runs is not counted twice."""
+        like_buffer.submit(self.post.id, 93, True)
+        insert_likes = like_buffer._insert_likes
+
+        def direct_like_first(pairs):
+            Like.set_liked(self.post.id, 93, True)
+            return insert_likes(pairs)
+
+        with mock.patch('app.like_buffer._insert_likes', side_effect=direct_like_first):
+            self.assertEqual(like_buffer.flush(), 1)
+        self.assertEqual(Post.objects.get(id=self.post.id).likes_count, 1)
+
+    def test_small_batches_keep_order(self):
+        """Entries of a post split across batches are applied oldest first."""
+        self.toggle(True)
+        self.toggle(False)
+        self.assertEqual(like_buffer.flush(batch_size=1), 1)
+        self.assertEqual(Post.objects.get(id=self.post.id).likes_count, 1)
+        self.assertEqual(like_buffer.flush(batch_size=1), 1)
+        self.assertFalse(Like.objects.filter(post=self.post).exists())
+        self.assertEqual(Post.objects.get(id=self.post.id).likes_count, 0)
+
+    def test_feed_counts_buffered_like(self):
+        """Feed shows the liker their buffered like in the count and the liked state through viewer status."""
+        timeline.push_post(self.post)
+        self.toggle(True)
+        feed = self.client.get(reverse('app:posts'), {'limit': 1}).data['results'][0]
+        self.assertEqual((feed['id'], feed['likes_count']), (self.post.id, 1))
+        self.assertNotIn('likes', feed)
+        status_url = reverse('app:viewer_status') + f'?post_ids={self.post.id}'
+        self.assertEqual(self.client.get(status_url).data['liked'], {self.post.id: True})
+
+    def test_like_endpoints_are_buffered(self):
+        """Adding and deleting likes through the likes endpoints goes through the buffer too."""
+        url = reverse('app:likes', kwargs={'post_id': self.post.id})
+        response = self.client.post(url, data={'user_id': self.liker.id})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.client.post(url, data={'user_id': self.liker.id}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Like.objects.filter(post=self.post).exists())
+        url = reverse('app:like', kwargs={'post_id': self.post.id, 'user_id': self.liker.id})
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.delete(url).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(list(PendingLike.objects.values_list('liked', flat=True)), [True, False])
+        self.assertEqual(like_buffer.flush(), 2)
+        self.assertFalse(Like.objects.filter(post=self.post).exists())
+        self.assertEqual(Post.objects.get(id=self.post.id).likes_count, 0)
+
+
+class CountersTestCase(APITestCase):
+    fixtures = ['users.json', 'posts.json', 'subscriptions.json', 'likes.json']
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        call_command('reconcile_counters', stdout=StringIO())
+
+    def assertCounters(self):
+        """Stored counters match the real number of rows."""
+        for user in User.objects.all():
+            self.assertEqual(user.followers_count, Subscription.objects.filter(followee=user).count())
+            self.assertEqual(user.following_count, Subscription.objects.filter(follower=user).count())
+            self.assertEqual(user.posts_count, Post.objects.filter(user=user).count())
+        for post in Post.objects.all():
+            self.assertEqual(post.likes_count, Like.objects.filter(post=post).count())
+
+    def test_reconcile(self):
+        """Management command fixes drifted counters."""
+        self.assertCounters()
+        User.objects.update(followers_count=100, posts_count=0)
+        Post.objects.update(likes_count=7)
+        call_command('reconcile_counters', stdout=StringIO())
+        self.assertCounters()
+
+    def test_likes_count(self):
+        """Liking and unliking keep post counter in sync."""
+        self.client.force_authenticate(user=User.objects.get(id=103))
+        self.client.post(reverse('app:likes', kwargs={'post_id': 113}), data={'user_id': 103})
+        self.assertEqual(Post.objects.get(id=113).likes_count, 4)
+        self.client.delete(reverse('app:like', kwargs={'post_id': 113, 'user_id': 103}))
+        self.assertEqual(Post.objects.get(id=113).likes_count, 3)
+        self.assertCounters()
+
+    def test_subscription_counts(self):
+        """Following and unfollowing keep both users' counters in sync."""
+        self.client.force_authenticate(user=User.objects.get(id=93))
+        self.client.post(reverse('app:subscription_list', kwargs={'follower_id': 93}), data={'followee_id': 62})
+        self.assertEqual(User.objects.get(id=62).followers_count, 2)
+        self.assertEqual(User.objects.get(id=93).following_count, 2)
+        self.assertCounters()
+        self.client.delete(reverse('app:subscription', kwargs={'follower_id': 93, 'followee_id': 62}))
+        self.assertEqual(User.objects.get(id=62).followers_count, 1)
+        self.assertCounters()
+
+    def test_posts_count(self):
+        """Creating and deleting posts keep author counter in sync."""
+        post = Post.objects.create(user=User.objects.get(id=62), image='image/upload/v1/counted')
+        self.assertEqual(User.objects.get(id=62).posts_count, 3)
+        post.delete()
+        self.assertEqual(User.objects.get(id=62).posts_count, 2)
+        self.assertCounters()
+
+    def test_saving_stale_row_keeps_counters(self):
+        """Saving a row loaded before a like or follow doesn't write its old counters back."""
+        post, user = Post.objects.get(id=113), User.objects.get(id=62)
+        Like.set_liked(113, 103, True)
+        Subscription.objects.create(follower=User.objects.get(id=93), followee=User.objects.get(id=62))
+        post.caption = 'edited'
+        post.save()
+        user.first_name = 'Edited'
+        user.save()
+        self.assertEqual(Post.objects.get(id=113).caption, 'edited')
+        self.assertEqual(Post.objects.get(id=113).likes_count, 4)
+        self.assertEqual(User.objects.get(id=62).first_name, 'Edited')
+        self.assertEqual(User.objects.get(id=62).followers_count, 2)
+        self.assertCounters()
+
+
+class UserCardsAPITestCase(APITestCase):
+    fixtures = ['users.json']
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.url = reverse('app:user_cards')
+
+    def test_get_cards(self):
+        """
+        Ensure api returns cards of all requested users in request order with one query.
+        """
+        response = self.client.get(self.url + '?ids=69,62', format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(user=User.objects.get(id=69))
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url + '?ids=69,62,69,99999', format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([card['id'] for card in response.data], [69, 62])
+        self.assertEqual(set(response.data[0]), {'id', 'first_name', 'last_name', 'avatar'})
+
+    def test_invalid_batches(self):
+        """Empty, malformed and too large batches are rejected."""
+        self.client.force_authenticate(user=User.objects.get(id=69))
+        for ids in ('', 'a,b', ','.join(str(i) for i in range(101))):
+            response = self.client.get(self.url + f'?ids={ids}', format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_etag(self):
+        """Unchanged cards are answered with 304 and changed ones with new data."""
+        self.client.force_authenticate(user=User.objects.get(id=69))
+        response = self.client.get(self.url + '?ids=69,62', format='json')
+        etag = response['ETag']
+        response = self.client.get(self.url + '?ids=69,62', format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        user = User.objects.get(id=62)
+        user.first_name = 'Changed'
+        user.save()
+        response = self.client.get(self.url + '?ids=69,62', format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[1]['first_name'], 'Changed')
+
+
+class ViewerStatusAPITestCase(APITestCase):
+    fixtures = ['users.json', 'posts.json', 'subscriptions.json', 'likes.json']
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.url = reverse('app:viewer_status')
+
+    def test_get_status(self):
+        """
+        Ensure api returns like and follow state of the current user with one query each.
+        """
+        response = self.client.get(self.url + '?post_ids=113', format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(user=User.objects.get(id=69))
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url + '?post_ids=113,114,113&user_ids=62,101', format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'liked': {113: True, 114: False}, 'following': {62: True, 101: False}})
+
+    def test_invalid_batches(self):
+        """Empty, malformed and too large batches are rejected."""
+        self.client.force_authenticate(user=User.objects.get(id=69))
+        for query in ('', 'post_ids=a', 'user_ids=' + ','.join(str(i) for i in range(101))):
+            response = self.client.get(self.url + f'?{query}', format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_explore_page(self):
+        """Explore page marks followed users without a query per user."""
+        self.client.force_login(User.objects.get(id=69))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('app:user-list'))
+        self.assertEqual(response.context['following'], {116, 111})
+        self.assertEqual(sum('app_subscription' in query['sql'] for query in queries), 1)
+
+
+class ExploreUserListTestCase(TestCase):
+    fixtures = ['users.json']
+
+    def setUp(self) -> None:
+        cache.delete(ExploreUserListView.count_cache_key)
+        User.objects.bulk_create([User(email=f'jones{i}@example.com', last_name='Jones', is_active=True)
+                                  for i in range(3)])
+        self.client.force_login(User.objects.get(id=69))
+        self.url = reverse('app:user-list')
+
+    def test_walk_pages(self):
+        """
+        Pages follow each other by (last_name, id) cursor without gaps, repeats, OFFSET or repeated COUNT.
+        """
+        expected = list(User.objects.filter(is_active=True, is_admin=False).exclude(id=69)
+                        .order_by('last_name', 'id').values_list('id', flat=True))
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['users_count'], len(expected))
+        ids = [user.id for user in response.context['object_list']]
+        cursor = response.context['next_cursor']
+        self.assertEqual(len(ids), ExploreUserListView.page_size)
+        while cursor:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.url, {'cursor': cursor, 'partial': 1})
+            self.assertFalse([query for query in queries if re.search('OFFSET|COUNT', query['sql'])])
+            self.assertNotContains(response, 'Explore Profiles')
+            ids += [user.id for user in response.context['object_list']]
+            cursor = response['X-Next-Cursor']
+        self.assertEqual(ids, expected)
+
+    def test_cached_count(self):
+        """Number of users is counted once and shown from cache afterwards."""
+        self.client.get(self.url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertFalse([query for query in queries if 'COUNT' in query['sql']])
+        self.assertContains(response, f'{response.context["users_count"]} profiles')
+
+    def test_count_matches_list_of_each_viewer(self):
+        """Cached count is shared, but only viewers who are listed themselves get one less."""
+        listed = User.objects.filter(is_active=True, is_admin=False).count()
+        self.assertEqual(self.client.get(self.url).context['users_count'], listed - 1)
+        self.client.force_login(User.objects.get(id=62))
+        self.assertEqual(self.client.get(self.url).context['users_count'], listed)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'bad'})
+        self.assertEqual(response.status_code, 400)
+
+
+class UserFollowListAPITestCase(APITestCase):
+    fixtures = ['users.json', 'subscriptions.json']
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+
+    def test_followers_pages(self):
+        """
+        Ensure followers are returned page by page with one query per page.
+        """
+        url = reverse('app:user_followers', kwargs={'pk': 69})
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(user=User.objects.get(id=69))
+        ids, cursor = [], None
+        while True:
+            params = '?limit=5' + (f'&cursor={cursor}' if cursor else '')
+            with self.assertNumQueries(1):
+                response = self.client.get(url + params, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            ids += [card['id'] for card in response.data['results']]
+            cursor = response.data['next_cursor']
+            if cursor is None:
+                break
+        expected = Subscription.objects.filter(followee=69).order_by('-id').values_list('follower_id', flat=True)
+        self.assertEqual(ids, list(expected))
+
+    def test_following(self):
+        """Ensure followees are returned."""
+        self.client.force_authenticate(user=User.objects.get(id=69))
+        response = self.client.get(reverse('app:user_following', kwargs={'pk': 116}), format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual({card['id'] for card in response.data['results']}, {69, 103, 97, 104})
+        self.assertIsNone(response.data['next_cursor'])
+        response = self.client.get(reverse('app:user_following', kwargs={'pk': 116}) + '?cursor=bad')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ConditionalGetTestCase(APITestCase):
+    fixtures = ['users.json', 'posts.json', 'subscriptions.json', 'likes.json']
+
+    def setUp(self) -> None:
+        self.client = APIClient()
+        self.client.force_authenticate(user=User.objects.get(id=69))
+        call_command('rebuild_timelines', stdout=StringIO())
+
+    def test_profile_posts_not_modified(self):
+        """Unchanged profile page is answered with 304 without loading likes, a new like changes it."""
+        url = reverse('app:posts') + '?user_id=69&limit=3'
+        response = self.client.get(url, format='json')
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        etag = response['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        post = Post.objects.filter(user=69).first()
+        Like.objects.create(post=post, user=User.objects.exclude(id__in=post.likes.all()).first())
+        response = self.client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_feed_not_modified(self):
+        """Unchanged feed page is answered with 304, other page of the feed is not."""
+        url = reverse('app:posts') + '?limit=3'
+        response = self.client.get(url, format='json')
+        etag, next_cursor = response['ETag'], response.data['next_cursor']
+        response = self.client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(url + f'&cursor={next_cursor}', format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_subscriptions_not_modified(self):
+        """Unchanged subscriptions are validated with one query, a new follow changes them."""
+        self.client.force_authenticate(user=User.objects.get(email='admin@mail.com'))
+        url = reverse('app:subscription_list', kwargs={'follower_id': 69})
+        response = self.client.get(url, format='json')
+        etag = response['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        followee = User.objects.exclude(id=69).exclude(subscription_followees__follower=69).first()
+        Subscription.objects.create(followee=followee, follower=User.objects.get(id=69))
+        response = self.client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_likes_page_not_modified_until_cursor_changes(self):
+        """Likes page with the same likes is answered with 200 once its next page cursor changed."""
+        url = reverse('app:likes', kwargs={'post_id': 113}) + '?limit=2'
+        response = self.client.get(url, format='json')
+        etag = response['ETag']
+        self.assertIsNotNone(response.data['next_cursor'])
+        response = self.client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Like.objects.get(id=1).delete()
+        response = self.client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data['next_cursor'])
+
+    def test_user_info_last_modified(self):
+        """User info can be validated by date as well as by ETag."""
+        url = reverse('app:user_fullname', kwargs={'pk': 62})
+        response = self.client.get(url, format='json')
+        last_modified = response['Last-Modified']
+        response = self.client.get(url, format='json', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        User.objects.filter(id=62).update(updated_at=timezone.now() + timedelta(minutes=1))
+        response = self.client.get(url, format='json', HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class AsyncViewsTestCase(TransactionTestCase):
+    """Async variants answer like the sync views, with the view running in the pool's threads."""
+    fixtures = ['users.json', 'posts.json', 'subscriptions.json', 'likes.json']
+
+    def setUp(self) -> None:
+        self.user = User.objects.get(id=69)
+        self.factory = APIRequestFactory()
+
+    def get(self, view, url, **kwargs):
+        request = self.factory.get(url)
+        force_authenticate(request, user=self.user)
+        return async_to_sync(async_view(view))(request, **kwargs)
+
+    def test_async_views(self):
+        threads = []
+        view = views.UserInfoAPI.as_view()
+
+        def record_thread(*args, **kwargs):
+            threads.append(threading.current_thread().name)
+            return view(*args, **kwargs)
+
+        response = self.get(record_thread, '/app/user/62/fullname', pk=62)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(response.content)['first_name'], User.objects.get(id=62).first_name)
+        self.assertTrue(threads[0].startswith('async-views'))
+
+        response = self.get(views.UserPostList.as_view(), '/app/posts/?user_id=62')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(json.loads(response.content)['results']), 2)
+
+        response = self.get(views.SubscriptionList.as_view(), '/app/subscriptions/62', follower_id=62)
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
 
 class HelperFuncTestCase(unittest.TestCase):
     """Unit test functions from helpers.py."""
@@ -569,6 +1672,17 @@ class HelperFuncTestCase(unittest.TestCase):
         self.assertEqual(get_timedelta_for_post(pub_date),
                          f"{pub_date.strftime('%B').upper()} {pub_date.strftime('%d').lstrip('0')}, {pub_date.year}")
 
+    def test_relative_time_formatter(self):
+        """RelativeTimeFormatter formats every date against the same moment and in post time zone."""
+        now = datetime(2022, 3, 1, 12, 0, tzinfo=pytz.utc)
+        formatter = RelativeTimeFormatter(now)
+        self.assertEqual(formatter(now - timedelta(minutes=2)), '2 MINUTES AGO')
+        self.assertEqual(formatter(now - timedelta(days=2)), '2 DAYS AGO')
+        # 21:00 UTC is already the next day in Asia/Oral (UTC+5)
+        self.assertEqual(formatter(datetime(2022, 2, 10, 21, 0, tzinfo=pytz.utc)), 'FEBRUARY 11')
+        self.assertEqual(formatter(datetime(2021, 2, 10, 12, 0, tzinfo=pytz.utc)), 'FEBRUARY 10, 2021')
+        self.assertEqual(formatter(now + timedelta(days=1)), 'UNDEFINED')
+
 
 class MySeleniumTests(StaticLiveServerTestCase):
     fixtures = ['users.json', 'posts.json', 'subscriptions.json']
@@ -584,6 +1698,9 @@ class MySeleniumTests(StaticLiveServerTestCase):
         cls.selenium.quit()
         super().tearDownClass()
 
+    def setUp(self):
+        call_command('rebuild_timelines', stdout=StringIO())
+
     def test_cancel_returns_to_profile_page(self):
         """When pressing Cancel button, user returns to his profile page."""
         self.selenium.get(f'{self.live_server_url}/app/')
@@ -0,0 +1,209 @@
+"""Materialized home timelines (hybrid fan-out).
+
+Every user owns a list of ids of their own posts and posts of the accounts they follow.
+Ids are pushed when a post is created and when a follow is created,
+and removed when a follow is deleted (post deletion cascades).
+
+Accounts with at least FEED_FANOUT_FOLLOWER_THRESHOLD followers are not pushed,
+one post of theirs would cost an insert per follower. Their posts are pulled
+when a feed page is read and merged with the pushed timeline. When a follow takes an account
+over the threshold it is marked `pulled_since`; when an unfollow takes it back below,
+posts it made meanwhile are pushed to its followers.
+
+A follow copies only the latest TIMELINE_BACKFILL_SIZE posts of the followee. The date of the
+oldest copied post of a followee that has more is kept as the owner's `timeline_horizon`:
+the timeline is complete after it, feed pages from there back are pulled from posts.
+"""
+
+import heapq
+import logging
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db.models import OuterRef, Q, QuerySet, Subquery
+from django.utils import timezone
+
+from .helpers import filter_after
+from .models import Post, Subscription, TimelineEntry, User, forget_cached_users
+
+logger = logging.getLogger(__name__)
+
+# how many latest posts of a followee are copied into the follower's timeline on follow
+BACKFILL_SIZE = getattr(settings, 'TIMELINE_BACKFILL_SIZE', 200)
+# accounts with this many followers or more are pulled at read time instead of pushed
+FANOUT_FOLLOWER_THRESHOLD = getattr(settings, 'FEED_FANOUT_FOLLOWER_THRESHOLD', 10000)
+BATCH_SIZE = 1000
+
+
+def _entries(owner_ids, posts):
+    return [TimelineEntry(owner_id=owner_id, post_id=post.id, pub_date=post.pub_date)
+            for owner_id in owner_ids for post in posts]
+
+
+def is_pulled(user_id: int) -> bool:
+    """Check if posts of the user are pulled at read time instead of pushed."""
+    return User.objects.filter(id=user_id, followers_count__gte=FANOUT_FOLLOWER_THRESHOLD).exists()
+
+
+def pulled_followee_ids(user_id: int) -> List[int]:
+    """Returns ids of accounts followed by the user whose posts are pulled at read time."""
+    return list(User.objects.filter(subscription_followees__follower=user_id,
+                                    followers_count__gte=FANOUT_FOLLOWER_THRESHOLD)
+                .values_list('id', flat=True))
+
+
+def push_post(post: Post) -> None:
+    """Add new post to the timelines of its author and, unless the author is pulled, of all followers."""
+    owner_ids = [post.user_id]
+    if is_pulled(post.user_id):
+        # the threshold may have been crossed by a follow that has not marked the account yet
+        _mark_pulled([post.user_id], post.pub_date)
+    else:
+        owner_ids += Subscription.objects.filter(followee=post.user_id).values_list('follower_id', flat=True)
+    TimelineEntry.objects.bulk_create(_entries(owner_ids, [post]), batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def backfill(follower_id: int, followee_id: int) -> None:
+    """Copy latest posts of followee into follower's timeline."""
+    if int(follower_id) != int(followee_id) and is_pulled(followee_id):
+        _mark_pulled([followee_id])
+        return
+    _backfill(follower_id, dict(_with_cutoff(User.objects.filter(id=followee_id)).values_list('id', 'cutoff')))
+
+
+def backfill_many(follower_id: int, followee_ids: List[int]) -> None:
+    """Copy latest posts of many followees into follower's timeline with one select and one insert."""
+    followees = _with_cutoff(User.objects.filter(id__in=followee_ids)).values_list('id', 'followers_count', 'cutoff')
+    pushed, pulled = {}, []
+    for user_id, followers_count, cutoff in followees:
+        if followers_count >= FANOUT_FOLLOWER_THRESHOLD:
+            pulled.append(user_id)
+        else:
+            pushed[user_id] = cutoff
+    if pulled:
+        _mark_pulled(pulled)
+    _backfill(follower_id, pushed)
+
+
+def _with_cutoff(users: QuerySet) -> QuerySet:
+    """Annotates users with `cutoff`, pub_date of their oldest post a backfill copies, None if it copies all."""
+    cutoff = Post.objects.filter(user=OuterRef('pk')).order_by('-pub_date', '-id')\
+        .values('pub_date')[BACKFILL_SIZE - 1:BACKFILL_SIZE]
+    return users.annotate(cutoff=Subquery(cutoff))
+
+
+def _backfill(follower_id: int, cutoffs: Dict[int, Optional[datetime]]) -> None:
+    """Copy posts of followees in `cutoffs` {followee_id: cutoff} from their cutoff on."""
+    if not cutoffs:
+        return
+    condition = Q(user__in=[user_id for user_id, date in cutoffs.items() if date is None])
+    for user_id, date in cutoffs.items():
+        if date is not None:
+            condition |= Q(user=user_id, pub_date__gte=date)
+    posts = Post.objects.filter(condition).only('id', 'pub_date').order_by()
+    TimelineEntry.objects.bulk_create(_entries([follower_id], posts), batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+    horizon = max((date for date in cutoffs.values() if date is not None), default=None)
+    if horizon is not None:
+        User.objects.filter(Q(timeline_horizon__isnull=True) | Q(timeline_horizon__lt=horizon), id=follower_id)\
+            .update(timeline_horizon=horizon)
+        forget_cached_users(follower_id)
+
+
+def remove_followee_posts(follower_id: int, followee_id: int) -> None:
+    """Remove posts of followee from follower's timeline."""
+    remove_followees_posts(follower_id, [followee_id])
+
+
+def remove_followees_posts(follower_id: int, followee_ids: List[int]) -> None:
+    """Remove posts of many followees from follower's timeline."""
+    TimelineEntry.objects.filter(owner=follower_id, post__user__in=followee_ids).delete()
+    _unmark_pulled(followee_ids)
+
+
+def _mark_pulled(user_ids: List[int], since=None) -> None:
+    """Remember when accounts of `user_ids` that reached the threshold stopped being pushed."""
+    marked = User.objects.filter(id__in=user_ids, followers_count__gte=FANOUT_FOLLOWER_THRESHOLD,
+                                 pulled_since__isnull=True)
+    if marked.update(pulled_since=since or timezone.now()):
+        forget_cached_users(*user_ids)
+
+
+def _unmark_pulled(user_ids: List[int]) -> None:
+    """Push posts that accounts of `user_ids` made while pulled, when they dropped below the threshold."""
+    dropped = User.objects.filter(id__in=user_ids, followers_count__lt=FANOUT_FOLLOWER_THRESHOLD,
+                                  pulled_since__isnull=False).values_list('id', 'pulled_since')
+    for user_id, pulled_since in dropped:
+        # concurrent unfollows push the posts once
+        if not User.objects.filter(id=user_id, pulled_since=pulled_since).update(pulled_since=None):
+            continue
+        forget_cached_users(user_id)
+        posts = list(Post.objects.filter(user=user_id, pub_date__gte=pulled_since).only('id', 'pub_date')
+                     [:BACKFILL_SIZE + 1])
+        followers = Subscription.objects.filter(followee=user_id)
+        follower_ids = list(followers.values_list('follower_id', flat=True))
+        TimelineEntry.objects.bulk_create(_entries(follower_ids, posts[:BACKFILL_SIZE]), batch_size=BATCH_SIZE,
+                                          ignore_conflicts=True)
+        if len(posts) > BACKFILL_SIZE:
+            # like a capped backfill, older posts are pulled past the followers' horizon
+            horizon = posts[BACKFILL_SIZE - 1].pub_date
+            User.objects.filter(Q(timeline_horizon__isnull=True) | Q(timeline_horizon__lt=horizon),
+                                id__in=followers.values('follower_id')).update(timeline_horizon=horizon)
+            forget_cached_users(*follower_ids)
+
+
+def rebuild(user_id: int) -> None:
+    """Recreate user's timeline from their own posts and latest posts of everyone they follow."""
+    TimelineEntry.objects.filter(owner=user_id).delete()
+    User.objects.filter(id=user_id).update(timeline_horizon=None)
+    forget_cached_users(user_id)
+    followees = Subscription.objects.filter(follower=user_id, followee__followers_count__lt=FANOUT_FOLLOWER_THRESHOLD)
+    users = User.objects.filter(Q(id=user_id) | Q(id__in=followees.values('followee_id')))
+    _backfill(user_id, dict(_with_cutoff(users).values_list('id', 'cutoff')))
+
+
+def feed_page(user_id: int, position: Optional[tuple], limit: int, timings: Optional[dict] = None) -> List[Post]:
+    """
+    Returns up to `limit` feed posts of the user that come after (pub_date, id) `position`.
+    Time spent on each stage in milliseconds is stored in `timings`.
+    """
+    timings = {} if timings is None else timings
+    started = time.perf_counter()
+    horizon = User.objects.filter(id=user_id).values_list('timeline_horizon', flat=True).first()
+    entries = filter_after(TimelineEntry.objects.filter(owner=user_id), position, id_field='post_id')
+    if horizon is not None:
+        entries = entries.filter(pub_date__gt=horizon)
+    pushed = [entry.post for entry in entries.select_related('post__user').order_by('-pub_date', '-post_id')[:limit]]
+    if horizon is not None and len(pushed) < limit:
+        # page reaches past the horizon, older posts are read like a timeline-less feed
+        followees = Subscription.objects.filter(follower=user_id).values('followee_id')
+        older = filter_after(Post.objects.filter(Q(user=user_id) | Q(user__in=followees), pub_date__lte=horizon),
+                             position)
+        pushed += older.select_related('user').order_by('-pub_date', '-id')[:limit - len(pushed)]
+    timings['timeline'] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    pulled_ids = pulled_followee_ids(user_id)
+    pulled = []
+    if pulled_ids:
+        pulled = list(filter_after(Post.objects.filter(user__in=pulled_ids), position)
+                      .select_related('user')
+                      .order_by('-pub_date', '-id')[:limit])
+    timings['pull'] = (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    posts, seen = [], set()
+    # both lists are sorted newest first, an account can be in both when it crossed the threshold
+    for post in heapq.merge(pushed, pulled, key=lambda p: (p.pub_date, p.id), reverse=True):
+        if post.id not in seen:
+            seen.add(post.id)
+            posts.append(post)
+        if len(posts) == limit:
+            break
+    timings['merge'] = (time.perf_counter() - started) * 1000
+
+    logger.debug('feed page for user %s: %d pushed, %d pulled from %d accounts, timings %s',
+                 user_id, len(pushed), len(pulled), len(pulled_ids), timings)
+    return posts
@@ -1,8 +1,16 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.urlpatterns import format_suffix_patterns
 
 
 from . import views
+from .async_views import async_view
+
+
+def api_view(view):
+    """Hot JSON endpoints are served by async variants when the project runs under ASGI."""
+    return async_view(view) if getattr(settings, 'ASYNC_API_VIEWS', False) else view
+
 
 app_name = 'app'
 urlpatterns = [
@@ -19,13 +27,19 @@ urlpatterns = [
     path('p/<int:pk>/delete', views.PostDeleteView.as_view(), name='post_delete'),
     path('p/<int:pk>/update', views.PostUpdateView.as_view(), name='post_update'),
     path('feed', views.Feed.as_view(), name='feed'),
-    path('subscriptions/<int:follower_id>', views.SubscriptionList.as_view(), name='subscription_list'),
+    path('subscriptions/<int:follower_id>', api_view(views.SubscriptionList.as_view()), name='subscription_list'),
+    path('subscriptions/<int:follower_id>/bulk', views.SubscriptionBulk.as_view(), name='subscription_bulk'),
     path('subscriptions/<int:follower_id>/<int:followee_id>', views.SubscriptionDetail.as_view(), name='subscription'),
     path('explore', views.ExploreUserListView.as_view(), name='user-list'),
-    path('likes/<int:post_id>', views.LikeList.as_view(), name='likes'),
-    path('likes/<int:post_id>/<int:user_id>', views.LikeDetail.as_view(), name='like'),
-    path('user/<int:pk>/fullname', views.UserInfoAPI.as_view(), name='user_fullname'),
+    path('likes/<int:post_id>', api_view(views.LikeList.as_view()), name='likes'),
+    path('likes/<int:post_id>/toggle', api_view(views.LikeToggle.as_view()), name='like_toggle'),
+    path('likes/<int:post_id>/<int:user_id>', api_view(views.LikeDetail.as_view()), name='like'),
+    path('user/<int:pk>/fullname', api_view(views.UserInfoAPI.as_view()), name='user_fullname'),
+    path('users/cards', views.UserCardList.as_view(), name='user_cards'),
+    path('viewer/status', api_view(views.ViewerStatusAPI.as_view()), name='viewer_status'),
+    path('user/<int:pk>/followers', views.UserFollowList.as_view(direction='followers'), name='user_followers'),
+    path('user/<int:pk>/following', views.UserFollowList.as_view(direction='following'), name='user_following'),
     path('api-auth/', include('rest_framework.urls')),
 ]
 
-urlpatterns += format_suffix_patterns([path('posts/', views.UserPostList.as_view(), name='posts')])
+urlpatterns += format_suffix_patterns([path('posts/', api_view(views.UserPostList.as_view()), name='posts')])
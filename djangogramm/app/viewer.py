@@ -0,0 +1,30 @@
+"""Like and follow state of many posts and users as seen by one user, for rendering lists."""
+
+from typing import Dict, Iterable, NamedTuple, Set
+
+from . import like_buffer
+from .models import Like, Subscription
+
+
+class ViewerStatus(NamedTuple):
+    liked: Set[int]
+    following: Set[int]
+    # own likes not flushed to the posts' counters yet, {post_id: +1 or -1}
+    likes_delta: Dict[int, int]
+
+
+def viewer_status(user_id: int, post_ids: Iterable[int] = (), user_ids: Iterable[int] = ()) -> ViewerStatus:
+    """Returns which of `post_ids` the user liked and which of `user_ids` they follow, in one query each."""
+    post_ids, user_ids = list(post_ids), list(user_ids)
+    liked, following, likes_delta = set(), set(), {}
+    if post_ids:
+        liked = set(Like.objects.filter(user=user_id, post__in=post_ids).values_list('post_id', flat=True))
+        if like_buffer.enabled():
+            for post_id, pending in like_buffer.pending_states(user_id, post_ids).items():
+                if pending != (post_id in liked):
+                    likes_delta[post_id] = 1 if pending else -1
+                    (liked.add if pending else liked.discard)(post_id)
+    if user_ids:
+        following = set(Subscription.objects.filter(follower=user_id, followee__in=user_ids)
+                        .values_list('followee_id', flat=True))
+    return ViewerStatus(liked, following, likes_delta)
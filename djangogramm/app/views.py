@@ -1,15 +1,22 @@
-import re
+from datetime import datetime
 
-from django.core.mail import send_mail
+from django.conf import settings
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import UploadedFile
 from django.core.validators import validate_email
-from django.http import HttpResponse, HttpResponseRedirect, HttpResponseNotFound, HttpResponseNotAllowed, Http404
+from django.db import transaction
+from django.db.models import Q
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseRedirect, HttpResponseNotFound, \
+    HttpResponseNotAllowed, Http404
 from django.shortcuts import render
 from django.template.loader import render_to_string
 from django.utils.encoding import force_bytes, force_str
-from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
-from django.views import View
+from django.utils.cache import patch_cache_control
+from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode, http_date, parse_http_date_safe
+from django.views import View, static
 from django.views.generic.detail import DetailView
+from django.views.generic.base import TemplateView
 from django.views.generic.list import ListView
 from django.views.generic.edit import FormView, CreateView, DeleteView, UpdateView
 from django.contrib.auth import authenticate, login, logout
@@ -17,18 +24,20 @@ from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib.auth.tokens import default_token_generator
 from django.contrib.sites.shortcuts import get_current_site
 from django.urls import reverse, reverse_lazy
-from django.conf import settings
 from rest_framework import status, permissions, generics
 from rest_framework.views import APIView
 from rest_framework.response import Response
 
-from .helpers import get_timedelta_for_post
+from .helpers import get_timedelta_for_post, RelativeTimeFormatter, encode_cursor, decode_cursor, filter_after, \
+    make_etag
 from .models import User, Post, Subscription, Like, EMPTY_USER_IMAGE
 from .forms import UserLoginForm, UserFullInfoForm, UserRegisterForm, AddPostForm, UserEditInfoForm, \
     UserAvatarUpdateForm, UserEditInfoCloudinaryForm
 from .serializers import UserProfilePostSerializer, FeedPostSerializer, SubscriptionSerializer, LikeSerializer, \
-    UserSerializer
+    UserSerializer, UserCardSerializer, LikerSerializer
 from .permissions import IsAdminOrUserOwnSubscriptions
+from . import like_buffer, mail_queue, media, timeline
+from .viewer import viewer_status
 
 
 class Authentication(View):
@@ -97,13 +106,8 @@ class Register(View):
                         'token': default_token_generator.make_token(user),
                     })
                     to_email = form.cleaned_data.get('email')
-                    send_mail(
-                        mail_subject,
-                        message,
-                        settings.EMAIL_HOST_USER,
-                        [to_email],
-                        fail_silently=False,
-                    )
+                    # sent by the process_email_queue command
+                    mail_queue.enqueue(mail_subject, message, to_email)
                     return render(request,
                                   "app/activation_link_sent.html",
                                   {'email': form.cleaned_data['email']})
@@ -119,7 +123,7 @@ def activate(request, uidb64, token):
         user = None
     if user is not None and default_token_generator.check_token(user, token):
         user.is_active = True
-        user.save()
+        user.save(update_fields=['is_active', 'updated_at'])
         login(request, user)
         return HttpResponseRedirect(reverse('app:enter_info', args=[user.id]))
     else:
@@ -131,34 +135,60 @@ def logout_view(request):
     return HttpResponseRedirect(reverse('app:handle_authentication'))
 
 
+def loaded_objects(request) -> dict:
+    """Returns model instances already loaded while handling the request, keyed by (model, pk)."""
+    if not hasattr(request, '_loaded_objects'):
+        request._loaded_objects = {}
+        if request.user.is_authenticated:
+            # authentication middleware has loaded the user already
+            request._loaded_objects[(User, request.user.pk)] = request.user
+    return request._loaded_objects
+
+
+class LoadedObjectMixin:
+    """
+    Load view's object once per request. Permission check in `test_func`, context and the action
+    itself share one instance, which is `request.user` itself when the view is about the signed-in user.
+    """
+
+    def get_object(self, queryset=None):
+        if queryset is None:
+            queryset = self.get_queryset()
+        objects = loaded_objects(self.request)
+        key = (queryset.model, self.kwargs.get(self.pk_url_kwarg))
+        if key not in objects:
+            objects[key] = super().get_object(queryset)
+        return objects[key]
+
+
 class UserEnterInfoView(UserPassesTestMixin, LoginRequiredMixin, FormView):
     form_class = UserFullInfoForm
     template_name = 'app/user_enter_info.html'
     login_url = reverse_lazy('app:handle_authentication')
 
     def test_func(self):
-        pattern = r'app/(\d+)/enter_info'
-        url = re.search(pattern, self.request.path)
-        user_id = url.group(1)
-        return user_id == str(self.request.user.pk)
+        return self.kwargs['pk'] == self.request.user.pk
 
     def form_valid(self, form):
         # This method is called when valid form data has been POSTed.
         # It should return an HttpResponse.
         if self.request.user.is_authenticated:
-            user = User.objects.get(email=self.request.user.email)
+            user = self.request.user
             user.first_name = form.cleaned_data.get('first_name')
             user.last_name = form.cleaned_data.get('last_name')
             user.bio = form.cleaned_data.get('bio')
+            fields = ['first_name', 'last_name', 'bio', 'updated_at', 'edited_at']
             avatar_image = form.files.get('avatar')
             if avatar_image:
-                user.avatar = avatar_image
-            user.save()
+                media.defer_upload(user, avatar_image)
+                fields += media.STAGED_FIELDS
+            # request.user comes from cache and may be stale, only the changed fields are written
+            user.save(update_fields=fields)
             self.success_url = reverse('app:profile', args=[user.id])
         return super().form_valid(form)
 
 
-class UserEditInfoView(UserPassesTestMixin, LoginRequiredMixin, UpdateView):
+class UserEditInfoView(LoadedObjectMixin, UserPassesTestMixin, LoginRequiredMixin, UpdateView):
     model = User
     form_class = UserEditInfoForm
     template_name = 'app/user_edit_profile.html'
@@ -171,6 +201,17 @@ class UserEditInfoView(UserPassesTestMixin, LoginRequiredMixin, UpdateView):
     def get_success_url(self):
         return reverse("app:profile", args=[self.request.user.id])
 
+    def form_valid(self, form):
+        fields = ['first_name', 'last_name', 'bio', 'updated_at', 'edited_at']
+        avatar_image = form.cleaned_data.get('avatar')
+        if isinstance(avatar_image, UploadedFile):
+            media.defer_upload(form.instance, avatar_image)
+            fields += media.STAGED_FIELDS
+        # the object is the cached request.user, saving all of it could write back stale fields
+        self.object = form.save(commit=False)
+        self.object.save(update_fields=fields)
+        return HttpResponseRedirect(self.get_success_url())
+
     def get_form(self, form_class=None):
         form = super(UserEditInfoView, self).get_form(form_class)
         form.fields['first_name'].required = True
@@ -183,31 +224,24 @@ class UserEditInfoView(UserPassesTestMixin, LoginRequiredMixin, UpdateView):
         return context
 
 
-class UserProfile(LoginRequiredMixin, DetailView):
+class UserProfile(LoadedObjectMixin, LoginRequiredMixin, DetailView):
     model = User
     context_object_name = 'user'
     login_url = reverse_lazy('app:handle_authentication')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        page_user = self.get_object()
+        page_user = self.object
         auth_user = self.request.user
         context['auth_user'] = auth_user
         context['can_edit'] = True if auth_user.pk == page_user.id else False
         can_follow = True if auth_user.pk != page_user.id else False
         follow_params = {'can_follow': can_follow}
         if can_follow:
-            try:
-                auth_user.subscription_followers.get(followee=page_user)
-            except Subscription.DoesNotExist:
-                is_following = False
-            else:
-                is_following = True
-            follow_params['is_following'] = is_following
+            following = viewer_status(auth_user.pk, user_ids=[page_user.id]).following
+            follow_params['is_following'] = page_user.id in following
         context['follow_params'] = follow_params
-        context['followers'] = page_user.followers.all()
-        context['following'] = page_user.following.all()
-        context['num_posts'] = page_user.post_set.count()
+        context['num_posts'] = page_user.posts_count
         context['empty_avatar'] = True if str(page_user.avatar) == 'media/empty_user_avatar' else False
         return context
 
@@ -220,18 +254,19 @@ class UserAvatarUpdateView(UserPassesTestMixin, LoginRequiredMixin, FormView):
         # This method is called when valid form data has been POSTed.
         # It should return an HttpResponse.
         if self.request.user.is_authenticated:
-            user = User.objects.get(email=self.request.user.email)
-            user.avatar = form.files.get('avatar')
-            user.save()
+            user = self.request.user
+            media.defer_upload(user, form.files.get('avatar'))
+            user.save(update_fields=[*media.STAGED_FIELDS, 'updated_at', 'edited_at'])
             self.success_url = reverse('app:profile', args=[user.id])
         return super().form_valid(form)
 
     def post(self, request, *args, **kwargs):
         delete_avatar = request.POST.get('delete_avatar')
         if delete_avatar and delete_avatar == 'true':
-            user = User.objects.get(email=self.request.user.email)
-            user.avatar = EMPTY_USER_IMAGE
-            user.save()
+            user = self.request.user
+            media.discard_staged(user)
+            user.avatar, user.variants = EMPTY_USER_IMAGE, {}
+            user.save(update_fields=['avatar', 'variants', *media.STAGED_FIELDS, 'updated_at', 'edited_at'])
             return HttpResponseRedirect(reverse('app:profile', args=[user.id]))
         return super().post(request, args, kwargs)
 
@@ -239,10 +274,7 @@ class UserAvatarUpdateView(UserPassesTestMixin, LoginRequiredMixin, FormView):
         return HttpResponseNotAllowed(['GET'])
 
     def test_func(self):
-        pattern = r'app/(\d+)/change_avatar'
-        url = re.search(pattern, self.request.path)
-        user_id = url.group(1)
-        return user_id == str(self.request.user.id)
+        return self.kwargs['pk'] == self.request.user.pk
 
 
 class AddPostView(UserPassesTestMixin, LoginRequiredMixin, CreateView):
@@ -252,14 +284,16 @@ class AddPostView(UserPassesTestMixin, LoginRequiredMixin, CreateView):
     login_url = reverse_lazy('app:handle_authentication')
 
     def test_func(self):
-        pattern = r'app/(\d+)/add_post'
-        url = re.search(pattern, self.request.path)
-        user_id = url.group(1)
-        return user_id == str(self.request.user.pk)
+        return self.kwargs['pk'] == self.request.user.pk
 
     def form_valid(self, form):
         form.instance.user = self.request.user
-        return super().form_valid(form)
+        media.defer_upload(form.instance, form.cleaned_data['image'])
+        # a post is either saved and in its followers' feeds or not saved at all
+        with transaction.atomic():
+            response = super().form_valid(form)
+            timeline.push_post(self.object)
+        return response
 
     def get_success_url(self):
         return reverse("app:profile", args=[self.request.user.id])
@@ -270,18 +304,46 @@ class AddPostView(UserPassesTestMixin, LoginRequiredMixin, CreateView):
         return context
 
 
-class UserPostList(APIView):
+class ConditionalGetMixin:
+    """
+    Answer GET with 304 when the client's copy is still valid.
+    Validators are computed from cheap columns (ids, `updated_at`, counters),
+    the response body is built only when they changed.
+    """
+    cache_control = 'private, no-cache'
+
+    def conditional_response(self, request, validators, build_data, last_modified=None):
+        etag = make_etag(*validators)
+        if_none_match = request.headers.get('If-None-Match')
+        if if_none_match:
+            not_modified = etag in if_none_match
+        else:
+            since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+            not_modified = bool(since and last_modified and int(last_modified.timestamp()) <= since)
+
+        if not_modified:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(build_data())
+        response['ETag'] = etag
+        if last_modified:
+            response['Last-Modified'] = http_date(last_modified.timestamp())
+        response['Cache-Control'] = self.cache_control
+        return response
+
+
+class UserPostList(ConditionalGetMixin, APIView):
     """
     View class to return posts for UserProfile or Feed views.
     """
     permission_classes = [permissions.IsAuthenticated]
+    default_limit = 9
+    max_limit = 50
 
-    @staticmethod
-    def get(request, format=None):
+    def get(self, request, format=None):
         # store received query params
         q_params = {
-            'offset': request.GET.get('offset'),
-            'start': request.GET.get('start'),
+            'limit': request.GET.get('limit'),
             'user_id': request.GET.get('user_id')
         }
         # validate params
@@ -289,69 +351,126 @@ class UserPostList(APIView):
             if val:
                 try:
                     q_params[param] = int(val)
-                except TypeError:
+                except ValueError:
                     return Response(status=status.HTTP_400_BAD_REQUEST)
+        limit = min(q_params['limit'] or self.default_limit, self.max_limit)
+        if limit < 1:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        position = None
+        cursor = request.GET.get('cursor')
+        if cursor:
+            position = decode_cursor(cursor, datetime, int)
+            if position is None:
+                return Response(status=status.HTTP_400_BAD_REQUEST)
+        # 'epoch' sends raw `pub_ts` timestamps for the client to format
+        timestamps = request.GET.get('timestamps')
+        if timestamps not in (None, 'epoch'):
+            return Response(status=status.HTTP_400_BAD_REQUEST)
 
         if q_params['user_id']:
-            if not q_params['start'] and not q_params['offset']:
-                posts = Post.objects.filter(user__id=q_params['user_id'])
-            elif not q_params['start'] or not q_params['offset']:
-                posts = Post.objects.filter(user__id=q_params['user_id'])[
-                        q_params['start']:q_params['offset']]
-            elif q_params['offset'] and q_params['start']:
-                posts = Post.objects.filter(
-                    user__id=q_params['user_id'])[
-                        q_params['start']:q_params['start'] +
-                                          q_params['offset']]
-            serializer = UserProfilePostSerializer(posts, many=True)
-        else:
-            auth_user = User.objects.get(id=request.user.id)
-            posts = Post.objects.filter(user__in=auth_user.following.all())\
-                .union(Post.objects.filter(user=auth_user))\
-                .order_by('-pub_date')
-            if not q_params['start'] or not q_params['offset']:
-                posts = posts[q_params['start']:q_params['offset']]
-            elif q_params['offset'] and q_params['start']:
-                posts = posts[
-                        q_params['start']:q_params['start'] + q_params['offset']]
-            serializer = FeedPostSerializer(posts, many=True)
+            posts = Post.objects.filter(user__id=q_params['user_id'])
+            posts, next_cursor = self.paginate(posts, position, limit)
+
+            pending_likes = self.pending_likes(request, posts)
+
+            def build_data():
+                UserProfilePostSerializer.prefetch(posts)
+                context = {'pending_likes': pending_likes, 'user_id': request.user.id}
+                serializer = UserProfilePostSerializer(posts, many=True, context=context)
+                return {'results': serializer.data, 'next_cursor': next_cursor, 'has_more': next_cursor is not None}
+
+            validators = [cursor, limit, next_cursor, pending_likes] + [(post.id, post.updated_at) for post in posts]
+            # pending likes change without any row being updated
+            last_modified = None if pending_likes else self.last_modified(posts)
+            return self.conditional_response(request, validators, build_data, last_modified)
+
+        # feed is read from the materialized timeline merged with posts of pulled accounts
+        timings = {}
+        posts = timeline.feed_page(request.user.id, position, limit + 1, timings=timings)
+        posts, next_cursor = self.cut_page(posts, limit)
+
+        time_formatter = RelativeTimeFormatter()
+        pending_likes = self.pending_likes(request, posts)
+
+        def build_data():
+            FeedPostSerializer.prefetch(posts)
+            # own likes not flushed yet are added to the counts, likes already stored are counted in
+            likes_delta = viewer_status(request.user.id, pending_likes).likes_delta if pending_likes else {}
+            context = {'timestamps': timestamps, 'time_formatter': time_formatter, 'likes_delta': likes_delta}
+            serializer = FeedPostSerializer(posts, many=True, context=context)
+            return {'results': serializer.data, 'next_cursor': next_cursor, 'has_more': next_cursor is not None}
+
+        validators = [cursor, limit, next_cursor, timestamps, pending_likes]
+        validators += [(post.id, post.updated_at, post.user.updated_at) for post in posts]
+        if timestamps != 'epoch':
+            # relative publication time ("5 minutes ago") changes without any row being updated
+            validators += [time_formatter(post.pub_date) for post in posts]
+        response = self.conditional_response(request, validators, build_data)
+        response['Server-Timing'] = ', '.join(f'{name};dur={dur:.2f}' for name, dur in timings.items())
+        return response
 
-        return Response(serializer.data)
+    @staticmethod
+    def last_modified(posts):
+        return max((post.updated_at for post in posts), default=None)
+
+    @staticmethod
+    def pending_likes(request, posts):
+        """User's own likes not flushed yet, so they see them right away."""
+        if not like_buffer.enabled() or not posts:
+            return {}
+        return like_buffer.pending_states(request.user.id, [post.id for post in posts])
 
+    @staticmethod
+    def paginate(queryset, position, limit):
+        """Return posts strictly after (pub_date, id) `position` and cursor to the next page."""
+        # fetch one extra row to know if there is a next page without counting
+        posts = list(filter_after(queryset, position).order_by('-pub_date', '-id')[:limit + 1])
+        return UserPostList.cut_page(posts, limit)
 
-class PostDetail(LoginRequiredMixin, DetailView):
-    model = Post
+    @staticmethod
+    def cut_page(posts, limit):
+        next_cursor = None
+        if len(posts) > limit:
+            posts = posts[:limit]
+            next_cursor = encode_cursor(posts[-1].pub_date, posts[-1].id)
+        return posts, next_cursor
+
+
+class PostDetail(LoadedObjectMixin, LoginRequiredMixin, DetailView):
+    queryset = Post.objects.select_related('user')
     context_object_name = 'post'
     login_url = reverse_lazy('app:handle_authentication')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        post = self.get_object()
+        post = self.object
         auth_user = self.request.user
         context['post_timedelta'] = get_timedelta_for_post(post.pub_date)
-        context['can_edit'] = True if auth_user.pk == post.user.pk else False
+        context['can_edit'] = True if auth_user.pk == post.user_id else False
         context['auth_user'] = auth_user
-        liked = Like.objects.filter(post=post.pk, user=auth_user.pk)
-        context['liked'] = True if liked else False
+        viewer = viewer_status(auth_user.pk, post_ids=[post.pk])
+        context['liked'] = post.pk in viewer.liked
+        context['likes_count'] = post.likes_count + viewer.likes_delta.get(post.pk, 0)
         return context
 
 
-class PostDeleteView(UserPassesTestMixin, LoginRequiredMixin, DeleteView):
+class PostDeleteView(LoadedObjectMixin, UserPassesTestMixin, LoginRequiredMixin, DeleteView):
     model = Post
     context_object_name = 'post'
     login_url = reverse_lazy('app:handle_authentication')
 
     def test_func(self):
-        return self.request.user.pk == self.get_object().user.pk
+        return self.request.user.pk == self.get_object().user_id
 
     def get_success_url(self):
-        return reverse_lazy('app:profile', kwargs={'pk': self.object.user.id})
+        return reverse_lazy('app:profile', kwargs={'pk': self.object.user_id})
 
     def get(self, request, *args, **kwargs):
         return HttpResponseNotFound('<h1>Page not found</h1>')
 
 
-class PostUpdateView(UserPassesTestMixin, LoginRequiredMixin, UpdateView):
+class PostUpdateView(LoadedObjectMixin, UserPassesTestMixin, LoginRequiredMixin, UpdateView):
     model = Post
     fields = ['caption']
     template_name_suffix = '_update_form'
@@ -359,25 +478,30 @@ class PostUpdateView(UserPassesTestMixin, LoginRequiredMixin, UpdateView):
     login_url = reverse_lazy('app:handle_authentication')
 
     def test_func(self):
-        return self.request.user.pk == self.get_object().user.pk
+        return self.request.user.pk == self.get_object().user_id
+
+    def form_valid(self, form):
+        # media fields are written by media.publish meanwhile, saving all of the post could write back stale ones
+        self.object = form.save(commit=False)
+        self.object.save(update_fields=['caption', 'updated_at', 'edited_at'])
+        return HttpResponseRedirect(self.get_success_url())
 
     def get(self, request, *args, **kwargs):
         return HttpResponseNotFound('<h1>Page not found</h1>')
 
 
-class Feed(LoginRequiredMixin, ListView):
-    model = Post
+class Feed(LoginRequiredMixin, TemplateView):
+    """Feed page, posts are loaded by feed.js page by page until the API reports `has_more` is false."""
     template_name = 'app/feed.html'
     login_url = reverse_lazy('app:handle_authentication')
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['total_num_posts'] = Post.objects.all().count()
         context['auth_user'] = self.request.user
         return context
 
 
-class SubscriptionList(APIView):
+class SubscriptionList(ConditionalGetMixin, APIView):
     """
     List all user subscriptions, or create a new subscription.
     """
@@ -385,12 +509,17 @@ class SubscriptionList(APIView):
 
     def get(self, request, follower_id):
         try:
-            User.objects.get(id=follower_id)
+            follower = User.objects.only('id', 'following_count', 'updated_at').get(id=follower_id)
         except User.DoesNotExist:
             return Response(status=status.HTTP_404_NOT_FOUND)
-        subscriptions = Subscription.objects.filter(follower=follower_id)
-        serializer = SubscriptionSerializer(subscriptions, many=True)
-        return Response(serializer.data)
+
+        def build_data():
+            subscriptions = Subscription.objects.filter(follower=follower_id)
+            return SubscriptionSerializer(subscriptions, many=True).data
+
+        # follow and unfollow bump follower's `updated_at` together with the counter
+        validators = [follower.id, follower.following_count, follower.updated_at]
+        return self.conditional_response(request, validators, build_data, follower.updated_at)
 
     def post(self, request, follower_id):
         # has to provide who to follow
@@ -415,11 +544,55 @@ class SubscriptionList(APIView):
             'followee': followee_id,
             'follower': follower_id})
         if serializer.is_valid():
-            serializer.save()
+            with transaction.atomic():
+                serializer.save()
+                timeline.backfill(follower_id, followee_id)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class SubscriptionBulk(APIView):
+    """
+    Follow (POST) or unfollow (DELETE) many users at once.
+    Users are given as `followee_ids` list, the result of each of them is returned in the same order.
+    """
+    permission_classes = [permissions.IsAuthenticated, IsAdminOrUserOwnSubscriptions]
+    max_batch = 100
+
+    def followee_ids(self, request):
+        ids = request.data.get('followee_ids') if hasattr(request.data, 'get') else None
+        if not isinstance(ids, list) or not 0 < len(ids) <= self.max_batch:
+            return None
+        try:
+            return list(dict.fromkeys(int(followee_id) for followee_id in ids))  # drop duplicates, keep order
+        except (TypeError, ValueError):
+            return None
+
+    def post(self, request, follower_id):
+        return self.write(request, follower_id, Subscription.follow_many, 'followed', timeline.backfill_many)
+
+    def delete(self, request, follower_id):
+        return self.write(request, follower_id, Subscription.unfollow_many, 'unfollowed',
+                          timeline.remove_followees_posts)
+
+    def write(self, request, follower_id, subscribe, changed_status, update_timeline):
+        followee_ids = self.followee_ids(request)
+        if followee_ids is None:
+            return Response({'detail': f'provide from 1 to {self.max_batch} followee_ids'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            # subscriptions, counters and the timeline change together or not at all
+            with transaction.atomic():
+                results = subscribe(follower_id, followee_ids)
+                changed = [followee_id for followee_id, result in results.items() if result == changed_status]
+                if changed:
+                    update_timeline(follower_id, changed)
+        except User.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response({'results': [{'followee_id': followee_id, 'status': result}
+                                     for followee_id, result in results.items()]})
+
+
 class SubscriptionDetail(APIView):
     """
     Retrieve or delete a subscription.
@@ -440,22 +613,53 @@ class SubscriptionDetail(APIView):
 
     def delete(self, request, follower_id, followee_id):
         subscription = self.get_object(followee_id, follower_id)
-        subscription.delete()
+        with transaction.atomic():
+            subscription.delete()
+            timeline.remove_followee_posts(follower_id, followee_id)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class LikeList(generics.ListCreateAPIView):
+class LikeList(ConditionalGetMixin, generics.ListCreateAPIView):
     """
-    List all post likes, or add a new like.
+    List post likes with liker cards, newest first, or add a new like.
     """
     serializer_class = LikeSerializer
     permission_classes = [permissions.IsAuthenticated]
+    default_limit = 20
+    max_limit = 100
 
     def list(self, request, *args, **kwargs):
         post_id = kwargs.get('post_id')
+        try:
+            limit = min(int(request.GET.get('limit') or self.default_limit), self.max_limit)
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
         queryset = self.get_queryset(post_id=post_id)
-        serializer = self.get_serializer_class()(queryset, many=True)
-        return Response(serializer.data)
+        cursor = request.GET.get('cursor')
+        if cursor:
+            position = decode_cursor(cursor, int)
+            if position is None:
+                return Response(status=status.HTTP_400_BAD_REQUEST)
+            queryset = queryset.filter(id__lt=position[0])
+
+        likes = list(queryset.select_related('user')
+                     .only('id', 'post_id', 'user__id', 'user__first_name', 'user__last_name', 'user__avatar',
+                           'user__variants', 'user__updated_at')
+                     .order_by('-id')[:limit + 1])
+        next_cursor = None
+        if len(likes) > limit:
+            likes = likes[:limit]
+            next_cursor = encode_cursor(likes[-1].id)
+
+        def build_data():
+            serializer = LikerSerializer(likes, many=True, context={'request': request})
+            return {'results': serializer.data, 'next_cursor': next_cursor}
+
+        validators = [cursor, limit, next_cursor] + [(like.id, like.user.updated_at) for like in likes]
+        return self.conditional_response(request, validators, build_data)
 
     def get_queryset(self, *args, **kwargs):
         post_id = kwargs.get('post_id')
@@ -467,7 +671,12 @@ class LikeList(generics.ListCreateAPIView):
 
         serializer = self.get_serializer_class()(data={'user': user_id, 'post': post_id})
         if serializer.is_valid():
-            serializer.save()
+            if like_buffer.enabled():
+                changed, _ = like_buffer.submit(post_id, serializer.validated_data['user'].id, True)
+                if not changed:
+                    return Response({'detail': 'like exists'}, status=status.HTTP_400_BAD_REQUEST)
+            else:
+                serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -497,30 +706,216 @@ class LikeDetail(generics.RetrieveDestroyAPIView):
     def destroy(self, request, *args, **kwargs):
         post_id = kwargs.get('post_id')
         user_id = kwargs.get('user_id')
+        if like_buffer.enabled():
+            try:
+                changed, _ = like_buffer.submit(post_id, user_id, False)
+            except Post.DoesNotExist:
+                raise Http404
+            if not changed:
+                raise Http404
+            return Response(status=status.HTTP_204_NO_CONTENT)
         like = self.get_object(post_id=post_id, user_id=user_id)
         like.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class ExploreUserListView(ListView):
+class LikeToggle(APIView):
+    """
+    Like or unlike a post as the current user, `liked` in the body is the wanted state,
+    so repeated requests (e.g. a double-click) are harmless. Returns the post's likes count.
+    With LIKE_BUFFER setting the like is buffered and applied later by the flush_likes command.
+    """
+    permission_classes = [permissions.IsAuthenticated]
 
+    def post(self, request, post_id):
+        liked = request.data.get('liked') if hasattr(request.data, 'get') else None
+        if not isinstance(liked, bool):
+            return Response({'detail': 'liked has to be true or false'}, status=status.HTTP_400_BAD_REQUEST)
+        set_liked = like_buffer.submit if like_buffer.enabled() else Like.set_liked
+        try:
+            changed, likes_count = set_liked(post_id, request.user.id, liked)
+        except Post.DoesNotExist:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response({'liked': liked, 'changed': changed, 'likes_count': likes_count})
+
+
+class ExploreUserListView(ListView):
+    """
+    Active users by last name. Pages are walked with an opaque (last_name, id) cursor instead of
+    OFFSET, and `partial` param renders only the next cards for infinite scroll.
+    """
     model = User
-    paginate_by = 15
-    ordering = ['last_name']
-    queryset = User.objects.filter(is_active=True).exclude(is_admin=True)
+    page_size = 15
+    queryset = User.objects.filter(is_active=True, is_admin=False)
+    count_cache_key = 'explore_users_count'
 
-    def get_context_data(self, **kwargs):
-        context = super().get_context_data(**kwargs)
-        context['auth_user'] = self.request.user
-        return context
+    def get(self, request, *args, **kwargs):
+        cursor = request.GET.get('cursor')
+        self.position = decode_cursor(cursor, str, int) if cursor else None
+        if cursor and self.position is None:
+            return HttpResponseBadRequest()
+        return super().get(request, *args, **kwargs)
+
+    def get_template_names(self):
+        if self.request.GET.get('partial'):
+            return ['app/user_list_items.html']
+        return super().get_template_names()
 
     def get_queryset(self):
         queryset = super().get_queryset()
         queryset = queryset.exclude(id=self.request.user.id)
-        return queryset
+        if self.position is not None:
+            last_name, user_id = self.position
+            queryset = queryset.filter(Q(last_name__gt=last_name) | Q(last_name=last_name, id__gt=user_id))
+        return queryset.order_by('last_name', 'id')
 
+    def get_context_data(self, **kwargs):
+        # fetch one extra row to know if there is a next page without counting
+        users = list(self.object_list[:self.page_size + 1])
+        next_cursor = None
+        if len(users) > self.page_size:
+            users = users[:self.page_size]
+            next_cursor = encode_cursor(users[-1].last_name, users[-1].id)
+        context = super().get_context_data(object_list=users, **kwargs)
+        context['next_cursor'] = next_cursor
+        context['auth_user'] = self.request.user
+        context['following'] = viewer_status(self.request.user.pk, user_ids=[user.id for user in users]).following
+        if not self.request.GET.get('partial'):
+            context['users_count'] = self.users_count()
+        return context
 
-class UserInfoAPI(generics.RetrieveAPIView):
+    def render_to_response(self, context, **response_kwargs):
+        response = super().render_to_response(context, **response_kwargs)
+        if self.request.GET.get('partial'):
+            response['X-Next-Cursor'] = context['next_cursor'] or ''
+        return response
+
+    def users_count(self):
+        """
+        Number of users listed to the viewer. Explorable users are counted at most once per
+        EXPLORE_COUNT_CACHE_TIMEOUT for everyone, and the viewer, who is not listed, is taken out.
+        """
+        count = cache.get_or_set(self.count_cache_key, lambda: self.queryset.count(),
+                                 getattr(settings, 'EXPLORE_COUNT_CACHE_TIMEOUT', 300))
+        user = self.request.user
+        if user.is_authenticated and user.is_active and not user.is_admin:
+            count -= 1
+        return max(count, 0)
+
+
+class UserInfoAPI(ConditionalGetMixin, generics.RetrieveAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
-    permission_classes = [permissions.IsAuthenticated]
\ No newline at end of file
+    permission_classes = [permissions.IsAuthenticated]
+
+    def retrieve(self, request, *args, **kwargs):
+        user = self.get_object()
+        return self.conditional_response(request, [user.id, user.updated_at],
+                                         lambda: self.get_serializer(user).data, user.updated_at)
+
+
+class UserFollowList(APIView):
+    """
+    Return user cards of followers or followees of a user, newest subscriptions first.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    direction = 'followers'
+    default_limit = 20
+    max_limit = 100
+
+    def get(self, request, pk, format=None):
+        try:
+            limit = min(int(request.GET.get('limit') or self.default_limit), self.max_limit)
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+
+        if self.direction == 'followers':
+            subscriptions, card_field = Subscription.objects.filter(followee=pk), 'follower'
+        else:
+            subscriptions, card_field = Subscription.objects.filter(follower=pk), 'followee'
+
+        cursor = request.GET.get('cursor')
+        if cursor:
+            position = decode_cursor(cursor, int)
+            if position is None:
+                return Response(status=status.HTTP_400_BAD_REQUEST)
+            subscriptions = subscriptions.filter(id__lt=position[0])
+
+        card_fields = [f'{card_field}__{field}'
+                       for field in ('id', 'first_name', 'last_name', 'avatar', 'variants')]
+        subscriptions = list(subscriptions.select_related(card_field).only('id', *card_fields)
+                             .order_by('-id')[:limit + 1])
+        next_cursor = None
+        if len(subscriptions) > limit:
+            subscriptions = subscriptions[:limit]
+            next_cursor = encode_cursor(subscriptions[-1].id)
+
+        users = [getattr(subscription, card_field) for subscription in subscriptions]
+        serializer = UserCardSerializer(users, many=True, context={'request': request})
+        return Response({'results': serializer.data, 'next_cursor': next_cursor})
+
+
+class UserCardList(ConditionalGetMixin, APIView):
+    """
+    Return first name, last name and avatar of many users at once.
+    Users are requested as comma separated `ids` query param.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    cache_control = 'private, max-age=60'
+    max_batch = 100
+
+    def get(self, request, format=None):
+        try:
+            ids = [int(user_id) for user_id in request.GET.get('ids', '').split(',') if user_id]
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        ids = list(dict.fromkeys(ids))  # drop duplicates, keep order
+        if not ids or len(ids) > self.max_batch:
+            return Response({'detail': f'provide from 1 to {self.max_batch} ids'}, status=status.HTTP_400_BAD_REQUEST)
+
+        users = User.objects.filter(id__in=ids).only('id', 'first_name', 'last_name', 'avatar', 'variants',
+                                                     'updated_at')
+        order = {user_id: i for i, user_id in enumerate(ids)}
+        users = sorted(users, key=lambda user: order[user.id])
+
+        validators = [(user.id, user.updated_at) for user in users]
+        return self.conditional_response(
+            request, validators, lambda: UserCardSerializer(users, many=True, context={'request': request}).data,
+            max((user.updated_at for user in users), default=None))
+
+
+class ViewerStatusAPI(APIView):
+    """
+    Return whether the current user liked each post and follows each user.
+    Posts and users are requested as comma separated `post_ids` and `user_ids` query params.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    max_batch = 100
+
+    def get(self, request, format=None):
+        try:
+            post_ids, user_ids = ([int(item_id) for item_id in request.GET.get(param, '').split(',') if item_id]
+                                  for param in ('post_ids', 'user_ids'))
+        except ValueError:
+            return Response(status=status.HTTP_400_BAD_REQUEST)
+        post_ids, user_ids = list(dict.fromkeys(post_ids)), list(dict.fromkeys(user_ids))
+        if not post_ids and not user_ids or len(post_ids) > self.max_batch or len(user_ids) > self.max_batch:
+            return Response({'detail': f'provide up to {self.max_batch} post_ids and user_ids'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        viewer = viewer_status(request.user.id, post_ids, user_ids)
+        return Response({'liked': {post_id: post_id in viewer.liked for post_id in post_ids},
+                         'following': {user_id: user_id in viewer.following for user_id in user_ids}})
+
+
+def serve_media(request, path, document_root=None, show_indexes=False):
+    """
+    Serve uploads from MEDIA_ROOT in development. Uploads are named by their content hash,
+    so a name never gets other content and browsers can keep it for good.
+    """
+    response = static.serve(request, path, document_root, show_indexes)
+    if response.status_code == 200:
+        patch_cache_control(response, public=True, max_age=365 * 24 * 60 * 60, immutable=True)
+    return response
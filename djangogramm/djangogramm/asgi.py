@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'djangogramm.settings')
+# serve the hot JSON endpoints with async views (see app.async_views)
+os.environ.setdefault('ASYNC_API_VIEWS', '1')
 
 application = get_asgi_application()
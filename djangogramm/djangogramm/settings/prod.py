@@ -71,7 +71,6 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.debug',
@@ -80,11 +79,22 @@ TEMPLATES = [
                 'django.contrib.messages.context_processors.messages',
                 'django.template.context_processors.media'
             ],
+            # templates are compiled once per process
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
+            ],
         },
     },
 ]
 
 WSGI_APPLICATION = 'djangogramm.wsgi.application'
+ASGI_APPLICATION = 'djangogramm.asgi.application'
+# set by asgi.py, async views of the JSON API run their ORM work in a pool of this many threads
+ASYNC_API_VIEWS = os.getenv('ASYNC_API_VIEWS') == '1'
+ASYNC_VIEW_THREADS = int(os.getenv('ASYNC_VIEW_THREADS', 8))
 
 
 # Database
@@ -102,6 +112,18 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+# shared by all worker processes, rendered fragments are keyed by objects' `updated_at`
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', BASE_DIR / 'cache'),
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
 
@@ -149,6 +171,12 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'app.User'
 
+# session's user is served from cache, see app.backends.CachedModelBackend
+AUTHENTICATION_BACKENDS = ['app.backends.CachedModelBackend']
+# cache has to be shared by all worker processes, otherwise other workers keep stale users
+AUTH_USER_CACHE = 'default'
+AUTH_USER_CACHE_TIMEOUT = 300
+
 EMAIL_USE_TLS = True
 EMAIL_HOST = os.getenv("EMAIL_HOST")
 EMAIL_HOST_USER = os.getenv("DJANGOGRAMM_EMAIL")
@@ -157,6 +185,23 @@ EMAIL_PORT = os.getenv("EMAIL_PORT")
 
 MEDIA_ROOT = BASE_DIR / 'media'
 MEDIA_URL = '/media/'
-
-
-
+# uploads wait here until the process_media command publishes them
+MEDIA_STAGING_ROOT = os.getenv('MEDIA_STAGING_ROOT', BASE_DIR / 'media_staging')
+# processes resizing uploaded images into variants, defaults to the number of CPUs
+IMAGE_PROCESS_WORKERS = int(os.getenv('IMAGE_PROCESS_WORKERS', 0)) or None
+# storage of avatars and post images, app.storage.FileSystemMediaStorage keeps them under MEDIA_ROOT,
+# e.g. for offline load tests (point EMPTY_USER_IMAGE to a file under MEDIA_ROOT then)
+MEDIA_STORAGE = os.getenv('MEDIA_STORAGE', 'app.storage.CloudinaryStorage')
+MEDIA_STORAGE_OPTIONS = {'proxy': os.getenv('CLOUDINARY_PROXY', 'http://proxy.server:3128')} \
+    if MEDIA_STORAGE == 'app.storage.CloudinaryStorage' else {}
+
+# buffer likes and apply them in batches with the flush_likes command, for viral posts
+LIKE_BUFFER = os.getenv('LIKE_BUFFER') == '1'
+
+# Feed
+# accounts with at least this many followers are pulled at read time instead of fanned out on write
+FEED_FANOUT_FOLLOWER_THRESHOLD = 10000
+
+# Explore
+# seconds the number of explorable profiles is cached for, instead of counting them on every page
+EXPLORE_COUNT_CACHE_TIMEOUT = 300